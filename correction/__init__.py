@@ -1,9 +1,17 @@
-import importlib.metadata
-from .core.corrector import Corrector
-
 __all__ = ["Corrector"]
 
-try:
-    __version__ = importlib.metadata.version(__package__)
-except importlib.metadata.PackageNotFoundError:
-    __version__ = "dev"
+
+def __getattr__(name: str):
+    # Imported on first use, so that importing the package (e.g., only for the settings) does not load pandas
+    if name == "Corrector":
+        from .core.corrector import Corrector
+
+        return Corrector
+    if name == "__version__":
+        import importlib.metadata
+
+        try:
+            return importlib.metadata.version(__package__)
+        except importlib.metadata.PackageNotFoundError:
+            return "dev"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
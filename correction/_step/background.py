@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class BackgroundTasks:
+    """Runs tasks on a bounded pool of background threads.
+
+    Submitting a task blocks while there are too many pending ones (backpressure). Use `flush` to wait for all of
+    them to finish, which raises the first error found (if any).
+
+    Args:
+        workers: Number of background threads
+        max_pending: Maximum number of submitted tasks that have not finished yet
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="correction")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()  # Tasks can be submitted and flushed from different threads
+
+    def submit(self, function: Callable, *args, **kwargs):
+        """Schedules the function to be called with the given arguments, waiting for a free slot if needed"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.append(future)
+
+    def flush(self):
+        """Waits for all submitted tasks to finish. Raises the first error found (after all have finished)"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        errors = [future.exception() for future in pending]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def shutdown(self):
+        """Waits for all submitted tasks and stops the background threads"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from apf.consumers import GenericConsumer, KafkaConsumer
+from confluent_kafka import KafkaException, TopicPartition
+
+from ..core.columns import DetectionColumns
+from ..core.corrector import Corrector
+from .encoding import decode_containers
+
+
+class OffsetKafkaConsumer(KafkaConsumer):
+    """Kafka consumer that can commit the offsets of a given batch, instead of the current position.
+
+    Uses the same configuration as `apf.consumers.KafkaConsumer`.
+    """
+
+    def offsets(self) -> list[TopicPartition]:
+        """Offsets to commit after processing the last consumed batch (next offset for each partition)"""
+        offsets = {}
+        for message in self.messages:
+            if not message.error():
+                key = (message.topic(), message.partition())
+                offsets[key] = max(offsets.get(key, -1), message.offset() + 1)
+        return [TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()]
+
+    def commit_offsets(self, offsets: list[TopicPartition]):
+        """Commits the given offsets, retrying up to `max_retries` times"""
+        for retry in range(1, self.max_retries + 1):
+            try:
+                return self.consumer.commit(offsets=offsets, asynchronous=False)
+            except KafkaException:
+                if retry == self.max_retries:
+                    raise
+
+
+def decode_columns(payloads: Iterable[bytes]) -> dict:
+    """Decodes a batch of Avro messages (one alert per message), with the detections straight into columns.
+
+    The detections are never built as mappings (see `decode_containers`). Detections are unique by `candid` and
+    non-detections by `oid`, `fid` and `mjd` (see `DetectionColumns` and `CorrectionStep.pre_execute`).
+
+    Args:
+        payloads: Avro encoded messages (as containers with their own schema)
+
+    Returns:
+        dict: Batch with `detections` (as `DetectionColumns`), `non_detections`, the number of non-detections
+            before removing duplicates (`n_non_detections`) and the number of messages (`n_messages`)
+    """
+    payloads = list(payloads)
+    messages, columns = decode_containers(payloads, "detections")
+    detections = DetectionColumns(Corrector._EXTRA_FIELDS)
+    if columns:
+        detections.extend(columns)
+    non_detections, keys, total = [], set(), 0
+    for message in messages:
+        total += len(message["non_detections"])
+        for non_detection in message["non_detections"]:
+            key = (non_detection["oid"], non_detection["fid"], non_detection["mjd"])
+            if key not in keys:
+                keys.add(key)
+                non_detections.append(non_detection)
+    return {
+        "detections": detections,
+        "non_detections": non_detections,
+        "n_non_detections": total,
+        "n_messages": len(payloads),
+    }
+
+
+class ColumnarKafkaConsumer(OffsetKafkaConsumer):
+    """Kafka consumer that yields each batch already decoded into columns (see `decode_columns`).
+
+    Uses the same configuration as `apf.consumers.KafkaConsumer`. Each batch is yielded as a single mapping, with the
+    number of messages in it (`n_messages`), which the step reports in place of one message per batch.
+    """
+
+    def consume(self, num_messages: int = 1, timeout: int = 60):
+        num_messages, timeout = self.set_basic_config(num_messages, timeout)
+        while True:
+            if self.dynamic_topic and self._check_topics():
+                self._subscribe_to_new_topics()
+
+            messages = self.consumer.consume(num_messages=num_messages, timeout=timeout)
+            if len(messages) == 0:
+                continue
+
+            payloads = []
+            for message in messages:
+                if message.error():
+                    if message.error().name() == "_PARTITION_EOF":
+                        self.logger.info("PARTITION_EOF: No more messages")
+                        return
+                    self.logger.exception(f"Error in kafka stream: {message.error()}")
+                    continue
+                payloads.append(message.value())
+
+            self.messages = messages
+            if payloads:
+                yield decode_columns(payloads)
+
+
+class MemoryConsumer(GenericConsumer):
+    """Consumer that yields the batches (lists of messages) given in `MESSAGES`, e.g., to run the step locally.
+
+    The offset of each batch is its position in the list plus one. Committed offsets are kept in `committed`.
+    """
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        self.messages = config["MESSAGES"]
+        self.committed = []
+        self._position = 0
+
+    def consume(self):
+        for position, batch in enumerate(self.messages, 1):
+            self._position = position
+            yield batch
+
+    def offsets(self) -> int:
+        return self._position
+
+    def commit_offsets(self, offsets: int):
+        self.committed.append(offsets)
+
+    def commit(self):
+        self.commit_offsets(self.offsets())
@@ -0,0 +1,558 @@
+from __future__ import annotations
+
+import functools
+import io
+import json
+import struct
+import zlib
+from typing import Callable, Iterable
+
+import fastavro
+import numpy as np
+from fastavro.validation import validate
+
+_MISSING = object()
+_INT_RANGE = (-(2**31), 2**31)
+_LONG_RANGE = (-(2**63), 2**63)
+
+
+@functools.lru_cache(maxsize=4096)
+def _long(value: int) -> bytes:
+    """Variable length zig-zag encoding (used for `int`, `long`, lengths and union indices)"""
+    datum = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while datum & ~0x7F:
+        out.append((datum & 0x7F) | 0x80)
+        datum >>= 7
+    out.append(datum)
+    return bytes(out)
+
+
+def _longs(values: list) -> list[bytes]:
+    return [_long(value) for value in values]
+
+
+def _strings(values: list) -> list[bytes]:
+    # Encoded once for each distinct value, as most repeat (e.g., the keys of maps or the surveys)
+    encoded = {value: _long(len(data)) + data for value, data in ((value, value.encode()) for value in set(values))}
+    return [encoded[value] for value in values]
+
+
+def _bytes(values: list) -> list[bytes]:
+    return [_long(len(value)) + value for value in values]
+
+
+def _booleans(values: list) -> list[bytes]:
+    return [b"\x01" if value else b"\x00" for value in values]
+
+
+def _nulls(values: list) -> list[bytes]:
+    return [b""] * len(values)
+
+
+def _fixed_width(dtype: str) -> Callable[[list], list[bytes]]:
+    width = np.dtype(dtype).itemsize
+
+    def encode(values: list) -> list[bytes]:
+        if None in values:  # NumPy would take it as NaN
+            raise TypeError("float() argument must be a string or a real number, not 'NoneType'")
+        data = np.array(values, dtype=dtype).tobytes()
+        return [data[start : start + width] for start in range(0, len(data), width)]
+
+    return encode
+
+
+_PRIMITIVES = {
+    "null": _nulls,
+    "boolean": _booleans,
+    "int": _longs,
+    "long": _longs,
+    "float": _fixed_width("<f4"),
+    "double": _fixed_width("<f8"),
+    "bytes": _bytes,
+    "string": _strings,
+}
+
+
+def _type_name(schema) -> str:
+    return schema if isinstance(schema, str) else schema["type"]
+
+
+def _type_key(value):
+    """Values with the same key always go to the same branch of a union of primitive types"""
+    if type(value) is int:
+        return int, _INT_RANGE[0] <= value < _INT_RANGE[1], _LONG_RANGE[0] <= value < _LONG_RANGE[1]
+    return type(value)
+
+
+class AvroEncoder:
+    """Avro encoder for many records at once, going over the values of each field together.
+
+    The schema is compiled once into encoders for whole columns of values (e.g., all the `mag` of the detections of
+    every record in a batch), so that fixed width numbers are packed together with `numpy`. The output is the same as
+    the one from `fastavro` (with `fastavro.writer` for containers), which also raises `TypeError` for `None` in fields
+    that cannot be null. Only the primitive types, records, arrays, maps and unions are supported.
+
+    Args:
+        schema: Avro schema of the records
+
+    Raises:
+        NotImplementedError: If the schema has unsupported types (e.g., enums or logical types)
+    """
+
+    def __init__(self, schema: dict):
+        self.schema = fastavro.parse_schema(schema)
+        self._named = {}
+        self._encode = self._compile(self.schema)
+        # Containers with a single record are the header, a block with the record and the sync marker of the header
+        out = io.BytesIO()
+        fastavro.writer(out, self.schema, [])
+        self._header = out.getvalue()
+        self._sync = self._header[-16:]
+
+    def _compile(self, schema) -> Callable[[list], list[bytes]]:
+        if isinstance(schema, list):
+            return self._union(schema)
+        if isinstance(schema, str) and schema not in _PRIMITIVES:
+            return lambda values: self._named[schema](values)  # Resolved on use, as types can be recursive
+        if isinstance(schema, dict) and "logicalType" in schema:
+            raise NotImplementedError(f"Logical type {schema['logicalType']} is not supported")
+
+        name = _type_name(schema)
+        if name in _PRIMITIVES:
+            return _PRIMITIVES[name]
+        if name == "record":
+            return self._record(schema)
+        if name == "array":
+            return self._array(schema)
+        if name == "map":
+            return self._map(schema)
+        raise NotImplementedError(f"Type {name} is not supported")
+
+    def _record(self, schema: dict) -> Callable[[list], list[bytes]]:
+        fields = []
+
+        def encode(values: list) -> list[bytes]:
+            columns = []
+            for name, default, encoder in fields:
+                if default is _MISSING:
+                    try:
+                        column = [value[name] for value in values]
+                    except KeyError:
+                        raise ValueError(f"no value and no default for {name}")
+                else:
+                    column = [value.get(name, default) for value in values]
+                columns.append(encoder(column))
+            return [b"".join(row) for row in zip(*columns)]
+
+        self._named[schema["name"]] = encode  # Registered before the fields, which can refer to it
+        for field in schema["fields"]:
+            fields.append((field["name"], field.get("default", _MISSING), self._compile(field["type"])))
+        return encode
+
+    def _array(self, schema: dict) -> Callable[[list], list[bytes]]:
+        items = self._compile(schema["items"])
+
+        def encode(values: list) -> list[bytes]:
+            encoded, start, output = items([item for value in values for item in value]), 0, []
+            for value in values:
+                if value:
+                    output.append(_long(len(value)) + b"".join(encoded[start : start + len(value)]) + b"\x00")
+                    start += len(value)
+                else:
+                    output.append(b"\x00")
+            return output
+
+        return encode
+
+    def _map(self, schema: dict) -> Callable[[list], list[bytes]]:
+        items = self._compile(schema["values"])
+
+        def encode(values: list) -> list[bytes]:
+            keys = _strings([key for value in values for key in value])
+            encoded, start, output = items([item for value in values for item in value.values()]), 0, []
+            for value in values:
+                if value:
+                    end = start + len(value)
+                    pairs = b"".join(map(bytes.__add__, keys[start:end], encoded[start:end]))
+                    output.append(_long(len(value)) + pairs + b"\x00")
+                    start = end
+                else:
+                    output.append(b"\x00")
+            return output
+
+        return encode
+
+    def _union(self, schema: list) -> Callable[[list], list[bytes]]:
+        encoders = [self._compile(branch) for branch in schema]
+        names = [_type_name(branch) for branch in schema]
+
+        if len(schema) == 2 and "null" in names:  # Optional values, of any type
+            null = names.index("null")
+            prefix, null_prefix, encoder = _long(1 - null), _long(null), encoders[1 - null]
+
+            def encode(values: list) -> list[bytes]:
+                encoded = iter(encoder([value for value in values if value is not None]))
+                return [null_prefix if value is None else prefix + next(encoded) for value in values]
+
+            return encode
+
+        if any(name not in _PRIMITIVES for name in names):
+            raise NotImplementedError("Unions of complex types are only supported with null")
+        branches = {}  # Index of the branch for each type of values (see `_type_key`)
+
+        def branch(value) -> int:
+            # Same choice as fastavro: the first branch that is valid for the value, but `double` over `float`
+            key, best = _type_key(value), -1
+            if key not in branches:
+                for index, name in enumerate(names):
+                    if best >= 0 and name == "double":
+                        best = index
+                        break
+                    if best < 0 and validate(value, name, raise_errors=False):
+                        best = index
+                        if name != "float":
+                            break
+                if best < 0:
+                    raise ValueError(f"{value!r} (type {type(value)}) do not match {schema}")
+                branches[key] = best
+            return branches[key]
+
+        def encode(values: list) -> list[bytes]:
+            indices = [branches[type(value)] if type(value) in branches else branch(value) for value in values]
+            output = [b""] * len(values)
+            for index in set(indices):
+                positions = [position for position, value_index in enumerate(indices) if value_index == index]
+                prefix = _long(index)
+                encoded = encoders[index]([values[position] for position in positions])
+                for position, value in zip(positions, encoded):
+                    output[position] = prefix + value
+            return output
+
+        return encode
+
+    def encode(self, records: list[dict]) -> list[bytes]:
+        """Encodes each record on its own (without schema), as `fastavro.schemaless_writer` does
+
+        Args:
+            records: Records matching the schema
+
+        Returns:
+            list[bytes]: Encoded records, in the same order
+        """
+        return self._encode(records)
+
+    def encode_containers(self, records: list[dict]) -> list[bytes]:
+        """Encodes each record in a container of its own (with schema), as `fastavro.writer` does
+
+        Args:
+            records: Records matching the schema
+
+        Returns:
+            list[bytes]: Encoded containers, in the same order
+        """
+        return [self._header + b"\x02" + _long(len(data)) + data + self._sync for data in self._encode(records)]
+
+
+def _read_long(data: bytes, pos: int) -> tuple[int, int]:
+    """Reads a variable length zig-zag encoded value (see `_long`). Returns the value and the next position"""
+    byte = data[pos]
+    if byte < 0x80:  # Most values (e.g., lengths and union indices) take a single byte
+        return (byte >> 1) ^ -(byte & 1), pos + 1
+    value, shift = byte & 0x7F, 7
+    while byte & 0x80:
+        pos += 1
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos + 1
+
+
+def _read_string(data: bytes, pos: int) -> tuple[str, int]:
+    size = data[pos]
+    if size < 0x80:  # Lengths are never negative, so this is twice the length
+        size, pos = size >> 1, pos + 1
+    else:
+        size, pos = _read_long(data, pos)
+    return data[pos : pos + size].decode(), pos + size
+
+
+def _read_bytes(data: bytes, pos: int) -> tuple[bytes, int]:
+    size, pos = _read_long(data, pos)
+    return data[pos : pos + size], pos + size
+
+
+def _read_boolean(data: bytes, pos: int) -> tuple[bool, int]:
+    return data[pos] == 1, pos + 1
+
+
+def _read_null(data: bytes, pos: int) -> tuple[None, int]:
+    return None, pos
+
+
+def _read_fixed_width(fmt: str) -> Callable[[bytes, int], tuple[float, int]]:
+    unpack, width = struct.Struct(fmt).unpack_from, struct.calcsize(fmt)
+
+    def read(data: bytes, pos: int) -> tuple[float, int]:
+        return unpack(data, pos)[0], pos + width
+
+    return read
+
+
+_READERS = {
+    "null": _read_null,
+    "boolean": _read_boolean,
+    "int": _read_long,
+    "long": _read_long,
+    "float": _read_fixed_width("<f"),
+    "double": _read_fixed_width("<d"),
+    "bytes": _read_bytes,
+    "string": _read_string,
+}
+_STRUCT_FORMATS = {"boolean": "?", "float": "f", "double": "d"}  # Fixed width types that can be read together
+
+
+class AvroDecoder:
+    """Avro decoder for many records at once, with the items of one of their fields straight into columns.
+
+    The mirror of `AvroEncoder`. The schema is compiled once into readers, and the items of the `columns` field (an
+    array of records) are never built as mappings: each of their fields is appended to a column of its own, with the
+    values of every item of every decoded record. Consecutive fixed width fields of those items (e.g., `mjd` and `ra`)
+    are unpacked together with `struct`. Values are the same as the ones from `fastavro`. Only the primitive types,
+    records, arrays, maps and unions are supported.
+
+    Args:
+        schema: Avro schema of the records (as written)
+        columns: Name of the field of the records (an array of records) decoded into columns
+
+    Raises:
+        NotImplementedError: If the schema has unsupported types (e.g., enums or logical types)
+        ValueError: If the schema is not a record with the `columns` field as an array of records
+    """
+
+    def __init__(self, schema: dict, columns: str):
+        self.schema = fastavro.parse_schema(schema)
+        self._named, self._schemas = {}, {}
+        if not isinstance(self.schema, dict) or self.schema["type"] != "record":
+            raise ValueError("Schema must be a record")
+        self._schemas[self.schema["name"]] = self.schema
+        self._fields = [(field["name"], self._compile(field["type"])) for field in self.schema["fields"]]
+
+        array = self._resolve(next((f["type"] for f in self.schema["fields"] if f["name"] == columns), None))
+        items = self._resolve(array["items"]) if isinstance(array, dict) and array["type"] == "array" else None
+        if not isinstance(items, dict) or items["type"] != "record":
+            raise ValueError(f"Field {columns} must be an array of records")
+        self.fields = [field["name"] for field in items["fields"]]  # Names of the columns, in order
+        self._read_items = self._items_into_columns(items)
+        self._fields = [(name, None if name == columns else read) for name, read in self._fields]
+
+    def _resolve(self, schema):
+        """Definition of named types (other schemas are returned as they are)"""
+        return self._schemas.get(schema, schema) if isinstance(schema, str) else schema
+
+    def _compile(self, schema) -> Callable[[bytes, int], tuple]:
+        if isinstance(schema, list):
+            return self._union(schema)
+        if isinstance(schema, str) and schema not in _READERS:
+            return lambda data, pos: self._named[schema](data, pos)  # Resolved on use, as types can be recursive
+        if isinstance(schema, dict) and "logicalType" in schema:
+            raise NotImplementedError(f"Logical type {schema['logicalType']} is not supported")
+
+        name = _type_name(schema)
+        if name in _READERS:
+            return _READERS[name]
+        if name == "record":
+            return self._record(schema)
+        if name == "array":
+            return self._array(schema)
+        if name == "map":
+            return self._map(schema)
+        raise NotImplementedError(f"Type {name} is not supported")
+
+    def _record(self, schema: dict) -> Callable[[bytes, int], tuple[dict, int]]:
+        fields = []
+
+        def read(data: bytes, pos: int) -> tuple[dict, int]:
+            record = {}
+            for name, reader in fields:
+                record[name], pos = reader(data, pos)
+            return record, pos
+
+        self._named[schema["name"]], self._schemas[schema["name"]] = read, schema  # Fields can refer to it
+        fields.extend((field["name"], self._compile(field["type"])) for field in schema["fields"])
+        return read
+
+    @staticmethod
+    def _blocks(data: bytes, pos: int, read_item: Callable[[bytes, int], int]) -> int:
+        """Calls `read_item` (which returns the next position) for each item of an array or map"""
+        count, pos = _read_long(data, pos)
+        while count:
+            if count < 0:  # Followed by the size of the block in bytes
+                count = -count
+                _, pos = _read_long(data, pos)
+            for _ in range(count):
+                pos = read_item(data, pos)
+            count, pos = _read_long(data, pos)
+        return pos
+
+    def _array(self, schema: dict) -> Callable[[bytes, int], tuple[list, int]]:
+        items = self._compile(schema["items"])
+
+        def read(data: bytes, pos: int) -> tuple[list, int]:
+            output = []
+            count, pos = _read_long(data, pos)
+            while count:
+                if count < 0:  # Followed by the size of the block in bytes
+                    count = -count
+                    _, pos = _read_long(data, pos)
+                for _ in range(count):
+                    value, pos = items(data, pos)
+                    output.append(value)
+                count, pos = _read_long(data, pos)
+            return output, pos
+
+        return read
+
+    def _map(self, schema: dict) -> Callable[[bytes, int], tuple[dict, int]]:
+        values = self._compile(schema["values"])
+
+        def read(data: bytes, pos: int) -> tuple[dict, int]:
+            output = {}
+            count, pos = _read_long(data, pos)
+            while count:
+                if count < 0:  # Followed by the size of the block in bytes
+                    count = -count
+                    _, pos = _read_long(data, pos)
+                for _ in range(count):
+                    key, pos = _read_string(data, pos)
+                    output[key], pos = values(data, pos)
+                count, pos = _read_long(data, pos)
+            return output, pos
+
+        return read
+
+    def _union(self, schema: list) -> Callable[[bytes, int], tuple]:
+        readers = [self._compile(branch) for branch in schema]
+
+        def read(data: bytes, pos: int) -> tuple:
+            index = data[pos]
+            if index < 0x80:  # Indices are never negative, so this is twice the index
+                return readers[index >> 1](data, pos + 1)
+            index, pos = _read_long(data, pos)
+            return readers[index](data, pos)
+
+        return read
+
+    def _items_into_columns(self, schema: dict) -> Callable[[bytes, int, list], int]:
+        """Reader that appends the fields of a record to the given columns (as their `append` methods)"""
+        steps = []  # Reader, width (`None` if variable) and first column of each group of fields
+        fields = [field["type"] for field in schema["fields"]]
+        for column, field in enumerate(fields):
+            fixed = isinstance(field, str) and field in _STRUCT_FORMATS
+            if fixed and steps and steps[-1][1] is not None and steps[-1][2] + len(steps[-1][3]) == column:
+                steps[-1][3].append(field)  # Consecutive fixed width fields are unpacked together
+            else:
+                steps.append([self._compile(field), 0 if fixed else None, column, [field]])
+        for step in steps:
+            if step[1] is not None:
+                unpack = struct.Struct("<" + "".join(_STRUCT_FORMATS[field] for field in step[3]))
+                step[:2] = unpack.unpack_from, unpack.size
+            step[3] = len(step[3])
+        steps = [tuple(step) for step in steps]
+
+        def read(data: bytes, pos: int, appends: list) -> int:
+            for reader, width, column, size in steps:
+                if width is None:
+                    value, pos = reader(data, pos)
+                    appends[column](value)
+                else:
+                    for append, value in zip(appends[column : column + size], reader(data, pos)):
+                        append(value)
+                    pos += width
+            return pos
+
+        return read
+
+    def decode(self, data: bytes, pos: int, columns: list[list]) -> tuple[dict, int]:
+        """Decodes a record (without schema), as `fastavro.schemaless_reader` does, but with the items of the
+        `columns` field appended to the given columns
+
+        Args:
+            data: Encoded records
+            pos: Position of the record in `data`
+            columns: Where to append the values of each field of the items, in the order of `fields`
+
+        Returns:
+            tuple: Record without the `columns` field, and the position after it
+        """
+        appends, record = [column.append for column in columns], {}
+        for name, reader in self._fields:
+            if reader is None:
+                pos = self._blocks(data, pos, lambda data, pos: self._read_items(data, pos, appends))
+            else:
+                record[name], pos = reader(data, pos)
+        return record, pos
+
+
+@functools.lru_cache(maxsize=16)
+def _decoder(schema: str, columns: str) -> AvroDecoder:
+    """Decoder for each schema found in the headers of containers"""
+    return AvroDecoder(json.loads(schema), columns)
+
+
+def decode_containers(payloads: Iterable[bytes], columns: str) -> tuple[list[dict], dict[str, list]]:
+    """Decodes the records of many containers (with their own schema), as `fastavro.reader` does, but with the items
+    of the `columns` field of every record straight into columns (see `AvroDecoder`).
+
+    Decoders are compiled once for each schema. Columns missing from the schema of some containers are filled with
+    `None`. Only the `null` and `deflate` codecs are supported.
+
+    Args:
+        payloads: Avro containers (e.g., one for each message)
+        columns: Name of the field of the records (an array of records) decoded into columns
+
+    Returns:
+        tuple: Records without the `columns` field, and mapping from the name of each field of the items to its values
+
+    Raises:
+        NotImplementedError: If a container has an unsupported codec or schema (see `AvroDecoder`)
+    """
+    records, output, size = [], {}, 0
+    for data in payloads:
+        if data[:4] != b"Obj\x01":
+            raise ValueError("Not an Avro container")
+        metadata, pos = {}, 4
+
+        def read_item(data: bytes, pos: int) -> int:
+            key, pos = _read_string(data, pos)
+            metadata[key], pos = _read_bytes(data, pos)
+            return pos
+
+        pos = AvroDecoder._blocks(data, pos, read_item)
+        sync, pos = data[pos : pos + 16], pos + 16
+        codec = metadata.get("avro.codec", b"null").decode()
+        if codec not in ("null", "deflate"):
+            raise NotImplementedError(f"Codec {codec} is not supported")
+
+        decoder = _decoder(metadata["avro.schema"].decode(), columns)
+        for name in decoder.fields:
+            if name not in output:
+                output[name] = [None] * size
+        targets = [output[name] for name in decoder.fields]
+        while pos < len(data):
+            count, pos = _read_long(data, pos)
+            length, pos = _read_long(data, pos)
+            block, start, pos = data, pos, pos + length
+            if codec == "deflate":
+                block, start = zlib.decompress(data[start:pos], -15), 0
+            for _ in range(count):
+                record, start = decoder.decode(block, start, targets)
+                records.append(record)
+            if data[pos : pos + 16] != sync:
+                raise ValueError("Sync marker does not match")
+            pos += 16
+        size = len(targets[0]) if targets else size
+        if len(output) > len(targets):
+            for column in output.values():
+                column.extend([None] * (size - len(column)))
+    return records, output
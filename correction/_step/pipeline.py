@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import queue
+import threading
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .step import CorrectionStep
+
+_DONE = object()  # Marks the end of the stream between stages
+
+
+class PipelinedRunner:
+    """Runs a step with its stages overlapped: consuming, correcting and producing are done in separate threads.
+
+    Up to `max_in_flight` batches can wait between consecutive stages, so (besides the batches being processed) at
+    most `2 * max_in_flight` batches are held in memory. Offsets are committed in order, for each batch, only after
+    both of its outputs are delivered.
+
+    The consumer must provide `offsets` (the offsets to commit for the last consumed batch) and `commit_offsets`.
+
+    Args:
+        step: Step to run
+        max_in_flight: Maximum number of batches waiting between stages
+    """
+
+    def __init__(self, step: CorrectionStep, max_in_flight: int = 1):
+        self.step = step
+        self.logger = logging.getLogger(f"alerce.{self.__class__.__name__}")
+        self._consumed = queue.Queue(maxsize=max_in_flight)
+        self._executed = queue.Queue(maxsize=max_in_flight)
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _put(self, target: queue.Queue, item: Any):
+        """Puts the item in the queue, waiting for a free slot unless the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                return target.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+
+    def _get(self, source: queue.Queue) -> Any:
+        """Gets the next item from the queue, or the end of the stream if the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, function: Callable):
+        """Runs the function, stopping the whole pipeline if it fails"""
+        try:
+            function()
+        except BaseException as error:
+            self._errors.append(error)
+            self._stop.set()
+
+    def _consume(self):
+        for message in self.step.consumer.consume():
+            self._put(self._consumed, (message, self.step.consumer.offsets()))
+            if self._stop.is_set():
+                return
+        self._put(self._consumed, _DONE)
+
+    def _execute(self):
+        while (item := self._get(self._consumed)) is not _DONE:
+            message, offsets = item
+            received = datetime.datetime.now(datetime.timezone.utc)
+            messages = [message] if isinstance(message, dict) else message
+            n_messages = self.step._count_messages(messages)
+            self.step.prometheus_metrics.consumed_messages.observe(n_messages)
+            result = self.step.post_execute(self.step.execute(self.step.pre_execute(messages)))
+            metrics = {**self.step.metrics, "timestamp_received": received}
+            if self.step.extra_metrics:
+                metrics.update(self.step.get_extra_metrics(messages))
+            self._put(self._executed, (self.step.pre_produce(result), offsets, n_messages, metrics))
+        self._put(self._executed, _DONE)
+
+    def _produce(self):
+        while (item := self._get(self._executed)) is not _DONE:
+            result, offsets, n_messages, metrics = item
+            self.step.produce(result)
+            self.step.flush_outputs()
+            if self.step.commit or self.step.commit_after_produce:
+                self.step.consumer.commit_offsets(offsets)
+            metrics["timestamp_sent"] = datetime.datetime.now(datetime.timezone.utc)
+            metrics["execution_time"] = (metrics["timestamp_sent"] - metrics["timestamp_received"]).total_seconds()
+            self.step.send_metrics(**metrics)
+            self.step.prometheus_metrics.processed_messages.observe(n_messages)
+            self.step.prometheus_metrics.execution_time.observe(metrics["execution_time"])
+
+    def run(self):
+        """Runs the step until the consumer stops. Raises the first error from any stage, after tearing down the step"""
+        self.logger.info("Running step with pipelined stages")
+        self.step._pre_consume()
+        # The consumer can be waiting for messages indefinitely, so it is not waited for if there is an error
+        consumer = threading.Thread(target=self._stage, args=(self._consume,), name="correction-consume", daemon=True)
+        executor = threading.Thread(target=self._stage, args=(self._execute,), name="correction-execute")
+        consumer.start()
+        executor.start()
+        try:
+            self._stage(self._produce)
+            self._stop.set()  # In case the producer stage stopped first
+            executor.join()
+            if self._errors:
+                raise self._errors[0]
+            consumer.join()
+        except BaseException:
+            self.step.tear_down()  # Stops the workers, threads and observer, without marking the run as successful
+            raise
+        self.step._tear_down()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+
+from apf.producers import GenericProducer, KafkaProducer
+
+from .encoding import AvroEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_dumps(data) -> str:
+    return orjson.dumps(data).decode()
+
+
+# Fast JSON encoder if available (note that `orjson` writes `NaN` and infinite values as `null`)
+dumps = json.dumps if orjson is None else _orjson_dumps
+
+
+class BatchKafkaProducer(KafkaProducer):
+    """Kafka producer that can send many messages together.
+
+    Uses the same configuration as `apf.producers.KafkaProducer`. Each message is still sent on its own, so
+    consumers are unaffected, but the delivery queue is polled once per batch instead of once per message. The whole
+    batch is serialized together with `AvroEncoder`, unless the schema is not supported by it.
+    """
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        try:
+            self.encoder = AvroEncoder(self.schema)
+        except NotImplementedError:
+            self.encoder = None  # Each message is serialized on its own with fastavro
+
+    def produce_batch(self, messages: list[dict], **kwargs):
+        """Produces all messages to the topic.
+
+        Args:
+            messages: Values of the messages to be produced. Should match the schema in `config["SCHEMA"]`
+            **kwargs: Passed to the produce method of the underlying producer
+        """
+        if self.dynamic_topic:
+            self.topic = self.topic_strategy.get_topics()
+        values = (
+            map(self._serialize_message, messages) if self.encoder is None else self.encoder.encode_containers(messages)
+        )
+        for message, value in zip(messages, values):
+            key = message[self.key_field] if self.key_field else None
+            for topic in self.topic:
+                try:
+                    self.producer.produce(topic, value=value, key=key, **kwargs)
+                except BufferError as e:
+                    self.logger.info(f"Error producing message: {e}")
+                    self.logger.info("Calling flush to empty queue and producing again")
+                    self.producer.flush()
+                    self.producer.produce(topic, value=value, key=key, **kwargs)
+        self.producer.poll(0)
+
+    def flush(self, timeout: float | None = None):
+        """Waits for all produced messages to be delivered
+
+        Args:
+            timeout: Maximum time to wait in seconds (no limit if not given)
+
+        Raises:
+            RuntimeError: If some messages were not delivered before the timeout
+        """
+        remaining = self.producer.flush() if timeout is None else self.producer.flush(timeout)
+        if remaining:
+            raise RuntimeError(f"{remaining} messages were not delivered")
+
+
+class MemoryProducer(GenericProducer):
+    """Producer that keeps the messages in memory (in `messages`), e.g., to run the step locally"""
+
+    def __init__(self, config: dict | None = None):
+        super().__init__(config)
+        self.messages = []
+
+    def produce(self, message=None, **kwargs):
+        self.messages.append(message)
+
+    def produce_batch(self, messages: list[dict], **kwargs):
+        self.messages.extend(messages)
+
+    def flush(self):
+        pass
@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 
@@ -5,15 +6,20 @@ from fastavro import schema
 
 SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
 
+# Schemas are loaded (and parsed) only once per process. They are shared, so they should not be modified
 
+
+@functools.lru_cache(maxsize=None)
 def get_output_schema() -> dict:
     return schema.load_schema(os.path.join(SCHEMA_DIR, "output.avsc"))
 
 
+@functools.lru_cache(maxsize=None)
 def get_scribe_schema() -> dict:
     return schema.load_schema(os.path.join(SCHEMA_DIR, "scribe.avsc"))
 
 
+@functools.lru_cache(maxsize=None)
 def get_metrics_schema() -> dict:
     path = os.path.join(SCHEMA_DIR, "metrics.json")
     with open(path, "r") as fh:
@@ -41,7 +47,7 @@ def settings_creator():
     }
 
     producer_config = {
-        "CLASS": "apf.producers.KafkaProducer",
+        "CLASS": "correction._step.producers.BatchKafkaProducer",
         "PARAMS": {
             "bootstrap.servers": os.environ["PRODUCER_SERVER"],
         },
@@ -50,7 +56,7 @@ def settings_creator():
     }
 
     scribe_producer_config = {
-        "CLASS": "apf.producers.KafkaProducer",
+        "CLASS": "correction._step.producers.BatchKafkaProducer",
         "PARAMS": {
             "bootstrap.servers": os.environ["SCRIBE_SERVER"],
         },
@@ -70,6 +76,59 @@ def settings_creator():
         },
     }
 
+    # Number of worker processes for the corrections (the detections are split in shards by AID)
+    execution_shards = int(os.getenv("EXECUTION_SHARDS", 1))
+
+    # Optional pipelined execution (consuming, correcting and producing batches at the same time)
+    pipeline_config = None
+    if bool(os.getenv("USE_PIPELINE")):
+        consumer_config["CLASS"] = "correction._step.consumers.OffsetKafkaConsumer"
+        pipeline_config = {"MAX_IN_FLIGHT": int(os.getenv("PIPELINE_MAX_IN_FLIGHT", 1))}
+
+    # Optional decoding of each batch straight into columns (supports the pipelined execution as well)
+    if bool(os.getenv("USE_COLUMNAR")):
+        consumer_config["CLASS"] = "correction._step.consumers.ColumnarKafkaConsumer"
+
+    # Optional timings of each phase of the step (as Prometheus metrics and/or pyroscope tags)
+    timings_config = None
+    if bool(os.getenv("USE_TIMINGS")):
+        timings_config = {"PROMETHEUS": prometheus, "PYROSCOPE": bool(os.getenv("USE_PROFILING", True))}
+
+    # Optional background production of the scribe messages
+    scribe_background_config = None
+    if int(os.getenv("SCRIBE_BACKGROUND_WORKERS", 0)):
+        scribe_background_config = {
+            "WORKERS": int(os.getenv("SCRIBE_BACKGROUND_WORKERS")),
+            "MAX_PENDING": int(os.getenv("SCRIBE_BACKGROUND_MAX_PENDING", 8)),
+            "CHUNK_SIZE": int(os.getenv("SCRIBE_BACKGROUND_CHUNK_SIZE", 1000)),
+        }
+
+    # Optional store to keep the mean coordinates of each AID across batches
+    coordinates_store_config = None
+    if os.getenv("COORDINATES_STORE") == "memory":
+        coordinates_store_config = {
+            "CLASS": "correction.core.accumulator.MemoryStore",
+            "PARAMS": {"maxsize": int(os.getenv("COORDINATES_STORE_SIZE", 100_000))},
+        }
+    elif os.getenv("COORDINATES_STORE") == "sqlite":
+        coordinates_store_config = {
+            "CLASS": "correction.core.accumulator.SQLiteStore",
+            "PARAMS": {"path": os.getenv("COORDINATES_STORE_PATH", "coordinates.db")},
+        }
+
+    # Optional store to keep the first detection of each AID and FID across batches
+    first_detections_store_config = None
+    if os.getenv("FIRST_DETECTIONS_STORE") == "memory":
+        first_detections_store_config = {
+            "CLASS": "correction.core.first_detections.MemoryFirstDetectionStore",
+            "PARAMS": {"maxsize": int(os.getenv("FIRST_DETECTIONS_STORE_SIZE", 100_000))},
+        }
+    elif os.getenv("FIRST_DETECTIONS_STORE") == "sqlite":
+        first_detections_store_config = {
+            "CLASS": "correction.core.first_detections.SQLiteFirstDetectionStore",
+            "PARAMS": {"path": os.getenv("FIRST_DETECTIONS_STORE_PATH", "first_detections.db")},
+        }
+
     if os.getenv("CONSUMER_KAFKA_USERNAME") and os.getenv("CONSUMER_KAFKA_PASSWORD"):
         consumer_config["PARAMS"]["security.protocol"] = "SASL_SSL"
         consumer_config["PARAMS"]["sasl.mechanism"] = "SCRAM-SHA-512"
@@ -97,6 +156,12 @@ def settings_creator():
         "METRICS_CONFIG": metrics_config,
         "PRODUCER_CONFIG": producer_config,
         "SCRIBE_PRODUCER_CONFIG": scribe_producer_config,
+        "COORDINATES_STORE_CONFIG": coordinates_store_config,
+        "FIRST_DETECTIONS_STORE_CONFIG": first_detections_store_config,
+        "SCRIBE_BACKGROUND_CONFIG": scribe_background_config,
+        "EXECUTION_SHARDS": execution_shards,
+        "PIPELINE_CONFIG": pipeline_config,
+        "TIMINGS_CONFIG": timings_config,
         "LOGGING_DEBUG": logging_debug,
         "PROMETHEUS": prometheus,
     }
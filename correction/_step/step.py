@@ -1,12 +1,47 @@
 from __future__ import annotations
-import json
+import datetime
+import functools
 import logging
+import math
+import operator
+from typing import TYPE_CHECKING
 
-import pandas as pd
 from apf.core import get_class
 from apf.core.step import GenericStep
 
+from ..core.accumulator import CoordinateAccumulator
+from ..core.columns import DetectionColumns
 from ..core.corrector import Corrector
+from ..core.timing import set_observer, timed, timed_function
+from .background import BackgroundTasks
+from .pipeline import PipelinedRunner
+from .producers import dumps
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..core.parallel import ShardedCorrector
+
+_NON_DETECTION_KEY = operator.itemgetter("oid", "fid", "mjd")
+_SCRIBE_EXCLUDED_FIELDS = {"candid", "forced", "new"}
+_SCRIBE_EXCLUDED_EXTRA_FIELDS = {"diaObject", "prvDiaSources", "prvDiaForcedSources"}
+
+
+@functools.lru_cache(maxsize=None)
+def _float_fields() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Fields of the output detections that are `float` or `double`, without and with `null` (where missing values
+    are NaN, as they were with the previous conversion through a dataframe)"""
+    from .settings import get_output_schema
+
+    (detections,) = (field["type"]["items"] for field in get_output_schema()["fields"] if field["name"] == "detections")
+    floats = {"float", "double"}
+    non_nullable = [
+        field["name"] for field in detections["fields"] if isinstance(field["type"], str) and field["type"] in floats
+    ]
+    nullable = [
+        field["name"]
+        for field in detections["fields"]
+        if isinstance(field["type"], list) and "null" in field["type"] and floats.intersection(field["type"])
+    ]
+    return tuple(non_nullable), tuple(nullable)
 
 
 class CorrectionStep(GenericStep):
@@ -24,6 +59,32 @@ class CorrectionStep(GenericStep):
         super().__init__(config=config, **step_args)
         cls = get_class(self.config["SCRIBE_PRODUCER_CONFIG"]["CLASS"])
         self.scribe_producer = cls(self.config["SCRIBE_PRODUCER_CONFIG"])
+        self.coordinates_accumulator = None
+        if self.config.get("COORDINATES_STORE_CONFIG"):
+            cls = get_class(self.config["COORDINATES_STORE_CONFIG"]["CLASS"])
+            store = cls(**self.config["COORDINATES_STORE_CONFIG"].get("PARAMS", {}))
+            self.coordinates_accumulator = CoordinateAccumulator(store)
+        self.first_detections = None
+        if self.config.get("FIRST_DETECTIONS_STORE_CONFIG"):
+            cls = get_class(self.config["FIRST_DETECTIONS_STORE_CONFIG"]["CLASS"])
+            self.first_detections = cls(**self.config["FIRST_DETECTIONS_STORE_CONFIG"].get("PARAMS", {}))
+        self.sharded_corrector: ShardedCorrector | None = None
+        if self.config.get("EXECUTION_SHARDS", 1) > 1:
+            from ..core.parallel import ShardedCorrector  # Only loads multiprocessing if needed
+
+            self.sharded_corrector = ShardedCorrector(self.config["EXECUTION_SHARDS"])
+        self.scribe_tasks, self.scribe_chunk_size, self.commit_after_produce = None, None, False
+        if self.config.get("SCRIBE_BACKGROUND_CONFIG"):
+            background_config = self.config["SCRIBE_BACKGROUND_CONFIG"]
+            self.scribe_tasks = BackgroundTasks(background_config["WORKERS"], background_config["MAX_PENDING"])
+            self.scribe_chunk_size = background_config["CHUNK_SIZE"]
+            # Offsets are committed after producing, once both outputs are delivered (see `post_produce`)
+            self.commit_after_produce, self.commit = self.commit, False
+        if self.config.get("TIMINGS_CONFIG"):
+            from .timings import StepObserver
+
+            timings_config = self.config["TIMINGS_CONFIG"]
+            set_observer(StepObserver(timings_config.get("PROMETHEUS", True), timings_config.get("PYROSCOPE", False)))
         self.set_producer_key_field("aid")
         self.logger = logging.getLogger("alerce.CorrectionStep")
 
@@ -31,8 +92,6 @@ class CorrectionStep(GenericStep):
     def create_step() -> CorrectionStep:
         import os
         from .settings import settings_creator
-        from prometheus_client import start_http_server
-        from apf.metrics.prometheus import PrometheusMetrics
 
         settings = settings_creator()
         level = logging.INFO
@@ -52,82 +111,230 @@ class CorrectionStep(GenericStep):
         step_config = {"config": settings}
 
         if settings["PROMETHEUS"]:
+            from prometheus_client import start_http_server
+            from apf.metrics.prometheus import PrometheusMetrics
+
             step_config["prometheus_metrics"] = PrometheusMetrics()
             start_http_server(8000)
 
         return CorrectionStep(**step_config)
 
+    @staticmethod
+    def _group_by_aid(records: list[dict]) -> dict[str, list[dict]]:
+        groups = {}
+        for record in records:
+            groups.setdefault(record["aid"], []).append(record)
+        return groups
+
+    @staticmethod
+    def _restore_nan(records: list[dict]) -> list[dict]:
+        """Records with NaN in place of `None` for `float` and `double` fields (see `_float_fields`).
+
+        As with the previous conversion through a dataframe, fields that can be null are only restored if any of the
+        records has a value for them. Only records with such values are copied, the rest (and the given records) are
+        kept as they are.
+        """
+        non_nullable, nullable = _float_fields()
+        fields = [*non_nullable, *(field for field in nullable if any(r.get(field) is not None for r in records))]
+        restored = []
+        for record in records:
+            missing = [field for field in fields if field in record and record[field] is None]
+            restored.append({**record, **dict.fromkeys(missing, math.nan)} if missing else record)
+        return restored
+
     @classmethod
+    @timed_function("pre_produce")
     def pre_produce(cls, result: dict):
-        detections = pd.DataFrame(result["detections"]).groupby("aid")
-        try:  # At least one non-detection
-            non_detections = pd.DataFrame(result["non_detections"]).groupby("aid")
-        except KeyError:  # to reproduce expected error for missing non-detections in loop
-            non_detections = pd.DataFrame(columns=["aid"]).groupby("aid")
+        detections = cls._group_by_aid(cls._restore_nan(result["detections"]))
+        non_detections = cls._group_by_aid(result.get("non_detections", []))
         output = []
-        for aid, dets in detections:
-            try:
-                nd = non_detections.get_group(aid).to_dict("records")
-            except KeyError:
-                nd = []
+        for aid in sorted(detections):
             output.append(
                 {
                     "aid": aid,
                     "meanra": result["coords"][aid]["meanra"],
                     "meandec": result["coords"][aid]["meandec"],
-                    "detections": dets.to_dict("records"),
-                    "non_detections": nd,
+                    "detections": detections[aid],
+                    "non_detections": non_detections.get(aid, []),
                 }
             )
         return output
 
-    @classmethod
-    def pre_execute(cls, messages: list[dict]) -> dict:
-        detections, non_detections = [], []
+    @staticmethod
+    def _count_messages(messages: list[dict]) -> int:
+        """Number of consumed messages, counting all messages of the batches decoded into columns"""
+        return sum(
+            message["n_messages"] if isinstance(message["detections"], DetectionColumns) else 1 for message in messages
+        )
+
+    def _pre_execute(self, message: dict | list[dict]):
+        # Same as `GenericStep`, but with the number of messages in batches decoded into columns
+        self.logger.info("Received message. Begin preprocessing")
+        self.metrics["timestamp_received"] = datetime.datetime.now(datetime.timezone.utc)
+        self.message = [message] if isinstance(message, dict) else message
+        self.prometheus_metrics.consumed_messages.observe(self._count_messages(self.message))
+        return self.pre_execute(self.message)
+
+    def _post_execute(self, result: dict):
+        # Same as `GenericStep`, but with the number of messages in batches decoded into columns
+        self.logger.info("Processed message. Begin post processing")
+        final_result = self.post_execute(result)
+        if self.commit:
+            self.consumer.commit()
+        self.metrics["timestamp_sent"] = datetime.datetime.now(datetime.timezone.utc)
+        elapsed = (self.metrics["timestamp_sent"] - self.metrics["timestamp_received"]).total_seconds()
+        self.metrics["execution_time"] = elapsed
+        if self.extra_metrics:
+            self.metrics.update(self.get_extra_metrics(self.message))
+        self.send_metrics(**self.metrics)
+        self.prometheus_metrics.processed_messages.observe(self._count_messages(self.message))
+        self.prometheus_metrics.execution_time.observe(elapsed)
+        return final_result
+
+    def get_extra_metrics(self, message: dict | list[dict]) -> dict:
+        extra_metrics = super().get_extra_metrics(message)
+        extra_metrics["n_messages"] = self._count_messages([message] if isinstance(message, dict) else message)
+        return extra_metrics
+
+    @timed_function("pre_execute")
+    def pre_execute(self, messages: list[dict]) -> dict:
+        """Joins the detections and non-detections of all messages, dropping duplicates across messages.
+
+        Detections are unique by `candid`, preferring the copy marked as `new`. Non-detections are unique by `oid`,
+        `fid` and `mjd`, keeping the first. Otherwise, the first occurrence of each is kept in order.
+
+        Batches already decoded into columns (from `ColumnarKafkaConsumer`) are passed on as they are.
+        """
+        if len(messages) == 1 and isinstance(messages[0]["detections"], DetectionColumns):
+            batch = messages[0]
+            self._report_dedup_ratios(
+                batch["detections"].total,
+                len(batch["detections"]),
+                batch["n_non_detections"],
+                len(batch["non_detections"]),
+            )
+            return {"detections": batch["detections"], "non_detections": batch["non_detections"]}
+
+        detections, non_detections, n_detections = {}, [], 0
         for msg in messages:
-            detections.extend(msg["detections"])
+            n_detections += len(msg["detections"])
+            for detection in msg["detections"]:
+                candid = detection["candid"]
+                if candid not in detections or (detection["new"] and not detections[candid]["new"]):
+                    detections[candid] = detection  # Replacing a value keeps the position of the first occurrence
             non_detections.extend(msg["non_detections"])
-        return {"detections": detections, "non_detections": non_detections}
+        unique_non_detections = self._unique_non_detections(non_detections)
 
-    @classmethod
-    def execute(cls, message: dict) -> dict:
-        corrector = Corrector(message["detections"])
-        detections = corrector.corrected_as_records()
-        non_detections = pd.DataFrame(message["non_detections"]).drop_duplicates(["oid", "fid", "mjd"])
-        coords = corrector.coordinates_as_records()
-        del corrector
-        return {"detections": detections, "non_detections": non_detections.to_dict("records"), "coords": coords}
+        self._report_dedup_ratios(n_detections, len(detections), len(non_detections), len(unique_non_detections))
+        return {"detections": list(detections.values()), "non_detections": unique_non_detections}
+
+    def _report_dedup_ratios(self, n_detections: int, n_unique: int, n_non_detections: int, n_unique_non: int):
+        """Adds the fraction of consumed records dropped as duplicates to the metrics"""
+        self.metrics["detections_dedup_ratio"] = 1 - n_unique / n_detections if n_detections else 0.0
+        self.metrics["non_detections_dedup_ratio"] = 1 - n_unique_non / n_non_detections if n_non_detections else 0.0
+
+    def execute(self, message: dict) -> dict:
+        if isinstance(message["detections"], DetectionColumns):
+            with timed("corrector"):
+                corrector = Corrector.from_columns(
+                    *message["detections"].build(), first_detections=self.first_detections
+                )
+            detections = corrector.corrected_as_records()
+            coords = corrector.coordinates_as_records(self.coordinates_accumulator)
+            del corrector
+        elif self.sharded_corrector is None:
+            with timed("corrector"):
+                corrector = Corrector(message["detections"], first_detections=self.first_detections)
+            detections = corrector.corrected_as_records()
+            coords = corrector.coordinates_as_records(self.coordinates_accumulator)
+            del corrector
+        else:
+            detections, coords = self.sharded_corrector.correct(
+                message["detections"], self.coordinates_accumulator, self.first_detections
+            )
+        non_detections = self._unique_non_detections(message["non_detections"])
+        return {"detections": detections, "non_detections": non_detections, "coords": coords}
+
+    @staticmethod
+    def _unique_non_detections(non_detections: list[dict]) -> list[dict]:
+        """Non-detections without duplicates (same `oid`, `fid` and `mjd`), keeping the first occurrence in order"""
+        seen, unique = set(), []
+        for non_detection in non_detections:
+            key = _NON_DETECTION_KEY(non_detection)
+            if key not in seen:
+                seen.add(key)
+                unique.append(non_detection)
+        return unique
 
     def post_execute(self, result: dict):
-        self.produce_scribe(result["detections"])
+        if self.scribe_tasks is None:
+            self.produce_scribe(result["detections"])
+        else:  # The scribe messages are built and produced while the main output is produced
+            detections = result["detections"]
+            for start in range(0, len(detections), self.scribe_chunk_size):
+                self.scribe_tasks.submit(self.produce_scribe, detections[start : start + self.scribe_chunk_size])
         return result
 
-    def produce_scribe(self, detections: list[dict]):
-        updated_detections = 0
-        for detection in detections:
-            detection = detection.copy()  # Prevent further modification for next step
-            if not detection.pop("new"):
-                continue
-
-            updated_detections += 1
-
-            is_forced = detection.pop("forced")
-            candid = detection.pop("candid")
-            set_on_insert = not detection.get("has_stamp", False)
-
-            # remove possible elasticc extrafields
-            for to_remove in ["diaObject", "prvDiaSources", "prvDiaForcedSources"]:
-                if to_remove in detection["extra_fields"]:
-                    detection["extra_fields"].pop(to_remove)
-
-            scribe_data = {
-                "collection": "forced_photometry" if is_forced else "detection",
-                "type": "update",
-                "criteria": {"_id": candid},
-                "data": detection,
-                "options": {"upsert": True, "set_on_insert": set_on_insert},
+    def post_produce(self):
+        if self.scribe_tasks is None:
+            return
+        self.flush_outputs()
+        if self.commit_after_produce:
+            self.consumer.commit()
+
+    def flush_outputs(self):
+        """Waits for the scribe messages (if produced in background) and for both producers to deliver"""
+        if self.scribe_tasks is not None:
+            self.scribe_tasks.flush()
+        for producer in [self.scribe_producer, self.producer]:
+            if hasattr(producer, "flush"):
+                producer.flush()
+
+    def start(self):
+        if not self.config.get("PIPELINE_CONFIG"):
+            return super().start()
+        PipelinedRunner(self, self.config["PIPELINE_CONFIG"]["MAX_IN_FLIGHT"]).run()
+
+    def tear_down(self):
+        if self.sharded_corrector is not None:
+            self.sharded_corrector.shutdown()
+        if self.scribe_tasks is not None:
+            self.scribe_tasks.shutdown()
+        if self.config.get("TIMINGS_CONFIG"):
+            set_observer(None)
+
+    @staticmethod
+    def _scribe_data(detection: dict) -> dict:
+        """Scribe command for a detection. The detection (and its extra fields) is read, but not modified"""
+        data = detection.copy()  # Shallow copy, faster than picking the fields one by one
+        for key in _SCRIBE_EXCLUDED_FIELDS:
+            del data[key]
+        extra_fields = detection["extra_fields"]
+        if not _SCRIBE_EXCLUDED_EXTRA_FIELDS.isdisjoint(extra_fields):  # remove possible elasticc extra fields
+            data["extra_fields"] = {
+                key: value for key, value in extra_fields.items() if key not in _SCRIBE_EXCLUDED_EXTRA_FIELDS
             }
-            scribe_payload = {"payload": json.dumps(scribe_data)}
-            self.scribe_producer.produce(scribe_payload)
+        return {
+            "collection": "forced_photometry" if detection["forced"] else "detection",
+            "type": "update",
+            "criteria": {"_id": detection["candid"]},
+            "data": data,
+            "options": {"upsert": True, "set_on_insert": not detection.get("has_stamp", False)},
+        }
 
-        self.logger.debug(f"Updated {updated_detections} new detections")
+    def produce(self, result: list[dict]):
+        """Produces the output messages, all together if the producer supports it"""
+        if not hasattr(self.producer, "produce_batch"):
+            return super().produce(result)
+        self.producer.produce_batch(result)
+        self.logger.info(f"Produced {len(result)} messages")
+
+    @timed_function("produce_scribe")
+    def produce_scribe(self, detections: list[dict]):
+        payloads = [{"payload": dumps(self._scribe_data(detection))} for detection in detections if detection["new"]]
+        if hasattr(self.scribe_producer, "produce_batch"):
+            self.scribe_producer.produce_batch(payloads)
+        else:  # Generic producers can only send one message at a time
+            for payload in payloads:
+                self.scribe_producer.produce(payload)
+        self.logger.debug(f"Updated {len(payloads)} new detections")
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import functools
+import threading
+
+from ..core.timing import Observer
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+@functools.lru_cache(maxsize=None)
+def _prometheus_metrics():
+    """Histogram of the duration of each phase and counter of rows (registered only once per process)"""
+    from prometheus_client import Counter, Histogram
+
+    seconds = Histogram(
+        "correction_phase_seconds", "Duration of each phase of the step", ["phase", "survey"], buckets=_BUCKETS
+    )
+    rows = Counter("correction_rows", "Number of rows processed by each phase of the step", ["phase", "survey"])
+    return seconds, rows
+
+
+class StepObserver(Observer):
+    """Reports the timings of the phases as Prometheus metrics and pyroscope tags.
+
+    The Prometheus metrics are `correction_phase_seconds` (histogram) and `correction_rows_total` (counter), both
+    labelled by `phase` and `survey`. Profiles are tagged with the innermost `phase` and its `survey` (if any).
+
+    Args:
+        prometheus: Whether to report the Prometheus metrics
+        pyroscope: Whether to add the pyroscope tags
+    """
+
+    def __init__(self, prometheus: bool = True, pyroscope: bool = False):
+        self._seconds, self._rows = _prometheus_metrics() if prometheus else (None, None)
+        self._pyroscope = None
+        if pyroscope:
+            import pyroscope
+
+            self._pyroscope = pyroscope
+        self._local = threading.local()  # Stack of active phases in each thread, to restore the outer tags
+
+    def _tags(self, phase: str, survey: str) -> dict:
+        return {"phase": phase, "survey": survey} if survey else {"phase": phase}
+
+    def _add_tags(self, phase: str, survey: str):
+        for key, value in self._tags(phase, survey).items():
+            self._pyroscope.add_thread_tag(key, value)
+
+    def _remove_tags(self, phase: str, survey: str):
+        for key, value in self._tags(phase, survey).items():
+            self._pyroscope.remove_thread_tag(key, value)
+
+    def enter(self, phase: str, survey: str):
+        if self._pyroscope is None:
+            return
+        stack = self._local.__dict__.setdefault("stack", [])
+        if stack:
+            self._remove_tags(*stack[-1])
+        stack.append((phase, survey))
+        self._add_tags(phase, survey)
+
+    def exit(self, phase: str, survey: str, seconds: float):
+        if self._seconds is not None:
+            self._seconds.labels(phase=phase, survey=survey).observe(seconds)
+        if self._pyroscope is None:
+            return
+        stack = self._local.stack
+        self._remove_tags(*stack.pop())
+        if stack:
+            self._add_tags(*stack[-1])
+
+    def count(self, phase: str, survey: str, rows: int):
+        if self._rows is not None:
+            self._rows.labels(phase=phase, survey=survey).inc(rows)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import abc
+from typing import Iterable, Mapping
+
+import pandas as pd
+
+from .stores import LRUStore, SQLiteKeyValueStore
+
+
+class CoordinateStore(abc.ABC):
+    """Backing store for the coordinate accumulator. Maps AIDs to mappings of sums"""
+
+    @abc.abstractmethod
+    def get(self, aids: Iterable[str]) -> dict[str, dict[str, float]]:
+        """Sums kept for the given AIDs. AIDs not in the store are not included"""
+
+    @abc.abstractmethod
+    def put(self, sums: Mapping[str, dict[str, float]]):
+        """Keeps the sums of the given AIDs, replacing any previous value"""
+
+
+class MemoryStore(LRUStore, CoordinateStore):
+    """In-memory store that keeps only the most recently used AIDs
+
+    Args:
+        maxsize: Maximum number of AIDs to keep
+    """
+
+
+class SQLiteStore(SQLiteKeyValueStore, CoordinateStore):
+    """Store backed by a local SQLite database. Keeps all AIDs
+
+    Args:
+        path: Path to the database file (created if missing)
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "coordinate_sums")
+
+
+class CoordinateAccumulator:
+    """Keeps the weighted sums used for the mean coordinates of each AID across batches.
+
+    Along with the sums, it keeps the latest `mjd` of the detections added to them, so that detections delivered more
+    than once (e.g., after a restart before committing) are not added again. This takes constant space per AID.
+
+    Args:
+        store: Where to keep the sums. Defaults to an in-memory store
+    """
+
+    _LAST_MJD = "last_mjd"  # Key with the latest mjd of the detections added to the sums of each AID
+
+    def __init__(self, store: CoordinateStore | None = None):
+        self.store = MemoryStore() if store is None else store
+
+    def get(self, aids: Iterable[str], columns: list[str]) -> tuple[pd.DataFrame, pd.Series]:
+        """Sums kept for the given AIDs and the latest `mjd` of the detections added to them.
+
+        AIDs not in the store or kept with different sums (e.g., from another mode) are not included.
+
+        Args:
+            aids: AIDs of interest
+            columns: Names of the sums
+
+        Returns:
+            tuple: Sums (as columns) and latest `mjd` added, both for each AID (as index)
+        """
+        keys = {*columns, self._LAST_MJD}
+        found = {aid: values for aid, values in self.store.get(aids).items() if set(values) == keys}
+        sums = pd.DataFrame.from_dict(found, orient="index", columns=[*columns, self._LAST_MJD], dtype=float)
+        return sums[columns], sums[self._LAST_MJD]
+
+    def put(self, sums: pd.DataFrame, last_mjd: pd.Series | None = None):
+        """Keeps the given sums (as columns) for each AID (as index), replacing any previous value
+
+        Args:
+            sums: Sums for each AID
+            last_mjd: Latest `mjd` of the detections added to the sums of each AID (`NaN` if missing)
+        """
+        last_mjd = pd.Series(dtype=float) if last_mjd is None else last_mjd
+        records = sums.assign(**{self._LAST_MJD: last_mjd.reindex(sums.index)}).to_dict("index")
+        self.store.put(records)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Mapping, Sequence
+
+
+class DetectionColumns:
+    """Builds the columns for `Corrector.from_columns` from detections given as columns (e.g., decoded by batch).
+
+    Detections are unique by `candid`, preferring the one marked as `new`. Otherwise, the first one is kept. Rows are
+    in order of first occurrence. Fields missing from some of the added columns are filled with `None`.
+
+    Args:
+        extra_fields: Fields taken out of the `extra_fields` of each detection into columns of their own
+    """
+
+    def __init__(self, extra_fields: Sequence[str]):
+        self.total = 0  # Number of detections added, including duplicates
+        self._extra_names = list(extra_fields)
+        self._positions: dict[str, int] = {}
+        self._new: list[bool] = []
+        self._columns: dict[str, list] = {}
+
+    def __len__(self):
+        return len(self._new)
+
+    def extend(self, columns: Mapping[str, list]):
+        """Adds detections given as columns (all of the same length, including `candid` and `extra_fields`)"""
+        size = len(columns["candid"])
+        self.total += size
+        new = columns.get("new", [False] * size)
+        start, taken, replaced = len(self), [], []  # Positions in the given columns of rows to add and to replace
+        for i, candid in enumerate(columns["candid"]):
+            position = self._positions.get(candid)
+            if position is None:
+                self._positions[candid] = start + len(taken)
+                self._new.append(bool(new[i]))
+                taken.append(i)
+            elif new[i] and not self._new[position]:
+                self._new[position] = True
+                replaced.append((position, i))
+
+        for field in columns.keys() - self._columns.keys():
+            self._columns[field] = [None] * start
+        for field, column in self._columns.items():
+            values = columns.get(field)
+            if values is None:
+                column.extend([None] * len(taken))
+            elif len(taken) == size:
+                column.extend(values)
+            else:
+                column.extend([values[i] for i in taken])
+            for position, i in replaced:
+                column[position] = None if values is None else values[i]
+
+    def build(self) -> tuple[dict[str, list], list[dict]]:
+        """Columns (all of the same length) and original `extra_fields`, as needed by `Corrector.from_columns`"""
+        columns = dict(self._columns)
+        extra_fields = columns.pop("extra_fields", [{}] * len(self))
+        for field in self._extra_names:
+            columns[field] = [fields.get(field) for fields in extra_fields]
+        return columns, extra_fields
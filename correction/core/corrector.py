@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import importlib.util
 import logging
-from typing import Literal
+import os
+from typing import Iterable, Mapping, Sequence
 
 import numpy as np
 import pandas as pd
 
 from . import strategy
+from .accumulator import CoordinateAccumulator
+from .first_detections import FirstDetectionStore
+from .timing import count, timed, timed_function
 
 
 class Corrector:
@@ -14,15 +19,38 @@ class Corrector:
 
     # _EXTRA_FIELDS must include columns from all surveys that are needed in their respective strategy
     _EXTRA_FIELDS = ["magnr", "sigmagnr", "distnr", "distpsnr1", "sgscore1", "sharpnr", "chinr"]
+    # Internal dtypes: few distinct values are kept as categories and flags with missing values as nullable booleans
+    _CATEGORIES = ["aid", "sid", "fid", "tid", "oid"]
+    _BOOLEANS = ["has_stamp", "forced", "new"]
     _ZERO_MAG = 100.0  # Not really zero mag, but zero flux (very high magnitude)
-
-    def __init__(self, detections: list[dict]):
+    _MAGNITUDES = ["mag_corr", "e_mag_corr", "e_mag_corr_ext"]
+    _FLAGS = ["corrected", "dubious", "stellar"]
+    _ENGINES = ["numpy", "numba"]
+    _COORDINATE_SUMS = {
+        "linear": ["weights_ra", "weights_dec", "ra", "dec"],
+        "spherical": ["weights_ra", "weights_dec", "x_ra", "y_ra", "x_dec", "y_dec", "z_dec"],
+    }
+
+    def __init__(
+        self,
+        detections: list[dict],
+        engine: str | None = None,
+        coordinates: str | None = None,
+        first_detections: FirstDetectionStore | None = None,
+    ):
         """Creates objet that handles detection corrections.
 
         Duplicate `candids` are dropped from all calculations and outputs.
 
         Args:
             detections: List of mappings with all values from generic alert (must include `extra_fields`)
+            engine: Engine for strategies that support more than one (`numpy` or `numba`). If not provided, it is
+                taken from the environment variable `CORRECTION_ENGINE` (defaults to `numpy`)
+            coordinates: Mode for the mean coordinates (`linear` or `spherical`, see `mean_coordinates`). If not
+                provided, it is taken from the environment variable `CORRECTION_COORDINATES` (defaults to `linear`)
+            first_detections: Keeps the first detection of each AID and FID across batches, for strategies that
+                depend on it (see `strategy.ztf.evaluate`). If not provided, the detections must include the full
+                history of each object
         """
         self.logger = logging.getLogger(f"alerce.{self.__class__.__name__}")
         self._detections = pd.DataFrame.from_records(detections, exclude={"extra_fields"})
@@ -33,82 +61,260 @@ class Corrector:
         extras = extras.reset_index(names=["candid"]).drop_duplicates("candid").set_index("candid")
 
         self._detections = self._detections.join(extras)
+        self._setup(engine, coordinates, first_detections)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Mapping[str, Sequence],
+        extra_fields: Sequence[dict],
+        engine: str | None = None,
+        coordinates: str | None = None,
+        first_detections: FirstDetectionStore | None = None,
+    ) -> Corrector:
+        """Creates object that handles detection corrections from column arrays.
+
+        The fields in `_EXTRA_FIELDS` must be given flattened, as columns of their own. Any of them that is missing
+        is filled with `NaN`. The internal frame is built in a single pass, without intermediate records or joins.
 
-    def _survey_mask(self, survey: str):
-        """Creates boolean mask of detections whose `sid` matches the given survey name (case-insensitive)
+        Duplicate `candids` are dropped from all calculations and outputs, keeping the first occurrence.
 
         Args:
-            survey: Name of the survey of interest
+            columns: Mapping from field name to values, all of the same length (must include `candid`)
+            extra_fields: Original `extra_fields` of each detection, in the same order as the columns. These are
+                only used to restore them in the output records
+            engine: Engine for strategies that support more than one (see `Corrector`)
+            coordinates: Mode for the mean coordinates (see `Corrector`)
+            first_detections: Keeps the first detection of each AID and FID across batches (see `Corrector`)
 
         Returns:
-            pd.Series: Mask of detections corresponding to the survey
+            Corrector: Object for the given detections
         """
-        return self._detections["sid"].str.lower() == survey.lower()
+        self = cls.__new__(cls)
+        self.logger = logging.getLogger(f"alerce.{cls.__name__}")
+        missing = {field: np.nan for field in cls._EXTRA_FIELDS if field not in columns}
+        self._detections = pd.DataFrame({**columns, **missing})
+
+        unique = ~self._detections["candid"].duplicated().to_numpy()
+        if not unique.all():
+            self._detections = self._detections[unique]
+            extra_fields = [fields for fields, keep in zip(extra_fields, unique) if keep]
+        self._detections = self._detections.set_index("candid")
+        self.__extras = dict(zip(self._detections.index, extra_fields))
+        self._setup(engine, coordinates, first_detections)
+        return self
+
+    def _setup(self, engine: str | None, coordinates: str | None, first_detections: FirstDetectionStore | None):
+        """Sets up the state shared by all constructors, once the detections are set"""
+        self._detections = self._compact(self._detections)
+        self.first_detections = first_detections
+        self.engine = self._resolve_engine(engine)
+        self.coordinates = (coordinates or os.getenv("CORRECTION_COORDINATES") or "linear").lower()
+        if self.coordinates not in self._COORDINATE_SUMS:
+            modes = ", ".join(self._COORDINATE_SUMS)
+            raise ValueError(f"Unknown mode '{self.coordinates}' (available modes: {modes})")
+        self._partitions = self._partition_surveys()
+        for name, positions in self._partitions.items():
+            count("corrector", len(positions), survey=name)
+        self._results = None
+
+    @classmethod
+    def _compact(cls, detections: pd.DataFrame) -> pd.DataFrame:
+        """Detections with the internal dtypes, which take less memory and are faster to group by.
+
+        Columns in `_CATEGORIES` become categorical, columns in `_BOOLEANS` with missing values become nullable
+        booleans and columns in `_EXTRA_FIELDS` become floats (values that are not numbers are set to `NaN`). Other
+        columns are kept as they are. The values in the output records are the same as without the conversion.
 
-    def _apply_all_surveys(self, function: str, *, default=None, columns=None, dtype=object):
-        """Applies given function for all surveys defined in `strategy` module.
+        Args:
+            detections: Detections as built by the constructors
 
-        Any survey without defined strategies will keep the default value.
+        Returns:
+            pd.DataFrame: Detections with the converted columns
+        """
+        dtypes = {column: "category" for column in cls._CATEGORIES if column in detections}
+        for column in cls._BOOLEANS:
+            if column in detections and detections[column].dtype == object:
+                if pd.api.types.infer_dtype(detections[column], skipna=True) == "boolean":
+                    dtypes[column] = "boolean"
+        detections = detections.astype(dtypes, copy=False)
+        for column in cls._EXTRA_FIELDS:
+            if detections[column].dtype != np.float64:
+                detections[column] = pd.to_numeric(detections[column], errors="coerce").astype(np.float64)
+        return detections
+
+    def _resolve_engine(self, engine: str | None) -> str:
+        """Validates the requested engine, falling back to `numpy` if `numba` is not installed
 
         Args:
-            function: Name of the function to apply. It must exist as a function in all strategy modules
-            default (any): Default value for surveys without a defined strategy
-            columns (list[str]): Create a dataframe with these columns. If not provided, it will create a series
-            dtype (dtype): Type of the output values
+            engine: Requested engine. If not provided, it is taken from the environment variable `CORRECTION_ENGINE`
 
         Returns:
-            pd.Series or pd.DataFrame: Result of the applied function for all detections
+            str: Name of the engine to use
         """
-        if columns:
-            basic = pd.DataFrame(default, index=self._detections.index, columns=columns, dtype=dtype)
-        else:
-            basic = pd.Series(default, index=self._detections.index, dtype=dtype)
-        for name in dir(strategy):  # Will loop through the modules/variables imported in strategy
-            if name.startswith("_"):  # Skip protected/private modules/variables
-                continue
-            mask = self._survey_mask(name)  # Module must match survey prefix uniquely
-            if mask.any():  # Skip if there are no detections of the given survey
-                module = getattr(strategy, name)  # Get module containing strategy for survey
-                # Get function and call it over the detections belonging to the survey
-                basic[mask] = getattr(module, function)(self._detections[mask])
-        return basic.astype(dtype)  # Ensure correct output type
+        engine = (engine or os.getenv("CORRECTION_ENGINE") or "numpy").lower()
+        if engine not in self._ENGINES:
+            raise ValueError(f"Unknown engine '{engine}' (available engines: {', '.join(self._ENGINES)})")
+        if engine == "numba" and importlib.util.find_spec("numba") is None:
+            self.logger.warning("Engine 'numba' requested, but it is not installed. Using 'numpy' instead")
+            return "numpy"
+        return engine
+
+    def _partition_surveys(self) -> dict[str, np.ndarray]:
+        """Positions of the detections belonging to each survey with a defined strategy.
+
+        Survey IDs are matched case-insensitively with the names in `strategy.REGISTRY`. Surveys without detections
+        are not included.
+
+        Returns:
+            dict[str, np.ndarray]: Mapping from survey name to the (integer) positions of its detections
+        """
+        sid = self._detections["sid"].astype("category")
+        codes = sid.cat.codes.to_numpy()
+        surveys = sid.cat.categories.str.lower()
+        partitions = {}
+        for name in strategy.REGISTRY:
+            (matches,) = np.nonzero(surveys == name)
+            if matches.size:
+                (partitions[name],) = np.nonzero(np.isin(codes, matches))
+        return partitions
+
+    @staticmethod
+    def _evaluate(
+        module,
+        detections: pd.DataFrame,
+        engine: str,
+        survey: str = "",
+        first_detections: FirstDetectionStore | None = None,
+    ) -> pd.DataFrame:
+        """Applies all functions of a strategy module over the given detections.
+
+        Uses the fused `evaluate` function if the module defines one. Otherwise, the functions `correct`,
+        `is_corrected`, `is_dubious` and `is_stellar` are applied one after the other.
+
+        Args:
+            module: Strategy module for the survey of the detections
+            detections: Detections of a single survey
+            engine: Engine passed to the `evaluate` function
+            survey: Name of the survey, only used to report timings (see `timing`)
+            first_detections: Store of first detections passed to the `evaluate` function (only if given)
+
+        Returns:
+            pd.DataFrame: Corrected magnitudes and errors and flags, in the same order as the detections
+        """
+        if hasattr(module, "evaluate"):
+            kwargs = {} if first_detections is None else {"first_detections": first_detections}
+            with timed("strategy.evaluate", survey):
+                return module.evaluate(detections, engine=engine, **kwargs)
+        with timed("strategy.correct", survey):
+            corrected = module.correct(detections)
+        with timed("strategy.is_corrected", survey):
+            is_corrected = module.is_corrected(detections)
+        with timed("strategy.is_dubious", survey):
+            is_dubious = module.is_dubious(detections)
+        with timed("strategy.is_stellar", survey):
+            is_stellar = module.is_stellar(detections)
+        return corrected.assign(corrected=is_corrected, dubious=is_dubious, stellar=is_stellar)
+
+    def compute(self) -> pd.DataFrame:
+        """Computes corrected magnitudes and flags for all detections.
+
+        The strategies are only applied on the first call and the results are kept for further calls (including
+        the properties and other methods that depend on them). Use `invalidate` to force a new computation.
+
+        Any survey without defined strategies will have `NaN` magnitudes and `False` flags.
+
+        Returns:
+            pd.DataFrame: Corrected magnitudes and errors (`NaN` for non-corrected magnitudes) and flags
+        """
+        if self._results is None:
+            magnitudes = np.full((len(self._MAGNITUDES), len(self._detections)), np.nan)
+            flags = np.zeros((len(self._FLAGS), len(self._detections)), dtype=bool)
+            for name, positions in self._partitions.items():
+                detections = self._detections.iloc[positions]
+                module = strategy.REGISTRY[name]
+                evaluated = self._evaluate(module, detections, self.engine, name, self.first_detections)
+                magnitudes[:, positions] = evaluated[self._MAGNITUDES].to_numpy(dtype=float).T
+                flags[:, positions] = evaluated[self._FLAGS].to_numpy(dtype=bool).T
+            magnitudes[:, ~flags[self._FLAGS.index("corrected")]] = np.nan  # NaN for non-corrected magnitudes
+
+            self._results = pd.DataFrame(
+                {**dict(zip(self._MAGNITUDES, magnitudes)), **dict(zip(self._FLAGS, flags))},
+                index=self._detections.index,
+            )
+        return self._results
+
+    def invalidate(self):
+        """Discards the results kept from a previous computation"""
+        self._results = None
 
     @property
     def corrected(self) -> pd.Series:
         """Whether the detection has a corrected magnitude"""
-        return self._apply_all_surveys("is_corrected", default=False, dtype=bool)
+        return self.compute()["corrected"]
 
     @property
     def dubious(self) -> pd.Series:
         """Whether the correction (or lack thereof) is dubious"""
-        return self._apply_all_surveys("is_dubious", default=False, dtype=bool)
+        return self.compute()["dubious"]
 
     @property
     def stellar(self) -> pd.Series:
         """Whether the source is likely stellar"""
-        return self._apply_all_surveys("is_stellar", default=False, dtype=bool)
+        return self.compute()["stellar"]
 
     def corrected_magnitudes(self) -> pd.DataFrame:
         """Dataframe with corrected magnitudes and errors. Non-corrected magnitudes are set to NaN."""
-        cols = ["mag_corr", "e_mag_corr", "e_mag_corr_ext"]
-        corrected = self._apply_all_surveys("correct", columns=cols, dtype=float)
-        return corrected.where(self.corrected)  # NaN for non-corrected magnitudes
+        return self.compute()[self._MAGNITUDES]
 
+    @timed_function("corrected_as_records")
     def corrected_as_records(self) -> list[dict]:
         """Corrected alerts as records.
 
         The output is the same as the input passed on creation, with additional generic fields corresponding to
         the corrections (`mag_corr`, `e_mag_corr`, `e_mag_corr_ext`, `corrected`, `dubious`, `stellar`).
 
-        The records are a list of mappings with the original input pairs and the new pairs together.
+        The records are a list of mappings with the original input pairs and the new pairs together. Missing values
+        are set to `None` and infinite corrected magnitudes to `_ZERO_MAG`. The `extra_fields` are the same objects
+        given on creation (not copies).
         """
         self.logger.debug(f"Correcting {len(self._detections)} detections...")
-        corrected = self.corrected_magnitudes().replace(np.inf, self._ZERO_MAG)
-        corrected = corrected.assign(corrected=self.corrected, dubious=self.dubious, stellar=self.stellar)
-        corrected = self._detections.join(corrected).replace(np.nan, None).drop(columns=self._EXTRA_FIELDS)
+        corrected = self.compute()
         self.logger.debug(f"Corrected {corrected['corrected'].sum()}")
-        corrected = corrected.reset_index().to_dict("records")
-        return [{**record, "extra_fields": self.__extras[record["candid"]]} for record in corrected]
+
+        detections = self._detections.drop(columns=self._EXTRA_FIELDS)
+        fields = ["candid", *detections.columns, *corrected.columns]
+        values = [self._as_list(detections.index.to_numpy())]
+        values.extend(self._as_list(detections[column].to_numpy()) for column in detections.columns)
+        magnitudes = (corrected[column].to_numpy() for column in self._MAGNITUDES)
+        values.extend(self._corrected_values(magnitudes, (corrected[column].to_numpy() for column in self._FLAGS)))
+
+        fields.append("extra_fields")
+        values.append([self.__extras[candid] for candid in values[0]])
+        return [dict(zip(fields, record)) for record in zip(*values)]
+
+    @classmethod
+    def _corrected_values(cls, magnitudes: Iterable[np.ndarray], flags: Iterable[np.ndarray]) -> list[list]:
+        """Values of the corrected magnitudes and flags in the output records, for each of `_MAGNITUDES` and `_FLAGS`
+
+        Args:
+            magnitudes: Corrected magnitudes and errors, in the order of `_MAGNITUDES`
+            flags: Flags, in the order of `_FLAGS`
+        """
+        values = [cls._as_list(np.where(column == np.inf, cls._ZERO_MAG, column)) for column in magnitudes]
+        values.extend(column.tolist() for column in flags)
+        return values
+
+    @staticmethod
+    def _as_list(values: np.ndarray) -> list:
+        """Values as a list of built-in types, with `None` in place of missing values (only checked if needed)"""
+        if values.dtype.kind in "biu":  # Integer and boolean arrays cannot have missing values
+            return values.tolist()
+        missing = pd.isna(values)
+        values = values.tolist()
+        for i in np.flatnonzero(missing):
+            values[i] = None
+        return values
 
     @staticmethod
     def weighted_mean(values: pd.Series, sigmas: pd.Series) -> float:
@@ -135,29 +341,93 @@ class Corrector:
         """
         return values / 3600.0
 
-    def _calculate_coordinates(self, label: Literal["ra", "dec"]) -> dict:
-        """Calculate weighted mean value for the given coordinates for each AID.
+    @timed_function("mean_coordinates")
+    def mean_coordinates(self, accumulator: CoordinateAccumulator | None = None, rebuild: bool = False) -> pd.DataFrame:
+        """Dataframe with weighted mean coordinates for each AID.
 
-        Args:
-            label: Label for the coordinate to calculate
+        The weights are the inverse square of the coordinate errors. Forced photometry is not considered for the
+        means, so AIDs with only forced photometry have `NaN` coordinates.
 
-        Returns:
-            dict: Mapping from `mean<label>` to weighted means of the coordinates
+        In `linear` mode, RA and Dec are averaged directly. In `spherical` mode, the positions are averaged as unit
+        vectors (using the weights of each coordinate to get its mean), which is correct for objects across RA 0/360
+        and near the poles. Both modes give the same results (up to rounding) for positions far from those.
+
+        With an accumulator, the weighted sums for each AID are kept across calls. For AIDs already in the
+        accumulator, only detections marked as `new` are added to the kept sums. AIDs not in the accumulator use all
+        their detections. This requires the detections to include the `new` field. New detections are only added if
+        they are later (by `mjd`) than those already in the kept sums, so repeating a batch does not change the means.
+
+        Args:
+            accumulator: Keeps the weighted sums of each AID across calls
+            rebuild: Replace the sums in the accumulator with those from all the detections of each AID
         """
-        non_forced = self._detections[~self._detections["forced"]]
+        if accumulator is None:
+            return self._coordinates_from_sums(self._coordinate_sums())
 
-        def _average(series):
-            return self.weighted_mean(series, sigmas.loc[series.index])
+        aids, mjd = self._detections["aid"].array, self._detections["mjd"].to_numpy(dtype=float, na_value=np.nan)
+        if rebuild:
+            columns = self._COORDINATE_SUMS[self.coordinates]
+            stored, last_mjd = pd.DataFrame(columns=columns, dtype=float), pd.Series(dtype=float)
+        else:
+            stored, last_mjd = accumulator.get(aids.categories, self._COORDINATE_SUMS[self.coordinates])
+        kept = np.full(len(aids.categories), -np.inf)  # Latest mjd added for each AID (by code)
+        kept[aids.categories.get_indexer(last_mjd.index)] = last_mjd.fillna(-np.inf).to_numpy()
+        new = self._detections["new"].to_numpy(dtype=bool, na_value=False)
+        known = np.isin(aids.codes, aids.categories.get_indexer(stored.index))
+        rows = ~known | (new & (mjd > kept[aids.codes]))
+        sums = self._coordinate_sums(rows).add(stored, fill_value=0)
+        added = pd.Series(mjd[rows]).groupby(aids.codes[rows]).max()
+        added = added.set_axis(aids.categories.take(added.index))
+        accumulator.put(sums, pd.concat([last_mjd, added]).groupby(level=0).max())
+        return self._coordinates_from_sums(sums)
+
+    def _coordinate_sums(self, rows: np.ndarray | None = None) -> pd.DataFrame:
+        """Weighted sums needed to compute the mean coordinates of each AID (columns depend on the mode).
 
-        sigmas = self.arcsec2dec(non_forced[f"e_{label}"])
-        return {f"mean{label}": non_forced.groupby("aid")[label].agg(_average)}
+        Args:
+            rows: Boolean mask with the detections to include. If not provided, all detections are included
 
-    def mean_coordinates(self) -> pd.DataFrame:
-        """Dataframe with weighted mean coordinates for each AID"""
-        coords = self._calculate_coordinates("ra")
-        coords.update(self._calculate_coordinates("dec"))
-        return pd.DataFrame(coords)
+        Returns:
+            pd.DataFrame: Sums for each AID, with columns from `_COORDINATE_SUMS`
+        """
+        detections = self._detections if rows is None else self._detections[rows]
+        forced = detections["forced"].to_numpy(dtype=bool, na_value=False)
+        ra, dec = (np.where(forced, 0, detections[label].to_numpy(dtype=float)) for label in ["ra", "dec"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights_ra, weights_dec = (
+                np.where(forced, 0, 1 / self.arcsec2dec(detections[f"e_{label}"].to_numpy(dtype=float)) ** 2)
+                for label in ["ra", "dec"]
+            )
+        sums = {"weights_ra": weights_ra, "weights_dec": weights_dec}
+        if self.coordinates == "spherical":
+            ra, dec = np.radians(ra), np.radians(dec)
+            x, y, z = np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)
+            sums.update(x_ra=weights_ra * x, y_ra=weights_ra * y)
+            sums.update(x_dec=weights_dec * x, y_dec=weights_dec * y, z_dec=weights_dec * z)
+        else:
+            sums.update(ra=weights_ra * ra, dec=weights_dec * dec)
+        aids = detections["aid"].array  # Grouped by the codes, which follow the (sorted) order of the categories
+        sums = pd.DataFrame(sums).groupby(aids.codes).sum()
+        return sums.set_axis(aids.categories.take(sums.index))
+
+    def _coordinates_from_sums(self, sums: pd.DataFrame) -> pd.DataFrame:
+        """Mean coordinates from the weighted sums of each AID (see `_coordinate_sums`)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.coordinates == "spherical":
+                meanra = np.degrees(np.arctan2(sums["y_ra"], sums["x_ra"])) % 360
+                meandec = np.degrees(np.arctan2(sums["z_dec"], np.hypot(sums["x_dec"], sums["y_dec"])))
+                coords = {
+                    "meanra": meanra.where(sums["weights_ra"] > 0),
+                    "meandec": meandec.where(sums["weights_dec"] > 0),
+                }
+            else:
+                coords = {"meanra": sums["ra"] / sums["weights_ra"], "meandec": sums["dec"] / sums["weights_dec"]}
+        return pd.DataFrame(coords).rename_axis("aid")
+
+    def coordinates_as_records(self, accumulator: CoordinateAccumulator | None = None) -> dict:
+        """Weighted mean coordinates as records (mapping from AID to a mapping of mean coordinates)
 
-    def coordinates_as_records(self) -> dict:
-        """Weighted mean coordinates as records (mapping from AID to a mapping of mean coordinates)"""
-        return self.mean_coordinates().to_dict("index")
+        Args:
+            accumulator: Keeps the weighted sums of each AID across calls (see `mean_coordinates`)
+        """
+        return self.mean_coordinates(accumulator).to_dict("index")
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import abc
+from typing import Hashable, Iterable, Mapping
+
+from .stores import LRUStore, SQLiteKeyValueStore
+
+Key = tuple[str, Hashable]  # AID and FID
+First = tuple[float, bool]  # MJD of the first detection and whether it was corrected
+
+
+class FirstDetectionStore(abc.ABC):
+    """Keeps the first detection of each AID and FID across batches: its `mjd` and whether it was corrected.
+
+    Strategies that depend on the first detection (e.g., the dubious flag of ZTF) use it in place of the full history
+    of each object. Keys are pairs of AID and FID.
+    """
+
+    @abc.abstractmethod
+    def get(self, keys: Iterable[Key]) -> dict[Key, First]:
+        """First detections kept for the given pairs of AID and FID. Pairs not in the store are not included"""
+
+    @abc.abstractmethod
+    def put(self, firsts: Mapping[Key, First]):
+        """Keeps the first detections of the given pairs of AID and FID, replacing any previous value"""
+
+
+class MemoryFirstDetectionStore(LRUStore, FirstDetectionStore):
+    """In-memory store that keeps only the most recently used pairs of AID and FID
+
+    Args:
+        maxsize: Maximum number of pairs to keep
+    """
+
+
+class SQLiteFirstDetectionStore(SQLiteKeyValueStore, FirstDetectionStore):
+    """Store backed by a local SQLite database. Keeps all pairs of AID and FID
+
+    Args:
+        path: Path to the database file (created if missing)
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "first_detections")
+
+    @staticmethod
+    def _decode(value: list) -> First:
+        mjd, corrected = value
+        return mjd, corrected
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .accumulator import CoordinateAccumulator, MemoryStore
+from .corrector import Corrector
+from .first_detections import FirstDetectionStore, MemoryFirstDetectionStore
+
+
+def _warm_up():
+    """Runs a small correction, so that the first batch in each worker does not pay for imports and caches"""
+    detection = {
+        "aid": "AID",
+        "candid": "candid",
+        "sid": "ZTF",
+        "fid": "g",
+        "mjd": 0.0,
+        "mag": 15.0,
+        "e_mag": 0.1,
+        "ra": 0.0,
+        "e_ra": 1.0,
+        "dec": 0.0,
+        "e_dec": 1.0,
+        "isdiffpos": 1,
+        "forced": False,
+        "new": True,
+        "extra_fields": {"magnr": 15.0, "sigmagnr": 0.1, "distnr": 1.0},
+    }
+    corrector = Corrector([detection])
+    corrector.corrected_as_records()
+    corrector.coordinates_as_records()
+
+
+def _correct_shard(
+    detections: list[dict], store: MemoryStore | None, first_detections: MemoryFirstDetectionStore | None
+) -> tuple[list[str], dict, np.ndarray, np.ndarray, dict, MemoryStore | None, MemoryFirstDetectionStore | None]:
+    """Corrects the detections of a shard (in a worker process)
+
+    Only the computed values are sent back. The records are built from the original detections in the main process.
+
+    Args:
+        detections: Detections of all the AIDs in the shard (without duplicate `candids`)
+        store: Sums for the mean coordinates of the AIDs in the shard, if they are kept across batches
+        first_detections: First detections of the AIDs in the shard, if they are kept across batches
+
+    Returns:
+        tuple: Fields of the detections (besides `candid` and `extra_fields`), positions of the missing values of each
+            field (only for fields with any), corrected magnitudes and flags (rows in the order of
+            `Corrector._MAGNITUDES` and `Corrector._FLAGS`, columns in the order of the detections), mean coordinates,
+            updated sums and updated first detections (if given)
+    """
+    corrector = Corrector(detections, first_detections=first_detections)
+    fields = [field for field in corrector._detections.columns if field not in Corrector._EXTRA_FIELDS]
+    missing = corrector._detections[fields].isna()
+    missing = {field: np.flatnonzero(missing[field]) for field in missing.columns[missing.any()]}
+    corrected = corrector.compute()
+    magnitudes = corrected[Corrector._MAGNITUDES].to_numpy(dtype=float).T
+    flags = corrected[Corrector._FLAGS].to_numpy(dtype=bool).T
+    coords = corrector.coordinates_as_records(None if store is None else CoordinateAccumulator(store))
+    return fields, missing, magnitudes, flags, coords, store, first_detections
+
+
+class ShardedCorrector:
+    """Applies the corrections in a pool of worker processes, splitting the detections in shards by AID.
+
+    The workers are started (and warmed up) on creation and kept for all batches. The output is the same as the one
+    from a single `Corrector` over all the detections, regardless of the number of shards.
+
+    Args:
+        shards: Number of shards (and worker processes)
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        # Spawned workers do not inherit the threads (e.g., from Kafka clients) of the main process
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers=shards, mp_context=context, initializer=_warm_up)
+        for future in [self._executor.submit(int) for _ in range(shards)]:
+            future.result()
+
+    def shard(self, aid: str) -> int:
+        """Shard for the given AID (stable across processes and runs)"""
+        return zlib.crc32(aid.encode()) % self.shards
+
+    def correct(
+        self,
+        detections: list[dict],
+        accumulator: CoordinateAccumulator | None = None,
+        first_detections: FirstDetectionStore | None = None,
+    ) -> tuple[list[dict], dict]:
+        """Corrected detections and mean coordinates.
+
+        Duplicate `candids` are dropped before splitting, keeping the first occurrence (as `Corrector` does).
+
+        Args:
+            detections: List of mappings with all values from generic alert (must include `extra_fields`)
+            accumulator: Keeps the sums for the mean coordinates of each AID across calls (see `Corrector`)
+            first_detections: Keeps the first detection of each AID and FID across calls (see `Corrector`)
+
+        Returns:
+            tuple: Corrected records (see `Corrector.corrected_as_records`) and mean coordinates for each AID (see
+                `Corrector.coordinates_as_records`)
+        """
+        candids, positions, shards = set(), [[] for _ in range(self.shards)], [[] for _ in range(self.shards)]
+        for position, detection in enumerate(detections):
+            if detection["candid"] in candids:
+                continue
+            candids.add(detection["candid"])
+            shard = self.shard(detection["aid"])
+            positions[shard].append(position)
+            shards[shard].append(detection)
+
+        futures, keys = {}, {}
+        for shard, shard_detections in enumerate(shards):
+            if not shard_detections:
+                continue
+            store = None
+            if accumulator is not None:
+                aids = {detection["aid"] for detection in shard_detections}
+                store = MemoryStore(maxsize=len(aids))
+                store.put(accumulator.store.get(aids))
+            shard_first_detections = None
+            if first_detections is not None:
+                keys[shard] = {(detection["aid"], detection["fid"]) for detection in shard_detections}
+                shard_first_detections = MemoryFirstDetectionStore(maxsize=len(keys[shard]))
+                shard_first_detections.put(first_detections.get(keys[shard]))
+            futures[shard] = self._executor.submit(_correct_shard, shard_detections, store, shard_first_detections)
+
+        results = {shard: future.result() for shard, future in futures.items()}
+        # Fields of the output records, as in `Corrector.corrected_as_records` (missing values are set to `None`)
+        fields = dict.fromkeys(["candid", *(field for result in results.values() for field in result[0])])
+
+        records, coords = [None] * len(detections), {}
+        for shard, (_, missing, magnitudes, flags, shard_coords, store, shard_first_detections) in results.items():
+            shard_records = []
+            for position in positions[shard]:
+                record = fields.copy()
+                record.update(detections[position])
+                del record["extra_fields"]  # Moved to the end
+                shard_records.append(record)
+                records[position] = record
+            for field, rows in missing.items():  # E.g., NaN
+                for row in rows.tolist():
+                    shard_records[row][field] = None
+            corrected = Corrector._corrected_values(magnitudes, flags)
+            for field, values in zip([*Corrector._MAGNITUDES, *Corrector._FLAGS], corrected):
+                for record, value in zip(shard_records, values):
+                    record[field] = value
+            for record, position in zip(shard_records, positions[shard]):
+                record["extra_fields"] = detections[position]["extra_fields"]
+            coords.update(shard_coords)
+            if accumulator is not None:
+                accumulator.store.put(store.get(shard_coords))
+            if first_detections is not None:
+                first_detections.put(shard_first_detections.get(keys[shard]))
+        records = [record for record in records if record is not None]  # Duplicated candids are not filled
+        return records, {aid: coords[aid] for aid in sorted(coords)}
+
+    def shutdown(self):
+        """Stops the worker processes"""
+        self._executor.shutdown()
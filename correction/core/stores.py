@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Mapping
+
+
+class LRUStore:
+    """In-memory key/value store that keeps only the most recently used keys
+
+    Args:
+        maxsize: Maximum number of keys to keep
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, keys: Iterable[Hashable]) -> dict:
+        """Values kept for the given keys. Keys not in the store are not included"""
+        found = {}
+        for key in keys:
+            if key in self._data:
+                self._data.move_to_end(key)
+                found[key] = self._data[key]
+        return found
+
+    def put(self, values: Mapping):
+        """Keeps the values of the given keys, replacing any previous value"""
+        for key, value in values.items():
+            self._data[key] = value
+            self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SQLiteKeyValueStore:
+    """Key/value store backed by a table in a local SQLite database. Keeps all keys.
+
+    Keys and values are kept as JSON, so they must be made of strings, numbers, booleans, lists (or tuples) and
+    mappings. Keys are returned as given. Subclasses can override `_decode` to restore values that JSON changes
+    (e.g., tuples become lists).
+
+    Args:
+        path: Path to the database file (created if missing)
+        table: Name of the table (created if missing)
+    """
+
+    _CHUNK = 500  # Keeps the number of query parameters under the SQLite limit
+
+    def __init__(self, path: str, table: str):
+        self.path, self.table = path, table
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def _decode(value: Any) -> Any:
+        """Value as returned by `get`, from the one decoded from JSON"""
+        return value
+
+    def get(self, keys: Iterable[Hashable]) -> dict:
+        """Values kept for the given keys. Keys not in the store are not included"""
+        keys = {json.dumps(key): key for key in keys}  # Given keys by their encoding
+        encoded, found = list(keys), {}
+        for i in range(0, len(encoded), self._CHUNK):
+            chunk = encoded[i : i + self._CHUNK]
+            query = f"SELECT key, value FROM {self.table} WHERE key IN ({', '.join('?' * len(chunk))})"
+            rows = self._connection.execute(query, chunk)
+            found.update((keys[key], self._decode(json.loads(value))) for key, value in rows)
+        return found
+
+    def put(self, values: Mapping):
+        """Keeps the values of the given keys, replacing any previous value"""
+        rows = ((json.dumps(key), json.dumps(value)) for key, value in values.items())
+        self._connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", rows)
+        self._connection.commit()
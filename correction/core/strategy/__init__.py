@@ -1 +1,4 @@
 from . import ztf, lsst
+
+# Strategies are resolved once on import: mapping from survey name (lowercase module name) to strategy module
+REGISTRY = {module.__name__.rsplit(".", 1)[-1]: module for module in (ztf, lsst)}
@@ -0,0 +1,22 @@
+"""Compiled version of the ZTF magnitude correction. Requires `numba` (not part of the strategy registry)"""
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True, error_model="numpy")
+def correct(magnr, sigmagnr, mag, e_mag, isdiffpos, out):  # pragma: no cover (compiled)
+    """Same as `ztf._correct`, computed element-wise without temporary arrays"""
+    mag_corr, e_mag_corr, e_mag_corr_ext = out[0], out[1], out[2]
+    for i in range(mag.size):
+        aux1 = 10.0 ** (-0.4 * magnr[i])
+        aux2 = 10.0 ** (-0.4 * mag[i])
+        aux3 = aux1 + isdiffpos[i] * aux2
+        if aux3 < 0:  # Keeps NaN as NaN, like np.maximum
+            aux3 = 0.0
+        mag_corr[i] = -2.5 * np.log10(aux3)
+
+        ext = aux2 * e_mag[i]
+        ref = aux1 * sigmagnr[i]
+        aux4 = ext * ext - ref * ref
+        e_mag_corr[i] = np.inf if aux4 < 0 else np.sqrt(aux4) / aux3
+        e_mag_corr_ext[i] = ext / aux3
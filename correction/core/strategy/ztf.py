@@ -1,8 +1,14 @@
+from __future__ import annotations
+
 import warnings
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
 
+if TYPE_CHECKING:  # pragma: no cover
+    from ..first_detections import FirstDetectionStore
+
 DISTANCE_THRESHOLD = 1.4
 SCORE_THRESHOLD = 0.4
 CHINR_THRESHOLD = 2
@@ -48,7 +54,7 @@ def is_stellar(detections: pd.DataFrame) -> pd.Series:
     stellar_ps1 = detections["sgscore1"] > SCORE_THRESHOLD
 
     near_ztf = is_corrected(detections)
-    sharpnr_in_range = (SHARPNR_MIN < detections["sharpnr"]) < SHARPNR_MAX
+    sharpnr_in_range = (SHARPNR_MIN < detections["sharpnr"]) & (detections["sharpnr"] < SHARPNR_MAX)
     stellar_ztf = (detections["chinr"] < CHINR_THRESHOLD) & sharpnr_in_range
     return (near_ztf & near_ps1 & stellar_ps1) | (near_ztf & ~near_ps1 & stellar_ztf)
 
@@ -75,6 +81,163 @@ def correct(detections: pd.DataFrame) -> pd.DataFrame:
 
 def is_first_corrected(detections: pd.DataFrame) -> pd.Series:
     """Whether the first detection for each AID and FID has a nearby source"""
-    corrected = is_corrected(detections)
-    idxmin = detections.groupby(["aid", "fid"])["mjd"].transform("idxmin")
-    return corrected[idxmin].set_axis(idxmin.index)
+    corrected = is_corrected(detections).to_numpy()
+    return pd.Series(corrected[_first_positions(detections)], index=detections.index)
+
+
+def evaluate(
+    detections: pd.DataFrame, engine: str = "numpy", first_detections: FirstDetectionStore | None = None
+) -> pd.DataFrame:
+    """Apply magnitude correction and compute all flags in a single pass.
+
+    Equivalent to calling `correct`, `is_corrected`, `is_dubious` and `is_stellar`, but every input column is read
+    only once (as a float array) and intermediate results are written into preallocated buffers.
+
+    With a store of first detections, the dubious flag uses the first detection kept for each AID and FID, unless
+    there is an earlier one among the given detections (which then replaces it in the store). This way, the detections
+    do not need to include the full history of each object.
+
+    Args:
+        detections: ZTF detections
+        engine: Use `numba` for a compiled correction (must be installed). Any other value uses `numpy`
+        first_detections: Keeps the first detection of each AID and FID across calls
+
+    Returns:
+        pd.DataFrame: Corrected magnitudes and errors (`mag_corr`, `e_mag_corr`, `e_mag_corr_ext`) and flags
+            (`corrected`, `dubious`, `stellar`)
+    """
+    magnr, sigmagnr, mag, e_mag, isdiffpos = (
+        _as_float_array(detections[c]) for c in ["magnr", "sigmagnr", "mag", "e_mag", "isdiffpos"]
+    )
+    distnr, distpsnr1, sgscore1, sharpnr, chinr = (
+        _as_float_array(detections[c]) for c in ["distnr", "distpsnr1", "sgscore1", "sharpnr", "chinr"]
+    )
+
+    magnitudes = np.empty((3, len(detections)))
+    if engine == "numba":
+        from ._ztf_numba import correct as _correct_compiled
+
+        _correct_compiled(magnr, sigmagnr, mag, e_mag, isdiffpos, magnitudes)
+    else:
+        _correct(magnr, sigmagnr, mag, e_mag, isdiffpos, magnitudes)
+    mag_corr, e_mag_corr, e_mag_corr_ext = magnitudes
+
+    corrected = distnr < DISTANCE_THRESHOLD
+    first = _first_corrected(detections, corrected, first_detections)
+    dubious = (~corrected & (isdiffpos == -1)) | (first & ~corrected) | (~first & corrected)
+
+    near_ps1 = distpsnr1 < DISTANCE_THRESHOLD
+    stellar_ps1 = sgscore1 > SCORE_THRESHOLD
+    stellar_ztf = (chinr < CHINR_THRESHOLD) & (SHARPNR_MIN < sharpnr) & (sharpnr < SHARPNR_MAX)
+    stellar = corrected & ((near_ps1 & stellar_ps1) | (~near_ps1 & stellar_ztf))
+
+    return pd.DataFrame(
+        {
+            "mag_corr": mag_corr,
+            "e_mag_corr": e_mag_corr,
+            "e_mag_corr_ext": e_mag_corr_ext,
+            "corrected": corrected,
+            "dubious": dubious,
+            "stellar": stellar,
+        },
+        index=detections.index,
+    )
+
+
+def _correct(magnr, sigmagnr, mag, e_mag, isdiffpos, out: np.ndarray):
+    """Same as `correct` over float arrays. Corrected magnitudes and errors are written to the rows of `out`"""
+    mag_corr, e_mag_corr, e_mag_corr_ext = out
+    aux1, aux2, aux4 = np.empty((3, mag.size))
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # possible log10 of 0, sqrt of negative and division by 0; this is expected and returned inf is correct value
+        np.power(10.0, np.multiply(-0.4, magnr, out=aux1), out=aux1)
+        np.power(10.0, np.multiply(-0.4, mag, out=aux2), out=aux2)
+        aux3 = np.multiply(isdiffpos, aux2)
+        np.maximum(np.add(aux1, aux3, out=aux3), 0.0, out=aux3)
+        np.multiply(-2.5, np.log10(aux3, out=mag_corr), out=mag_corr)
+
+        np.multiply(aux2, e_mag, out=e_mag_corr_ext)  # Numerator of the error for extended sources
+        np.square(np.multiply(aux1, sigmagnr, out=aux1), out=aux1)
+        np.subtract(np.square(e_mag_corr_ext, out=aux4), aux1, out=aux4)
+        np.divide(np.sqrt(aux4, out=e_mag_corr), aux3, out=e_mag_corr)
+        e_mag_corr[aux4 < 0] = np.inf
+        np.divide(e_mag_corr_ext, aux3, out=e_mag_corr_ext)
+
+
+def check_first_detections(detections: pd.DataFrame, first_detections: FirstDetectionStore) -> pd.Series:
+    """Detections whose first detection (for its AID and FID) has a different flag in the store than in the detections.
+
+    This compares the result with a store of first detections with the one without it (the store is not updated).
+    If the detections include the full history of each object, there should be no differences.
+
+    Args:
+        detections: ZTF detections
+        first_detections: Keeps the first detection of each AID and FID across calls
+
+    Returns:
+        pd.Series: Whether the flag of the first detection differs, for each detection
+    """
+    corrected = _as_float_array(detections["distnr"]) < DISTANCE_THRESHOLD
+    stateless = _first_corrected(detections, corrected)
+    stateful = _first_corrected(detections, corrected, first_detections, update=False)
+    return pd.Series(stateless != stateful, index=detections.index)
+
+
+def _first_corrected(
+    detections: pd.DataFrame,
+    corrected: np.ndarray,
+    first_detections: FirstDetectionStore | None = None,
+    update: bool = True,
+) -> np.ndarray:
+    """Whether the first detection for each AID and FID has a nearby source, using precomputed `corrected` flags.
+
+    With a store of first detections, kept detections are used unless the given detections have an earlier one
+    (ties go to the kept detection). Earlier detections replace the kept ones if `update` is set.
+    """
+    positions = _first_positions(detections)
+    if first_detections is None:
+        return corrected[positions]
+
+    starts = np.unique(positions)  # First detection of each AID and FID within the detections
+    first, mjd = corrected[starts], _as_float_array(detections["mjd"])[starts]
+    keys = list(zip(detections["aid"].iloc[starts].tolist(), detections["fid"].iloc[starts].tolist()))
+    kept, earlier = first_detections.get(keys), {}
+    for i, key in enumerate(keys):
+        if key in kept and not mjd[i] < kept[key][0]:
+            first[i] = kept[key][1]
+        elif not np.isnan(mjd[i]):
+            earlier[key] = (float(mjd[i]), bool(first[i]))
+    if update and earlier:
+        first_detections.put(earlier)
+    return first[np.searchsorted(starts, positions)]
+
+
+def _first_positions(detections: pd.DataFrame) -> np.ndarray:
+    """Position of the first detection (lowest `mjd`) for the AID and FID of each detection.
+
+    The detections are sorted once by AID, FID and `mjd` (as integer codes, see `_codes`) and the first position of
+    each group is broadcast to all its members. The sort is stable, so ties in `mjd` go to the earliest detection, as
+    with `idxmin`. Missing `mjd` values are sorted last, so they are only first if the whole group is missing.
+    """
+    aid, fid = _codes(detections["aid"]), _codes(detections["fid"])
+    order = np.lexsort((_as_float_array(detections["mjd"]), fid, aid))
+    aid, fid = aid[order], fid[order]
+    starts = np.empty(order.size, dtype=bool)
+    starts[:1] = True
+    np.not_equal(aid[1:], aid[:-1], out=starts[1:])
+    starts[1:] |= fid[1:] != fid[:-1]
+    first = np.empty_like(order)
+    first[order] = order[starts][np.cumsum(starts) - 1]
+    return first
+
+
+def _codes(series: pd.Series) -> np.ndarray:
+    """Integer codes of the values (the same as the internal categories of the `Corrector`, if categorical)"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy()
+    return pd.factorize(series)[0]
+
+
+def _as_float_array(series: pd.Series) -> np.ndarray:
+    """Contiguous float64 array with the values of the series (missing values become NaN)"""
+    return np.ascontiguousarray(series.to_numpy(dtype=np.float64, na_value=np.nan))
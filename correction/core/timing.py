@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import time
+from typing import Callable, ContextManager
+
+_NOT_TIMED = contextlib.nullcontext()
+
+
+class Observer:
+    """Receives the timings of each phase and the counts of rows. Subclasses override any of the methods.
+
+    Timings are only taken once an observer is set (with `set_observer`). Otherwise, `timed` returns a shared context
+    manager that does nothing and `count` returns right away, so the instrumented code pays only for a function call.
+    The observer is shared by all threads in the process. Worker processes (see `ShardedCorrector`) start without one.
+    """
+
+    def enter(self, phase: str, survey: str):
+        """Called right before the phase starts"""
+
+    def exit(self, phase: str, survey: str, seconds: float):
+        """Called after the phase ends (even if it failed), with its duration in seconds"""
+
+    def count(self, phase: str, survey: str, rows: int):
+        """Called with the number of rows processed by the phase"""
+
+
+_observer: Observer | None = None
+
+
+def set_observer(observer: Observer | None):
+    """Sets the observer for all phases (or removes it, if `None`)"""
+    global _observer
+    _observer = observer
+
+
+def get_observer() -> Observer | None:
+    """Current observer, if any"""
+    return _observer
+
+
+class _Timer:
+    __slots__ = ("observer", "phase", "survey", "start")
+
+    def __init__(self, observer: Observer, phase: str, survey: str):
+        self.observer, self.phase, self.survey = observer, phase, survey
+
+    def __enter__(self):
+        self.observer.enter(self.phase, self.survey)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.observer.exit(self.phase, self.survey, time.perf_counter() - self.start)
+
+
+def timed(phase: str, survey: str = "") -> ContextManager:
+    """Context manager that reports the duration of the phase to the observer, if any
+
+    Args:
+        phase: Name of the phase (e.g., `pre_execute`)
+        survey: Survey the phase applies to (empty if it applies to all)
+    """
+    if _observer is None:
+        return _NOT_TIMED
+    return _Timer(_observer, phase, survey)
+
+
+def count(phase: str, rows: int, survey: str = ""):
+    """Reports the number of rows processed by the phase to the observer, if any
+
+    Args:
+        phase: Name of the phase (e.g., `pre_execute`)
+        rows: Number of rows
+        survey: Survey the rows belong to (empty if it applies to all)
+    """
+    if _observer is not None:
+        _observer.count(phase, survey, rows)
+
+
+def timed_function(phase: str) -> Callable[[Callable], Callable]:
+    """Decorator that reports the duration of each call to the function as the given phase (see `timed`)"""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _observer is None:
+                return function(*args, **kwargs)
+            with _Timer(_observer, phase, ""):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,41 @@
+import tracemalloc
+
+import pytest
+
+
+@pytest.fixture
+def throughput(benchmark):
+    """Runs the benchmark and adds the throughput (`alerts_per_second`) and peak memory (`peak_memory_mib`) to it.
+
+    The peak memory is measured with `tracemalloc` in a separate run, so that it does not affect the timings.
+    """
+
+    def run(function, *args, alerts: int):
+        result = benchmark(function, *args)
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_mib"] = round(peak / 2**20, 2)
+        if benchmark.stats is not None:  # Not available if benchmarks are disabled
+            benchmark.extra_info["alerts_per_second"] = round(alerts / benchmark.stats.stats.mean)
+        return result
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    session = getattr(config, "_benchmarksession", None)
+    benchmarks = [bench for bench in getattr(session, "benchmarks", []) if "alerts_per_second" in bench.extra_info]
+    if not benchmarks:
+        return
+    terminalreporter.section("throughput")
+    width = max(len(bench.name) for bench in benchmarks)
+    terminalreporter.write_line(f"{'Name':<{width}}  {'alerts/s':>12}  {'peak MiB':>10}")
+    for bench in benchmarks:
+        info = bench.extra_info
+        terminalreporter.write_line(
+            f"{bench.name:<{width}}  {info['alerts_per_second']:>12,}  {info['peak_memory_mib']:>10.2f}"
+        )
@@ -0,0 +1,187 @@
+import random
+
+from tests.utils import atlas_alert, non_detection, ztf_alert, ztf_extra_fields
+
+
+def generate_detections(n: int, *, seed: int = 0, per_aid: int = 20) -> list[dict]:
+    rng = random.Random(seed)
+    detections = []
+    for i in range(n):
+        aid = f"AID{i // per_aid}"
+        extra_fields = ztf_extra_fields(
+            magnr=rng.uniform(14, 20),
+            sigmagnr=rng.uniform(0.01, 0.1),
+            distnr=rng.uniform(0, 3),
+            distpsnr1=rng.uniform(0, 3),
+            sgscore1=rng.random(),
+            chinr=rng.uniform(0, 4),
+            sharpnr=rng.uniform(-0.5, 0.5),
+        )
+        detection = ztf_alert(
+            aid=aid,
+            oid=f"ZTF{i // per_aid}",
+            pid=i,
+            candid=str(i),
+            parent_candid=None,
+            mag=rng.uniform(15, 21),
+            e_mag=rng.uniform(0.01, 0.2),
+            ra=rng.gauss(100, 1e-4),
+            e_ra=rng.uniform(0.1, 1),
+            dec=rng.gauss(-30, 1e-4),
+            e_dec=rng.uniform(0.1, 1),
+            isdiffpos=rng.choice([-1, 1]),
+            fid=rng.choice(["g", "r"]),
+            mjd=rng.uniform(59000, 60000),
+            new=i % 2 == 0,
+            extra_fields=extra_fields,
+        )
+        detections.append(detection)
+    return detections
+
+
+def generate_non_detections(n: int, *, seed: int = 0, per_aid: int = 20) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        non_detection(
+            aid=f"AID{i // per_aid}",
+            oid=f"ZTF{i // per_aid}",
+            sid="ZTF",
+            tid="ZTF",
+            fid=rng.choice(["g", "r"]),
+            mjd=rng.uniform(59000, 60000),
+            diffmaglim=rng.uniform(19, 21),
+        )
+        for i in range(n)
+    ]
+
+
+def _ztf_detection(rng: random.Random, aid: str, oid: str, candid: str, mjd: float, forced: bool) -> dict:
+    extra_fields = ztf_extra_fields(
+        magnr=rng.uniform(14, 20),
+        sigmagnr=rng.uniform(0.01, 0.1),
+        distnr=rng.uniform(0, 3),
+        distpsnr1=rng.uniform(0, 3),
+        sgscore1=rng.random(),
+        chinr=rng.uniform(0, 4),
+        sharpnr=rng.uniform(-0.5, 0.5),
+    )
+    return ztf_alert(
+        aid=aid,
+        oid=oid,
+        pid=rng.randrange(10**12),
+        candid=candid,
+        parent_candid=None,
+        mag=rng.uniform(15, 21),
+        e_mag=rng.uniform(0.01, 0.2),
+        ra=rng.gauss(100, 1e-4),
+        e_ra=rng.uniform(0.1, 1),
+        dec=rng.gauss(-30, 1e-4),
+        e_dec=rng.uniform(0.1, 1),
+        isdiffpos=rng.choice([-1, 1]),
+        fid=rng.choice(["g", "r"]),
+        mjd=mjd,
+        has_stamp=not forced,
+        forced=forced,
+        new=False,
+        extra_fields=extra_fields,
+    )
+
+
+def _atlas_detection(rng: random.Random, aid: str, oid: str, candid: str, mjd: float) -> dict:
+    return atlas_alert(
+        aid=aid,
+        oid=oid,
+        pid=rng.randrange(10**12),
+        candid=candid,
+        parent_candid=None,
+        tid=f"ATLAS-0{rng.randrange(4)}",
+        mag=rng.uniform(15, 19),
+        e_mag=rng.uniform(0.01, 0.2),
+        ra=rng.gauss(100, 1e-4),
+        e_ra=rng.uniform(0.1, 1),
+        dec=rng.gauss(-30, 1e-4),
+        e_dec=rng.uniform(0.1, 1),
+        isdiffpos=rng.choice([-1, 1]),
+        fid=rng.choice(["c", "o"]),
+        mjd=mjd,
+        new=False,
+    )
+
+
+def _lsst_detection(rng: random.Random, aid: str, oid: str, candid: str, mjd: float) -> dict:
+    detection = _atlas_detection(rng, aid, oid, candid, mjd)
+    detection.update(sid="LSST", tid="LSST", fid=rng.choice("ugrizy"), extra_fields={"diaObject": None})
+    return detection
+
+
+def generate_messages(
+    n: int,
+    *,
+    seed: int = 0,
+    surveys: tuple[float, float, float] = (0.7, 0.2, 0.1),
+    history: int = 100,
+    forced: float = 0.1,
+    repeated: float = 0.2,
+) -> list[dict]:
+    """Batch of `n` alerts (messages as produced by the previous step), the same for the same arguments.
+
+    Each alert belongs to a new AID, with the new detection last, after its previous detections and non-detections.
+    Some AIDs get a second alert in the same batch, with the whole history repeated (duplicate `candids`).
+
+    Args:
+        n: Number of alerts
+        seed: Seed for the random values
+        surveys: Fraction of AIDs from ZTF, ATLAS and LSST, respectively
+        history: Maximum number of previous detections of ZTF AIDs (the others have up to a tenth)
+        forced: Fraction of previous ZTF detections that are forced photometry
+        repeated: Fraction of alerts that are for an AID already in the batch
+    """
+    rng = random.Random(seed)
+    messages = []
+    for i in range(n):
+        if messages and rng.random() < repeated:
+            previous = rng.choice(messages)
+            aid, oid = previous["aid"], previous["detections"][0]["oid"]
+            detections = [{**det, "new": False} for det in previous["detections"]]
+            non_detections = list(previous["non_detections"])
+            survey = detections[-1]["sid"]
+        else:
+            aid, oid = f"AID{i}", f"OID{i}"
+            detections, non_detections = [], []
+            survey = rng.choices(["ZTF", "ATLAS", "LSST"], weights=surveys)[0]
+        mjd = detections[-1]["mjd"] if detections else rng.uniform(59000, 59500)
+
+        if not detections and survey == "ZTF":
+            for j in range(rng.randrange(history)):
+                is_forced = rng.random() < forced
+                mjd += rng.expovariate(1 / 3)
+                detections.append(_ztf_detection(rng, aid, oid, f"{oid}-{j}{'f' if is_forced else ''}", mjd, is_forced))
+            for j in range(rng.randrange(history // 2)):
+                non_detections.append(
+                    non_detection(
+                        aid=aid,
+                        oid=oid,
+                        sid="ZTF",
+                        tid="ZTF",
+                        fid=rng.choice(["g", "r"]),
+                        mjd=rng.uniform(59000, mjd),
+                        diffmaglim=rng.uniform(19, 21),
+                    )
+                )
+        elif not detections:
+            create = _atlas_detection if survey == "ATLAS" else _lsst_detection
+            for j in range(rng.randrange(history // 10)):
+                mjd += rng.expovariate(1 / 3)
+                detections.append(create(rng, aid, oid, f"{oid}-{j}", mjd))
+
+        mjd += rng.expovariate(1 / 3)
+        candid = f"{oid}-{i}n"
+        if survey == "ZTF":
+            new = _ztf_detection(rng, aid, oid, candid, mjd, False)
+        elif survey == "ATLAS":
+            new = _atlas_detection(rng, aid, oid, candid, mjd)
+        else:
+            new = _lsst_detection(rng, aid, oid, candid, mjd)
+        new["new"] = True
+        messages.append({"aid": aid, "detections": detections + [new], "non_detections": non_detections})
+    return messages
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+from correction import Corrector
+from tests.benchmarks.generator import generate_detections
+from tests.utils import as_columns
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_corrector_from_records(benchmark, size):
+    detections = generate_detections(size)
+    benchmark.group = f"corrector-init-{size}"
+    benchmark(Corrector, detections)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_corrector_from_columns(benchmark, size):
+    columns, extra_fields = as_columns(generate_detections(size), Corrector._EXTRA_FIELDS)
+    benchmark.group = f"corrector-init-{size}"
+    benchmark(Corrector.from_columns, columns, extra_fields)
+
+
+def _groupby_mean_coordinates(corrector):
+    # Reference implementation of the mean coordinates with a callback per AID (previous implementation)
+    non_forced = corrector._detections[~corrector._detections["forced"]]
+    coords = {}
+    for label in ["ra", "dec"]:
+        sigmas = Corrector.arcsec2dec(non_forced[f"e_{label}"])
+        grouped = non_forced.groupby("aid")[label]
+        coords[f"mean{label}"] = grouped.agg(lambda s: Corrector.weighted_mean(s, sigmas.loc[s.index]))
+    return pd.DataFrame(coords)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("mode", ["linear", "spherical"])
+def test_mean_coordinates(benchmark, mode, size):
+    corrector = Corrector(generate_detections(size), coordinates=mode)
+    benchmark.group = f"mean-coordinates-{size}"
+    benchmark(corrector.mean_coordinates)
+
+
+@pytest.mark.parametrize("size", SIZES[:-1])
+def test_mean_coordinates_groupby_callback(benchmark, size):
+    corrector = Corrector(generate_detections(size))
+    benchmark.group = f"mean-coordinates-{size}"
+    benchmark(_groupby_mean_coordinates, corrector)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_corrected_as_records(benchmark, size):
+    corrector = Corrector(generate_detections(size))
+    corrector.compute()
+    benchmark.group = f"corrected-as-records-{size}"
+    benchmark(corrector.corrected_as_records)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_detections_memory(benchmark, size):
+    # Memory of the internal frame (with the compact dtypes) is reported along with the time to build it
+    benchmark.group = f"corrector-init-{size}"
+    corrector = benchmark(Corrector, generate_detections(size))
+    benchmark.extra_info["frame_mib"] = corrector._detections.memory_usage(deep=True).sum() / 2**20
@@ -0,0 +1,33 @@
+import io
+
+import fastavro
+import pytest
+
+from correction._step import CorrectionStep
+from correction._step.encoding import AvroEncoder
+from correction._step.settings import get_output_schema
+from tests.benchmarks.test_step import MESSAGES, _execute_result
+
+
+def _fastavro_containers(schema: dict, messages: list[dict]) -> list[bytes]:
+    # Same as `apf.producers.KafkaProducer` (one container for each message)
+    output = []
+    for message in messages:
+        out = io.BytesIO()
+        fastavro.writer(out, schema, [message])
+        output.append(out.getvalue())
+    return output
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_encode_output_with_fastavro(benchmark, messages):
+    output = CorrectionStep.pre_produce(_execute_result(messages))
+    benchmark.group = f"encode-output-{messages}"
+    benchmark(_fastavro_containers, fastavro.parse_schema(get_output_schema()), output)
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_encode_output_by_columns(benchmark, messages):
+    output = CorrectionStep.pre_produce(_execute_result(messages))
+    benchmark.group = f"encode-output-{messages}"
+    benchmark(AvroEncoder(get_output_schema()).encode_containers, output)
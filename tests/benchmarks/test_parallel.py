@@ -0,0 +1,39 @@
+import os
+import time
+
+import pytest
+
+from correction import Corrector
+from correction.core.parallel import ShardedCorrector
+from tests.benchmarks.generator import generate_detections
+
+SIZE = 50_000
+SHARDS = sorted({1, 2, 4, os.cpu_count() or 1})
+
+
+def _single_corrector(detections):
+    corrector = Corrector(detections)
+    return corrector.corrected_as_records(), corrector.coordinates_as_records()
+
+
+def test_single_corrector(benchmark):
+    detections = generate_detections(SIZE)
+    benchmark.group = f"sharded-{SIZE}"
+    benchmark(_single_corrector, detections)
+
+
+@pytest.mark.parametrize("shards", SHARDS)
+def test_sharded_corrector(benchmark, shards):
+    detections = generate_detections(SIZE)
+    sharded_corrector = ShardedCorrector(shards)
+    benchmark.group = f"sharded-{SIZE}"
+    main_process = []  # CPU time of the main process, which bounds the speedup with enough cores
+
+    def correct():
+        start = time.process_time()
+        sharded_corrector.correct(detections)
+        main_process.append(time.process_time() - start)
+
+    benchmark(correct)
+    benchmark.extra_info["main_process_seconds"] = min(main_process)
+    sharded_corrector.shutdown()
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from correction._step import CorrectionStep
+from correction._step.consumers import MemoryConsumer
+from correction._step.producers import MemoryProducer
+from tests.benchmarks.generator import generate_detections
+
+BATCHES = 10
+IO_DELAY = 0.05  # Seconds to consume and to deliver each batch
+
+
+class SlowConsumer(MemoryConsumer):
+    def consume(self):
+        for batch in super().consume():
+            time.sleep(IO_DELAY)
+            yield batch
+
+
+class SlowProducer(MemoryProducer):
+    def flush(self):
+        time.sleep(IO_DELAY / 2)  # Both the main and scribe producers are flushed
+
+
+def _batches():
+    batches = []
+    for i in range(BATCHES):
+        detections = generate_detections(1_000, seed=i)
+        for detection in detections:
+            detection["aid"] = f"{detection['aid']}-{i}"
+        batches.append([{"detections": detections, "non_detections": []}])
+    return batches
+
+
+def _run(batches, pipeline):
+    config = {
+        "CONSUMER_CONFIG": {"CLASS": "tests.benchmarks.test_pipeline.SlowConsumer", "MESSAGES": batches},
+        "PRODUCER_CONFIG": {"CLASS": "tests.benchmarks.test_pipeline.SlowProducer"},
+        "SCRIBE_PRODUCER_CONFIG": {"CLASS": "tests.benchmarks.test_pipeline.SlowProducer"},
+        "PIPELINE_CONFIG": {"MAX_IN_FLIGHT": 1} if pipeline else None,
+        # Sequential steps only flush the outputs with the background scribe
+        "SCRIBE_BACKGROUND_CONFIG": {"WORKERS": 1, "MAX_PENDING": 8, "CHUNK_SIZE": 10_000},
+    }
+    CorrectionStep(config=config).start()
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_step_run(benchmark, pipeline, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batches = _batches()
+    benchmark.group = f"step-run-{BATCHES}-batches"
+    benchmark.pedantic(_run, args=(batches, pipeline), rounds=3)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Creates the step from the settings (with local stand-ins for Kafka) and processes a single message
+_SCRIPT = """
+from correction._step import CorrectionStep
+from correction._step.settings import settings_creator
+from tests.utils import ztf_alert
+
+settings = settings_creator()
+settings.pop("METRICS_CONFIG")
+settings["CONSUMER_CONFIG"] = {
+    "CLASS": "correction._step.consumers.MemoryConsumer",
+    "MESSAGES": [[{"aid": "AID1", "detections": [ztf_alert(oid="OID1", new=True)], "non_detections": []}]],
+}
+settings["PRODUCER_CONFIG"]["CLASS"] = "correction._step.producers.MemoryProducer"
+settings["SCRIBE_PRODUCER_CONFIG"]["CLASS"] = "correction._step.producers.MemoryProducer"
+step = CorrectionStep(config=settings)
+step.start()
+assert len(step.producer.messages) == 1
+"""
+
+_ENVIRONMENT = {
+    "CONSUMER_SERVER": "localhost:9092",
+    "CONSUMER_TOPICS": "correction",
+    "CONSUMER_GROUP_ID": "correction",
+    "PRODUCER_SERVER": "localhost:9092",
+    "PRODUCER_TOPIC": "correction",
+    "SCRIBE_SERVER": "localhost:9092",
+    "SCRIBE_TOPIC": "scribe",
+}
+
+
+def _run(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, **_ENVIRONMENT, "PYTHONPATH": root}
+    subprocess.run([sys.executable, "-c", _SCRIPT], cwd=tmp_path, env=env, check=True)
+
+
+def test_time_to_first_message(benchmark, tmp_path):
+    benchmark.group = "startup"
+    benchmark.pedantic(_run, args=(tmp_path,), rounds=5, iterations=1)
@@ -0,0 +1,134 @@
+import io
+import json
+from unittest import mock
+
+import fastavro
+import pandas as pd
+import pytest
+
+from correction._step import CorrectionStep, consumers, producers
+from tests.benchmarks.generator import generate_detections, generate_non_detections
+from tests.integration.schema import SCHEMA
+from tests.utils import correction_step
+
+MESSAGES = [50, 500, 5_000]
+PER_AID = 20
+
+
+def _pre_produce_reference(result: dict):
+    # Reference implementation through dataframes grouped by AID (previous implementation)
+    detections = pd.DataFrame(result["detections"]).groupby("aid")
+    non_detections = pd.DataFrame(result["non_detections"]).groupby("aid")
+    output = []
+    for aid, dets in detections:
+        try:
+            nd = non_detections.get_group(aid).to_dict("records")
+        except KeyError:
+            nd = []
+        output.append(
+            {
+                "aid": aid,
+                "meanra": result["coords"][aid]["meanra"],
+                "meandec": result["coords"][aid]["meandec"],
+                "detections": dets.to_dict("records"),
+                "non_detections": nd,
+            }
+        )
+    return output
+
+
+def _execute_result(messages: int) -> dict:
+    step = correction_step()
+    message = {
+        "detections": generate_detections(messages * PER_AID, per_aid=PER_AID),
+        "non_detections": generate_non_detections(messages * PER_AID // 2, per_aid=PER_AID // 2),
+    }
+    return step.execute(message)
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_pre_produce(benchmark, messages):
+    result = _execute_result(messages)
+    benchmark.group = f"pre-produce-{messages}"
+    benchmark(CorrectionStep.pre_produce, result)
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_pre_produce_through_dataframes(benchmark, messages):
+    result = _execute_result(messages)
+    benchmark.group = f"pre-produce-{messages}"
+    benchmark(_pre_produce_reference, result)
+
+
+@pytest.mark.parametrize("messages", MESSAGES[:-1])
+@pytest.mark.parametrize("encoder", ["json", "orjson"])
+def test_produce_scribe(benchmark, encoder, messages):
+    if encoder == "orjson":
+        pytest.importorskip("orjson")
+    step, result = correction_step(), _execute_result(messages)
+    benchmark.group = f"produce-scribe-{messages}"
+    dumps = json.dumps if encoder == "json" else producers._orjson_dumps
+    with mock.patch("correction._step.step.dumps", dumps):
+        benchmark(step.produce_scribe, result["detections"])
+
+
+def _drop_duplicates_reference(non_detections: list[dict]) -> list[dict]:
+    # Reference implementation through a dataframe (previous implementation)
+    return pd.DataFrame(non_detections).drop_duplicates(["oid", "fid", "mjd"]).to_dict("records")
+
+
+def _repeated_non_detections(messages: int) -> list[dict]:
+    # Each AID appears in two messages of the batch, with the same history
+    non_detections = generate_non_detections(messages * PER_AID // 2, per_aid=PER_AID)
+    return non_detections + non_detections
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_unique_non_detections(benchmark, messages):
+    non_detections = _repeated_non_detections(messages)
+    benchmark.group = f"unique-non-detections-{messages}"
+    benchmark(CorrectionStep._unique_non_detections, non_detections)
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+def test_unique_non_detections_through_dataframe(benchmark, messages):
+    non_detections = _repeated_non_detections(messages)
+    benchmark.group = f"unique-non-detections-{messages}"
+    benchmark(_drop_duplicates_reference, non_detections)
+
+
+def _payloads(messages: int) -> list[bytes]:
+    # Each message has the detections of a single AID, encoded as by the previous step
+    schema = fastavro.parse_schema({**SCHEMA, "name": "alert_message"})
+    detections = generate_detections(messages * PER_AID, per_aid=PER_AID)
+    payloads = []
+    for i in range(messages):
+        message = {
+            "aid": f"AID{i}",
+            "detections": [
+                {"pid": 1, "parent_candid": None, **det} for det in detections[i * PER_AID : (i + 1) * PER_AID]
+            ],
+            "non_detections": [],
+        }
+        out = io.BytesIO()
+        fastavro.writer(out, schema, [message])
+        payloads.append(out.getvalue())
+    return payloads
+
+
+def _decode_and_execute(step: CorrectionStep, payloads: list[bytes]) -> dict:
+    # Same as the default consumer, decoding each message to a mapping
+    messages = [next(fastavro.reader(io.BytesIO(payload))) for payload in payloads]
+    return step.execute(step.pre_execute(messages))
+
+
+def _decode_columns_and_execute(step: CorrectionStep, payloads: list[bytes]) -> dict:
+    return step.execute(step.pre_execute([consumers.decode_columns(payloads)]))
+
+
+@pytest.mark.parametrize("messages", MESSAGES)
+@pytest.mark.parametrize("decoder", ["records", "columns"])
+def test_decode_and_execute(benchmark, decoder, messages):
+    step, payloads = correction_step(), _payloads(messages)
+    benchmark.group = f"decode-and-execute-{messages}"
+    benchmark(_decode_and_execute if decoder == "records" else _decode_columns_and_execute, step, payloads)
@@ -0,0 +1,64 @@
+import functools
+
+import pytest
+
+from correction import Corrector
+from correction._step import CorrectionStep
+from correction._step.producers import MemoryProducer
+from tests.benchmarks.generator import generate_messages
+from tests.utils import correction_step
+
+# Number of alerts in each batch (mixed surveys, long ZTF histories, forced photometry and repeated AIDs)
+ALERTS = [100, 1_000]
+
+
+def _step() -> CorrectionStep:
+    return correction_step(producer=MemoryProducer(), scribe_producer=MemoryProducer())
+
+
+def _end_to_end(step: CorrectionStep, messages: list[dict]):
+    result = step.post_execute(step.execute(step.pre_execute(messages)))
+    step.produce(step.pre_produce(result))
+    step.producer.messages.clear()
+    step.scribe_producer.messages.clear()
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_corrector_throughput(throughput, alerts):
+    detections = _step().pre_execute(generate_messages(alerts))["detections"]
+    throughput(Corrector, detections, alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_mean_coordinates_throughput(throughput, alerts):
+    corrector = Corrector(_step().pre_execute(generate_messages(alerts))["detections"])
+    throughput(functools.partial(corrector.mean_coordinates, rebuild=True), alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_pre_execute_throughput(throughput, alerts):
+    throughput(_step().pre_execute, generate_messages(alerts), alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_execute_throughput(throughput, alerts):
+    step = _step()
+    throughput(step.execute, step.pre_execute(generate_messages(alerts)), alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_pre_produce_throughput(throughput, alerts):
+    step = _step()
+    throughput(step.pre_produce, step.execute(step.pre_execute(generate_messages(alerts))), alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_produce_scribe_throughput(throughput, alerts):
+    step = _step()
+    detections = step.execute(step.pre_execute(generate_messages(alerts)))["detections"]
+    throughput(step.produce_scribe, detections, alerts=alerts)
+
+
+@pytest.mark.parametrize("alerts", ALERTS)
+def test_end_to_end_throughput(throughput, alerts):
+    throughput(_end_to_end, _step(), generate_messages(alerts), alerts=alerts)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from correction import Corrector
+from correction.core.strategy import ztf
+from tests.benchmarks.generator import generate_detections
+
+SIZES = [10_000, 100_000]
+ENGINES = ["numpy", "numba"]
+
+
+def _arrays(size):
+    detections = Corrector(generate_detections(size))._detections
+    return [ztf._as_float_array(detections[c]) for c in ["magnr", "sigmagnr", "mag", "e_mag", "isdiffpos"]]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ztf_correction_kernel(benchmark, engine, size):
+    if engine == "numba":
+        pytest.importorskip("numba")
+        from correction.core.strategy._ztf_numba import correct
+    else:
+        correct = ztf._correct
+    arrays = _arrays(size)
+    out = np.empty((3, size))
+    correct(*arrays, out)  # Warm up (compilation for numba)
+    benchmark.group = f"ztf-correct-{size}"
+    benchmark(correct, *arrays, out)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ztf_evaluate(benchmark, engine, size):
+    if engine == "numba":
+        pytest.importorskip("numba")
+    detections = Corrector(generate_detections(size))._detections
+    ztf.evaluate(detections, engine=engine)  # Warm up (compilation for numba)
+    benchmark.group = f"ztf-evaluate-{size}"
+    benchmark(ztf.evaluate, detections, engine=engine)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("method", ["lexsort", "groupby"])
+def test_ztf_first_detection(benchmark, method, size):
+    detections = Corrector(generate_detections(size))._detections
+    benchmark.group = f"ztf-first-detection-{size}"
+    if method == "lexsort":
+        benchmark(ztf._first_positions, detections)
+    else:  # Previous implementation
+        benchmark(lambda: detections.groupby(["aid", "fid"], observed=True)["mjd"].transform("idxmin"))
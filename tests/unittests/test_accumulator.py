@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from correction import Corrector
+from correction.core.accumulator import CoordinateAccumulator, MemoryStore, SQLiteStore
+from tests.utils import ztf_alert
+
+
+def _detections(size, start=0, aids=5, new=True):
+    rng = np.random.default_rng(start)
+    return [
+        ztf_alert(
+            candid=f"c{i}",
+            aid=f"AID{i % aids}",
+            ra=rng.uniform(0, 360),
+            e_ra=rng.uniform(0.1, 1),
+            dec=rng.uniform(-90, 90),
+            e_dec=rng.uniform(0.1, 1),
+            forced=bool(i % 7 == 0),
+            mjd=float(i),
+            new=new,
+        )
+        for i in range(start, start + size)
+    ]
+
+
+def test_memory_store_evicts_least_recently_used_aids():
+    store = MemoryStore(maxsize=2)
+    store.put({"AID1": {"a": 1.0}, "AID2": {"a": 2.0}})
+    store.get(["AID1"])
+    store.put({"AID3": {"a": 3.0}})
+    assert len(store) == 2
+    assert store.get(["AID1", "AID2", "AID3"]) == {"AID1": {"a": 1.0}, "AID3": {"a": 3.0}}
+
+
+def test_sqlite_store_keeps_sums_across_instances(tmp_path):
+    path = str(tmp_path / "coordinates.db")
+    SQLiteStore(path).put({"AID1": {"a": 1.0}, "AID2": {"a": 2.0}})
+    SQLiteStore(path).put({"AID2": {"a": 3.0}})
+    assert SQLiteStore(path).get(["AID1", "AID2", "AID3"]) == {"AID1": {"a": 1.0}, "AID2": {"a": 3.0}}
+
+
+def test_sqlite_store_gets_more_aids_than_query_parameter_limit(tmp_path):
+    store = SQLiteStore(str(tmp_path / "coordinates.db"))
+    store.put({f"AID{i}": {"a": float(i)} for i in range(2000)})
+    assert len(store.get([f"AID{i}" for i in range(2001)])) == 2000
+
+
+def test_accumulator_ignores_aids_stored_with_different_sums():
+    accumulator = CoordinateAccumulator()
+    accumulator.put(pd.DataFrame({"a": [1.0], "b": [2.0]}, index=["AID1"]), pd.Series({"AID1": 3.0}))
+    sums, last_mjd = accumulator.get(["AID1"], ["a", "b"])
+    assert sums.loc["AID1"].tolist() == [1.0, 2.0]
+    assert last_mjd.to_dict() == {"AID1": 3.0}
+    sums, last_mjd = accumulator.get(["AID1"], ["a", "c"])
+    assert sums.empty and last_mjd.empty
+
+
+@pytest.mark.parametrize("coordinates", ["linear", "spherical"])
+@pytest.mark.parametrize("store", [MemoryStore, SQLiteStore])
+def test_incremental_mean_coordinates_are_same_as_from_full_history(coordinates, store, tmp_path):
+    accumulator = CoordinateAccumulator(MemoryStore() if store is MemoryStore else SQLiteStore(str(tmp_path / "db")))
+    history = _detections(50)
+    Corrector(history, coordinates=coordinates).mean_coordinates(accumulator)
+
+    # The new batch includes the previous detections (not new) of each AID
+    batch = [{**det, "new": False} for det in history] + _detections(30, start=50)
+    incremental = Corrector(batch, coordinates=coordinates).mean_coordinates(accumulator)
+    stateless = Corrector(batch, coordinates=coordinates).mean_coordinates()
+    assert_frame_equal(incremental.sort_index(), stateless, check_exact=False, rtol=1e-12)
+
+
+def test_incremental_mean_coordinates_only_uses_new_detections_for_known_aids():
+    accumulator = CoordinateAccumulator()
+    Corrector([ztf_alert(candid="c1", ra=100, mjd=1.0, new=True)]).mean_coordinates(accumulator)
+
+    # The old detection is not in the batch, but is still considered
+    batch = [ztf_alert(candid="c2", ra=200, mjd=2.0, new=True), ztf_alert(candid="c3", ra=300, new=False)]
+    assert np.isclose(Corrector(batch).mean_coordinates(accumulator).loc["AID1", "meanra"], 150)
+
+
+@pytest.mark.parametrize("store", [MemoryStore, SQLiteStore])
+def test_incremental_mean_coordinates_are_not_changed_by_redelivered_batch(store, tmp_path):
+    accumulator = CoordinateAccumulator(MemoryStore() if store is MemoryStore else SQLiteStore(str(tmp_path / "db")))
+    Corrector([ztf_alert(candid="c1", ra=10, mjd=1.0, new=True)]).mean_coordinates(accumulator)
+
+    batch = [ztf_alert(candid="c2", ra=20, mjd=2.0, new=True), ztf_alert(candid="c1", ra=10, mjd=1.0, new=False)]
+    first = Corrector(batch).mean_coordinates(accumulator)
+    redelivered = Corrector(batch).mean_coordinates(accumulator)
+    assert np.isclose(first.loc["AID1", "meanra"], 15)
+    assert_frame_equal(redelivered, first)
+
+
+def test_incremental_mean_coordinates_do_not_add_new_detections_up_to_latest_mjd_added():
+    accumulator = CoordinateAccumulator()
+    Corrector([ztf_alert(candid="c1", ra=10, mjd=2.0, new=True)]).mean_coordinates(accumulator)
+
+    batch = [ztf_alert(candid="c2", ra=20, mjd=2.0, new=True), ztf_alert(candid="c3", ra=30, mjd=3.0, new=True)]
+    assert np.isclose(Corrector(batch).mean_coordinates(accumulator).loc["AID1", "meanra"], 20)
+    assert accumulator.get(["AID1"], ["weights_ra", "weights_dec", "ra", "dec"])[1].to_dict() == {"AID1": 3.0}
+
+
+def test_mean_coordinates_rebuilds_accumulator_from_all_detections():
+    accumulator = CoordinateAccumulator()
+    Corrector([ztf_alert(candid="c1", ra=100, new=True)]).mean_coordinates(accumulator)
+
+    batch = [ztf_alert(candid="c2", ra=200, new=True), ztf_alert(candid="c3", ra=300, new=False)]
+    assert np.isclose(Corrector(batch).mean_coordinates(accumulator, rebuild=True).loc["AID1", "meanra"], 250)
+    assert np.isclose(Corrector(batch[1:]).mean_coordinates(accumulator).loc["AID1", "meanra"], 250)
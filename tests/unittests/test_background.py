@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+from correction._step.background import BackgroundTasks
+
+
+def test_background_tasks_are_finished_after_flush():
+    results = []
+    tasks = BackgroundTasks(workers=2)
+    for i in range(10):
+        tasks.submit(results.append, i)
+    tasks.flush()
+    assert sorted(results) == list(range(10))
+    tasks.shutdown()
+
+
+def test_background_tasks_flush_raises_error_from_tasks():
+    def fail():
+        raise ValueError("failed")
+
+    tasks = BackgroundTasks()
+    tasks.submit(fail)
+    with pytest.raises(ValueError):
+        tasks.flush()
+    tasks.flush()  # Errors are only raised once
+    tasks.shutdown()
+
+
+def test_background_tasks_submit_waits_when_too_many_are_pending():
+    release = threading.Event()
+    tasks = BackgroundTasks(workers=1, max_pending=2)
+    tasks.submit(release.wait)
+    tasks.submit(release.wait)
+
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (tasks.submit(release.wait), submitted.set()))
+    thread.start()
+    time.sleep(0.1)
+    assert not submitted.is_set()
+    release.set()
+    thread.join(timeout=5)
+    assert submitted.is_set()
+    tasks.shutdown()
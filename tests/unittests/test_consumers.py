@@ -0,0 +1,144 @@
+import io
+from unittest import mock
+
+import fastavro
+
+from correction._step.consumers import ColumnarKafkaConsumer, decode_columns
+from correction.core.columns import DetectionColumns
+from correction.core.corrector import Corrector
+from tests.integration.schema import SCHEMA
+from tests.utils import correction_step, ztf_alert, atlas_alert, non_detection
+
+# The record for detections (`alert`) would clash with the outer one (`alerce.alert`) in newer versions of fastavro
+_PARSED_SCHEMA = fastavro.parse_schema({**SCHEMA, "name": "alert_message"})
+
+
+def encode(aid, detections, non_detections):
+    """Encodes a message as the previous step does (a container with a single record)"""
+    defaults = {"oid": "OID", "pid": 1, "parent_candid": None, "new": True}
+    message = {
+        "aid": aid,
+        "detections": [{**defaults, **det} for det in detections],
+        "non_detections": [
+            {"oid": "OID", "sid": "ZTF", "tid": "ZTF", "diffmaglim": 20.0, **non} for non in non_detections
+        ],
+    }
+    out = io.BytesIO()
+    fastavro.writer(out, _PARSED_SCHEMA, [message])
+    return out.getvalue()
+
+
+def decode(payload):
+    return next(fastavro.reader(io.BytesIO(payload)))
+
+
+payloads = [
+    encode(
+        "AID1",
+        [
+            ztf_alert(candid="c1", new=False),
+            ztf_alert(candid="c2", mjd=2.0, fid="r", isdiffpos=-1, extra_fields={"distnr": 2.0}),
+            atlas_alert(candid="a1", mjd=1.5),
+        ],
+        [non_detection(fid="g", mjd=0.5)],
+    ),
+    encode(
+        "AID2",
+        [ztf_alert(aid="AID2", candid="c1"), ztf_alert(aid="AID2", candid="c3", mag=12.0, parent_candid="c1")],
+        [non_detection(aid="AID2", fid="g", mjd=0.5), non_detection(aid="AID2", fid="r", mjd=0.7)],
+    ),
+]
+
+
+def _as_columns(detections):
+    return {
+        field: [det.get(field) for det in detections] for field in {field: None for det in detections for field in det}
+    }
+
+
+def test_detection_columns_keep_first_position_and_prefer_new_duplicate():
+    columns = DetectionColumns(["magnr"])
+    columns.extend(_as_columns([ztf_alert(candid="c1", new=False, mag=1.0), ztf_alert(candid="c2", new=False)]))
+    columns.extend(_as_columns([ztf_alert(candid="c1", new=True, mag=2.0, extra_fields={})]))
+    columns.extend(_as_columns([ztf_alert(candid="c2", new=False, mag=3.0), ztf_alert(candid="c2", new=True, mag=4.0)]))
+
+    built, extra_fields = columns.build()
+    assert len(columns) == 2 and columns.total == 5
+    assert built["candid"] == ["c1", "c2"]
+    assert built["mag"] == [2.0, 4.0]
+    assert built["new"] == [True, True]
+    assert built["magnr"] == [None, 10.0]
+    assert extra_fields[0] == {}
+
+
+def test_detection_columns_fill_fields_missing_from_some_columns():
+    columns = DetectionColumns([])
+    columns.extend(_as_columns([atlas_alert(candid="a1")]))
+    columns.extend(_as_columns([atlas_alert(candid="a2", extra="value"), atlas_alert(candid="a1", new=True)]))
+    columns.extend(_as_columns([atlas_alert(candid="a3")]))
+
+    built, _ = columns.build()
+    assert built["extra"] == [None, "value", None]
+    assert built["new"] == [True, None, None]
+    assert len({len(column) for column in built.values()}) == 1
+
+
+def test_decode_columns_gives_same_corrections_as_decoded_messages():
+    messages = [decode(payload) for payload in payloads]
+    batch = decode_columns(payloads)
+
+    step = correction_step()
+    expected = step.execute(step.pre_execute(messages))
+    expected_metrics = dict(step.metrics)
+    result = step.execute(step.pre_execute([batch]))
+
+    assert result == expected
+    assert step.metrics == expected_metrics
+    assert step.metrics["detections_dedup_ratio"] > 0
+
+
+def test_decode_columns_gives_same_columns_as_corrector():
+    messages = [decode(payload) for payload in payloads]
+    unique = correction_step().pre_execute(messages)["detections"]
+    columns, extra_fields = decode_columns(payloads)["detections"].build()
+
+    assert columns["candid"] == [det["candid"] for det in unique]
+    assert columns["new"] == [det["new"] for det in unique]
+    expected = Corrector(unique).corrected_as_records()
+    assert Corrector.from_columns(columns, extra_fields).corrected_as_records() == expected
+
+
+@mock.patch("correction._step.consumers.KafkaConsumer.__init__", return_value=None)
+def test_columnar_kafka_consumer_yields_each_batch_decoded(_):
+    consumer = ColumnarKafkaConsumer({})
+    consumer.dynamic_topic = False
+    consumer.logger = mock.MagicMock()
+    consumer.config = {"consume.messages": 2, "consume.timeout": 0}
+    kafka_messages = []
+    for payload in payloads:
+        kafka_message = mock.MagicMock()
+        kafka_message.error.return_value = None
+        kafka_message.value.return_value = payload
+        kafka_messages.append(kafka_message)
+    consumer.consumer = mock.MagicMock()
+    consumer.consumer.consume.side_effect = [kafka_messages, [], StopIteration]
+
+    batches = consumer.consume()
+    batch = next(batches)
+
+    assert consumer.messages == kafka_messages
+    assert batch["n_non_detections"] == 3
+    assert len(batch["non_detections"]) == 2
+    assert batch["detections"].build() == decode_columns(payloads)["detections"].build()
+
+
+def test_step_reports_number_of_messages_in_batches_decoded_into_columns():
+    step = correction_step()
+    step.prometheus_metrics, step.send_metrics = mock.MagicMock(), mock.MagicMock()
+    step.commit, step.extra_metrics = False, ["aid"]
+
+    step._post_execute(step.execute(step._pre_execute(decode_columns(payloads))))
+
+    step.prometheus_metrics.consumed_messages.observe.assert_called_once_with(2)
+    step.prometheus_metrics.processed_messages.observe.assert_called_once_with(2)
+    assert step.send_metrics.call_args.kwargs["n_messages"] == 2
@@ -1,12 +1,15 @@
 from copy import deepcopy
 from unittest import mock
 
+import pytest
+
 import pandas as pd
 import numpy as np
 from pandas.testing import assert_frame_equal
 
 from correction import Corrector
-from tests.utils import ztf_alert, atlas_alert
+from correction.core import strategy
+from tests.utils import ztf_alert, atlas_alert, as_columns
 
 detections = [ztf_alert(candid="c1"), atlas_alert(candid="c2")]
 MAG_CORR_COLS = ["mag_corr", "e_mag_corr", "e_mag_corr_ext"]
@@ -19,78 +22,164 @@ def test_corrector_removes_duplicate_candids():
     assert (corrector._detections.index == ["c"]).all()
 
 
-def test_mask_survey_returns_only_alerts_from_requested_survey():
-    corrector = Corrector(detections)
-    expected_ztf = pd.Series([True, False], index=["c1", "c2"])
-    assert (corrector._survey_mask("ZtF") == expected_ztf).all()
-    assert (corrector._survey_mask("ATlas") == ~expected_ztf).all()
+def test_corrector_from_columns_removes_duplicate_candids_keeping_first():
+    columns, extra_fields = as_columns([ztf_alert(candid="c"), atlas_alert(candid="c")], Corrector._EXTRA_FIELDS)
+    corrector = Corrector.from_columns(columns, extra_fields)
+    assert (corrector._detections.index == ["c"]).all()
+    assert corrector.corrected_as_records()[0]["extra_fields"] is extra_fields[0]
+
+
+def test_corrector_from_columns_fills_missing_extra_fields_with_nan():
+    columns, extra_fields = as_columns([atlas_alert(candid="c")], [])
+    corrector = Corrector.from_columns(columns, extra_fields)
+    assert corrector._detections[Corrector._EXTRA_FIELDS].isna().all().all()
+
+
+def test_corrector_from_columns_has_same_output_as_from_records():
+    altered_detections = deepcopy(detections) + [ztf_alert(candid="c3", isdiffpos=-1, aid="AID2")]
+    altered_detections[0]["extra_fields"]["distnr"] = 2
+    expected = Corrector(altered_detections)
+    corrector = Corrector.from_columns(*as_columns(altered_detections, Corrector._EXTRA_FIELDS))
+    assert corrector.corrected_as_records() == expected.corrected_as_records()
+    assert_frame_equal(corrector.mean_coordinates(), expected.mean_coordinates())
+
+
+def test_corrector_applies_internal_dtypes_once_on_creation():
+    altered_detections = deepcopy(detections) + [ztf_alert(candid="c3", aid="AID2", has_stamp=None)]
+    altered_detections[0]["extra_fields"]["magnr"] = "not a number"
+    dtypes = Corrector(altered_detections)._detections.dtypes
+    assert all(isinstance(dtypes[column], pd.CategoricalDtype) for column in ["aid", "sid", "fid", "tid"])
+    assert dtypes["has_stamp"] == "boolean" and dtypes["forced"] == bool
+    assert (dtypes[Corrector._EXTRA_FIELDS] == float).all()
+
+
+def test_corrected_as_records_is_not_changed_by_internal_dtypes():
+    altered_detections = deepcopy(detections) + [ztf_alert(candid="c3", aid="AID2", has_stamp=None, tid=None)]
+    records = Corrector(altered_detections).corrected_as_records()
+    for record, detection in zip(records, altered_detections):
+        assert {key: record[key] for key in detection} == detection
+        assert all(type(record[key]) is type(detection[key]) for key in detection)
+
+
+def test_corrector_engine_defaults_to_numpy(monkeypatch):
+    monkeypatch.delenv("CORRECTION_ENGINE", raising=False)
+    assert Corrector(detections).engine == "numpy"
+
+
+@mock.patch("correction.core.corrector.importlib.util.find_spec", return_value=mock.MagicMock())
+def test_corrector_engine_is_taken_from_environment_if_not_given(_, monkeypatch):
+    monkeypatch.setenv("CORRECTION_ENGINE", "NUMBA")
+    assert Corrector(detections).engine == "numba"
+    assert Corrector(detections, engine="numpy").engine == "numpy"
+
+
+@mock.patch("correction.core.corrector.importlib.util.find_spec", return_value=None)
+def test_corrector_engine_falls_back_to_numpy_if_numba_is_not_installed(_):
+    assert Corrector(detections, engine="numba").engine == "numpy"
+
+
+def test_corrector_raises_error_for_unknown_engine():
+    with pytest.raises(ValueError):
+        Corrector(detections, engine="unknown")
+
+
+def test_partition_surveys_returns_positions_of_alerts_for_each_survey_with_strategy():
+    altered_detections = deepcopy(detections) + [ztf_alert(candid="c3", sid="zTf"), atlas_alert(candid="c4")]
+    corrector = Corrector(altered_detections)
+    assert set(corrector._partitions) == {"ztf"}
+    assert (corrector._partitions["ztf"] == [0, 2]).all()
+
+
+def _evaluated(index, value):
+    return pd.DataFrame(
+        {**{c: value for c in MAG_CORR_COLS}, "corrected": True, "dubious": True, "stellar": True}, index
+    )
 
 
 @mock.patch("correction.core.corrector.strategy")
-def test_apply_all_calls_requested_function_to_masked_detections_for_each_submodule(mock_strategy):
-    mock_strategy.ztf = mock.MagicMock()
-    mock_strategy.ztf.function = mock.MagicMock()
-    mock_strategy.ztf.function.return_value = None
-    mock_strategy.dummy = mock.MagicMock()
-    mock_strategy.dummy.function = mock.MagicMock()
+def test_compute_calls_evaluate_on_detections_of_each_survey_with_strategy(mock_strategy):
+    mock_ztf, mock_dummy = mock.MagicMock(), mock.MagicMock()
+    mock_ztf.evaluate.side_effect = lambda dets, **_: _evaluated(dets.index, 1.0)
+    mock_strategy.REGISTRY = {"ztf": mock_ztf, "dummy": mock_dummy}
 
     corrector = Corrector(detections)
-    corrector._apply_all_surveys("function")
-    (called,) = mock_strategy.ztf.function.call_args.args
+    output = corrector.compute()
+    (called,) = mock_ztf.evaluate.call_args.args
     assert_frame_equal(called, corrector._detections.loc[["c1"]])
-    mock_strategy.dummy.function.assert_not_called()
+    assert mock_ztf.evaluate.call_args.kwargs == {"engine": corrector.engine}
+    mock_dummy.evaluate.assert_not_called()
+    assert (output.loc["c1"] == 1).all()
 
 
 @mock.patch("correction.core.corrector.strategy")
-def test_apply_all_returns_a_series_with_default_value_and_dtype_if_no_columns_are_given(mock_strategy):
+def test_compute_applies_separate_functions_if_strategy_has_no_evaluate(mock_strategy):
+    mock_ztf = mock.MagicMock(spec=["correct", "is_corrected", "is_dubious", "is_stellar"])
+    mock_ztf.correct.side_effect = lambda dets, **_: _evaluated(dets.index, 1.0)[MAG_CORR_COLS]
+    for function in ["is_corrected", "is_dubious", "is_stellar"]:
+        getattr(mock_ztf, function).side_effect = lambda dets: pd.Series(True, index=dets.index)
+    mock_strategy.REGISTRY = {"ztf": mock_ztf}
+
     corrector = Corrector(detections)
-    output = corrector._apply_all_surveys("function", default=-1, dtype=float)
-    assert isinstance(output, pd.Series)
-    assert output.dtype == float
-    assert (output.index == ["c1", "c2"]).all()
-    assert (output == -1).all()
+    output = corrector.compute()
+    for function in ["correct", "is_corrected", "is_dubious", "is_stellar"]:
+        (called,) = getattr(mock_ztf, function).call_args.args
+        assert_frame_equal(called, corrector._detections.loc[["c1"]])
+    assert (output.loc["c1"] == 1).all()
 
 
 @mock.patch("correction.core.corrector.strategy")
-def test_apply_all_returns_a_df_with_default_value_and_dtype_if_columns_are_given(mock_strategy):
+def test_compute_returns_default_values_for_surveys_without_strategy(mock_strategy):
     corrector = Corrector(detections)
-    output = corrector._apply_all_surveys("function", default=-1, columns=["a", "b"], dtype=float)
-    assert isinstance(output, pd.DataFrame)
-    assert (output.dtypes == float).all()
-    assert (output.columns == ["a", "b"]).all()
+    output = corrector.compute()
+    assert (output.columns == MAG_CORR_COLS + ["corrected", "dubious", "stellar"]).all()
     assert (output.index == ["c1", "c2"]).all()
-    assert (output == -1).all().all()
+    assert (output[MAG_CORR_COLS].dtypes == float).all() and output[MAG_CORR_COLS].isna().all().all()
+    assert (output[["corrected", "dubious", "stellar"]].dtypes == bool).all()
+    assert not output[["corrected", "dubious", "stellar"]].any().any()
+
 
+@mock.patch("correction.core.corrector.strategy")
+def test_compute_sets_magnitudes_of_non_corrected_detections_to_nan(mock_strategy):
+    mock_ztf = mock.MagicMock()
+    mock_ztf.evaluate.side_effect = lambda dets, **_: _evaluated(dets.index, 1.0).assign(corrected=False)
+    mock_strategy.REGISTRY = {"ztf": mock_ztf}
 
-def test_corrected_calls_apply_all_with_function_is_corrected():
     corrector = Corrector(detections)
-    corrector._apply_all_surveys = mock.MagicMock()
-    _ = corrector.corrected
-    corrector._apply_all_surveys.assert_called_with("is_corrected", default=False, dtype=bool)
+    assert corrector.compute().loc["c1", MAG_CORR_COLS].isna().all()
 
 
-def test_corrected_is_false_for_surveys_without_strategy():
-    corrector = Corrector(detections)
-    assert (corrector.corrected == pd.Series([True, False], index=["c1", "c2"])).all()
+def test_compute_applies_each_strategy_function_once_for_all_outputs():
+    mock_ztf = mock.MagicMock(wraps=strategy.ztf, spec=strategy.ztf)
+    mock_lsst = mock.MagicMock(wraps=strategy.lsst, spec=strategy.lsst)
+    with mock.patch.dict(strategy.REGISTRY, ztf=mock_ztf, lsst=mock_lsst):
+        corrector = Corrector(detections + [atlas_alert(candid="c3", sid="LSST")])
+        corrector.corrected_as_records()
+        _ = corrector.corrected, corrector.dubious, corrector.stellar
+        corrector.corrected_magnitudes()
+    assert mock_ztf.evaluate.call_count == 1
+    for function in ["is_corrected", "is_dubious", "is_stellar", "correct"]:
+        assert getattr(mock_lsst, function).call_count == 1
 
 
-def test_dubious_calls_apply_all_with_function_is_dubious():
-    corrector = Corrector(detections)
-    corrector._apply_all_surveys = mock.MagicMock()
-    _ = corrector.dubious
-    corrector._apply_all_surveys.assert_called_with("is_dubious", default=False, dtype=bool)
+def test_compute_applies_strategy_functions_again_after_invalidation():
+    mock_ztf = mock.MagicMock(wraps=strategy.ztf, spec=strategy.ztf)
+    with mock.patch.dict(strategy.REGISTRY, ztf=mock_ztf):
+        corrector = Corrector(detections)
+        first = corrector.compute()
+        corrector.invalidate()
+        second = corrector.compute()
+    assert_frame_equal(first, second)
+    assert mock_ztf.evaluate.call_count == 2
 
 
-def test_dubious_is_false_for_surveys_without_strategy():
+def test_corrected_is_false_for_surveys_without_strategy():
     corrector = Corrector(detections)
-    assert (corrector.dubious == pd.Series([False, False], index=["c1", "c2"])).all()
+    assert (corrector.corrected == pd.Series([True, False], index=["c1", "c2"])).all()
 
 
-def test_stellar_calls_apply_all_with_function_is_stellar():
+def test_dubious_is_false_for_surveys_without_strategy():
     corrector = Corrector(detections)
-    corrector._apply_all_surveys = mock.MagicMock()
-    _ = corrector.stellar
-    corrector._apply_all_surveys.assert_called_with("is_stellar", default=False, dtype=bool)
+    assert (corrector.dubious == pd.Series([False, False], index=["c1", "c2"])).all()
 
 
 def test_stellar_is_false_for_surveys_without_strategy():
@@ -98,13 +187,6 @@ def test_stellar_is_false_for_surveys_without_strategy():
     assert (corrector.stellar == pd.Series([True, False], index=["c1", "c2"])).all()
 
 
-def test_corrected_magnitudes_calls_apply_all_with_function_correct():
-    corrector = Corrector(detections)
-    corrector._apply_all_surveys = mock.MagicMock()
-    corrector.corrected_magnitudes()
-    corrector._apply_all_surveys.assert_any_call("correct", columns=MAG_CORR_COLS, dtype=float)
-
-
 def test_corrected_magnitudes_is_nan_for_surveys_without_strategy():
     corrector = Corrector(detections)
     assert ~corrector.corrected_magnitudes().loc["c1"].isna().any()
@@ -125,6 +207,23 @@ def test_corrected_as_records_sets_infinite_values_to_zero_magnitude():
     assert all(corrector.corrected_as_records()[0][col] == Corrector._ZERO_MAG for col in MAG_CORR_COLS)
 
 
+def test_corrected_as_records_keeps_negative_infinite_values():
+    altered_detections = deepcopy(detections)
+    altered_detections[0].update(isdiffpos=-1, e_mag=-1.0)
+    record = Corrector(altered_detections).corrected_as_records()[0]
+    assert record["mag_corr"] == Corrector._ZERO_MAG
+    assert record["e_mag_corr_ext"] == -np.inf
+
+
+def test_corrected_as_records_sets_infinite_values_to_zero_magnitude_with_numba_engine():
+    pytest.importorskip("numba")
+    altered_detections = deepcopy(detections)
+    altered_detections[0]["isdiffpos"] = -1
+    corrector = Corrector(altered_detections, engine="numba")
+    assert corrector.engine == "numba"
+    assert all(corrector.corrected_as_records()[0][col] == Corrector._ZERO_MAG for col in MAG_CORR_COLS)
+
+
 def test_corrected_as_records_restores_original_input_with_new_corrected_fields():
     corrector = Corrector(detections)
     records = corrector.corrected_as_records()
@@ -134,6 +233,18 @@ def test_corrected_as_records_restores_original_input_with_new_corrected_fields(
     assert records == detections
 
 
+def test_corrected_as_records_sets_missing_values_to_none_and_keeps_extra_fields():
+    altered_detections = deepcopy(detections)
+    altered_detections[0]["parent_candid"] = "p1"
+    altered_detections[1]["parent_candid"] = None
+    altered_detections[1]["mag"] = np.nan
+    records = Corrector(altered_detections).corrected_as_records()
+    assert records[1]["parent_candid"] is None
+    assert records[1]["mag"] is None
+    assert all(records[1][col] is None for col in MAG_CORR_COLS)  # Non-corrected magnitudes
+    assert all(record["extra_fields"] is det["extra_fields"] for record, det in zip(records, altered_detections))
+
+
 def test_weighted_mean_with_equal_weights_is_same_as_ordinary_mean():
     vals, weights = pd.Series([100, 200]), pd.Series([5, 5])
     assert Corrector.weighted_mean(vals, weights) == 150
@@ -153,28 +264,110 @@ def test_arcsec2deg_applies_proper_conversion():
     assert np.isclose(Corrector.arcsec2dec(1), 1 / 3600)
 
 
-def test_calculate_coordinates_with_equal_weights_is_same_as_ordinary_mean():
+def test_mean_coordinates_with_equal_weights_is_same_as_ordinary_mean():
     wdetections = [ztf_alert(candid="c1", ra=100, e_ra=5), atlas_alert(candid="c2", ra=200, e_ra=5)]
     corrector = Corrector(wdetections)
-    assert corrector._calculate_coordinates("ra")["meanra"].loc["AID1"] == 150
+    assert corrector.mean_coordinates()["meanra"].loc["AID1"] == 150
 
 
-def test_calculate_coordinates_with_a_very_high_error_does_not_consider_its_value_in_mean():
+def test_mean_coordinates_with_a_very_high_error_does_not_consider_its_value_in_mean():
     wdetections = [ztf_alert(candid="c1", ra=100, e_ra=5), atlas_alert(candid="c2", ra=200, e_ra=1e6)]
     corrector = Corrector(wdetections)
-    assert np.isclose(corrector._calculate_coordinates("ra")["meanra"].loc["AID1"], 100)
+    assert np.isclose(corrector.mean_coordinates()["meanra"].loc["AID1"], 100)
 
 
-def test_calculate_coordinates_with_an_very_small_error_only_considers_its_value_in_mean():
+def test_mean_coordinates_with_an_very_small_error_only_considers_its_value_in_mean():
     wdetections = [ztf_alert(candid="c1", ra=100, e_ra=5), atlas_alert(candid="c2", ra=200, e_ra=1e-6)]
     corrector = Corrector(wdetections)
-    assert np.isclose(corrector._calculate_coordinates("ra")["meanra"].loc["AID1"], 200)
+    assert np.isclose(corrector.mean_coordinates()["meanra"].loc["AID1"], 200)
 
 
-def test_calculate_coordinates_ignores_forced_photometry():
+def test_mean_coordinates_ignores_forced_photometry():
     wdetections = [ztf_alert(candid="c1", ra=100, e_ra=1), atlas_alert(candid="c2", ra=200, forced=True, e_ra=1)]
     corrector = Corrector(wdetections)
-    assert np.isclose(corrector._calculate_coordinates("ra")["meanra"].loc["AID1"], 100)
+    assert np.isclose(corrector.mean_coordinates()["meanra"].loc["AID1"], 100)
+
+
+def test_mean_coordinates_are_nan_for_aids_with_only_forced_photometry():
+    wdetections = [ztf_alert(candid="c1"), atlas_alert(candid="c2", aid="AID2", forced=True)]
+    corrector = Corrector(wdetections)
+    coords = corrector.mean_coordinates()
+    assert coords.loc["AID2"].isna().all()
+    assert (coords.loc["AID1"] == 1).all()
+
+
+def test_mean_coordinates_is_same_as_weighted_mean_of_non_forced_detections_for_each_aid():
+    rng = np.random.default_rng(42)
+    wdetections = [
+        ztf_alert(
+            candid=f"c{i}",
+            aid=f"AID{i % 7}",
+            ra=rng.uniform(0, 360),
+            e_ra=rng.uniform(0.1, 1),
+            dec=rng.uniform(-90, 90),
+            e_dec=rng.uniform(0.1, 1),
+            forced=bool(i % 5 == 0),
+        )
+        for i in range(100)
+    ]
+    coords = Corrector(wdetections).mean_coordinates()
+    for aid, group in pd.DataFrame(wdetections).query("~forced").groupby("aid"):
+        for label in ["ra", "dec"]:
+            expected = Corrector.weighted_mean(group[label], Corrector.arcsec2dec(group[f"e_{label}"]))
+            assert np.isclose(coords.loc[aid, f"mean{label}"], expected, rtol=1e-12, atol=0)
+
+
+def test_corrector_coordinates_mode_is_taken_from_environment_if_not_given(monkeypatch):
+    monkeypatch.delenv("CORRECTION_COORDINATES", raising=False)
+    assert Corrector(detections).coordinates == "linear"
+    monkeypatch.setenv("CORRECTION_COORDINATES", "Spherical")
+    assert Corrector(detections).coordinates == "spherical"
+    assert Corrector(detections, coordinates="linear").coordinates == "linear"
+
+
+def test_corrector_raises_error_for_unknown_coordinates_mode():
+    with pytest.raises(ValueError):
+        Corrector(detections, coordinates="unknown")
+
+
+def test_spherical_mean_coordinates_across_ra_zero():
+    wdetections = [ztf_alert(candid="c1", ra=359.9, dec=10), atlas_alert(candid="c2", ra=0.1, dec=10)]
+    coords = Corrector(wdetections, coordinates="spherical").mean_coordinates()
+    assert np.isclose((coords.loc["AID1", "meanra"] + 180) % 360 - 180, 0)
+    assert np.isclose(coords.loc["AID1", "meandec"], 10, atol=1e-4)
+
+
+def test_spherical_mean_coordinates_near_pole():
+    wdetections = [ztf_alert(candid="c1", ra=10, dec=89.9), atlas_alert(candid="c2", ra=190, dec=89.9)]
+    coords = Corrector(wdetections, coordinates="spherical").mean_coordinates()
+    assert np.isclose(coords.loc["AID1", "meandec"], 90)
+
+
+def test_spherical_mean_coordinates_are_nan_for_aids_with_only_forced_photometry():
+    wdetections = [ztf_alert(candid="c1"), atlas_alert(candid="c2", aid="AID2", forced=True)]
+    coords = Corrector(wdetections, coordinates="spherical").mean_coordinates()
+    assert coords.loc["AID2"].isna().all()
+    assert np.allclose(coords.loc["AID1"], 1)
+
+
+def test_spherical_mean_coordinates_is_same_as_linear_away_from_ra_zero_and_poles():
+    rng = np.random.default_rng(42)
+    centers = {f"AID{i}": (rng.uniform(1, 359), rng.uniform(-80, 80)) for i in range(10)}
+    wdetections = [
+        ztf_alert(
+            candid=f"c{i}",
+            aid=aid,
+            ra=centers[aid][0] + rng.normal(0, 1e-4),
+            e_ra=rng.uniform(0.1, 1),
+            dec=centers[aid][1] + rng.normal(0, 1e-4),
+            e_dec=rng.uniform(0.1, 1),
+        )
+        for i, aid in enumerate(rng.choice(list(centers), 200))
+    ]
+    linear = Corrector(wdetections, coordinates="linear").mean_coordinates()
+    spherical = Corrector(wdetections, coordinates="spherical").mean_coordinates()
+    assert (linear.index == spherical.index).all()
+    assert np.allclose(linear, spherical, rtol=0, atol=1e-9)
 
 
 def test_coordinates_dataframe_calculates_mean_for_each_aid():
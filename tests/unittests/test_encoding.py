@@ -0,0 +1,132 @@
+import io
+
+import fastavro
+import numpy as np
+import pytest
+
+from correction._step import CorrectionStep
+from correction._step.encoding import AvroDecoder, AvroEncoder, decode_containers
+from correction._step.settings import get_output_schema
+from correction.core.corrector import Corrector
+from tests.utils import ztf_alert, atlas_alert, non_detection, ztf_extra_fields
+
+_OPTIONAL = {"oid": "OID", "pid": 1, "parent_candid": None, "new": True}
+_NON_DETECTION = {"oid": "OID", "sid": "ZTF", "tid": "ZTF", "diffmaglim": 20.0}
+
+detections = [
+    ztf_alert(candid="c1", **{**_OPTIONAL, "parent_candid": "c0"}),
+    ztf_alert(candid="c2", mjd=2.0, isdiffpos=-1, extra_fields=ztf_extra_fields(distnr=2.0, chinr=2**40)),
+    ztf_alert(candid="c3", aid="AID2", mag=25.0, extra_fields={"flag": True, "raw": b"\x00", "name": "ñ"}),
+    atlas_alert(candid="a1", mjd=1.5, extra_fields={}),
+]
+non_detections = [non_detection(fid="g", mjd=0.5, **_NON_DETECTION), non_detection(aid="AID2", fid="r", mjd=0.7)]
+
+
+def _output():
+    corrector = Corrector([{**_OPTIONAL, **det} for det in detections])
+    result = {
+        "detections": corrector.corrected_as_records(),
+        "non_detections": [{**_NON_DETECTION, **nd} for nd in non_detections],
+        "coords": corrector.coordinates_as_records(),
+    }
+    return CorrectionStep.pre_produce(result) + [{"aid": "AID3", "meanra": 1.0, "meandec": 1.0, "detections": []}]
+
+
+def _fastavro_schemaless(schema, record):
+    out = io.BytesIO()
+    fastavro.schemaless_writer(out, fastavro.parse_schema(schema), record)
+    return out.getvalue()
+
+
+def test_encoder_gives_same_bytes_as_fastavro_for_output_messages():
+    messages = _output()
+    encoded = AvroEncoder(get_output_schema()).encode(messages)
+    assert encoded == [_fastavro_schemaless(get_output_schema(), message) for message in messages]
+
+
+def test_encoder_containers_decode_to_same_records_as_fastavro_writer():
+    messages, schema = _output(), fastavro.parse_schema(get_output_schema())
+    for message, container in zip(messages, AvroEncoder(schema).encode_containers(messages)):
+        out = io.BytesIO()
+        fastavro.writer(out, schema, [message])
+        out.seek(0)
+        np.testing.assert_equal(list(fastavro.reader(io.BytesIO(container))), list(fastavro.reader(out)))
+
+
+def test_encoder_chooses_same_union_branch_as_fastavro():
+    schema = {
+        "type": "record",
+        "name": "values",
+        "fields": [{"name": "value", "type": ["null", "int", "float", "double", "long", "string", "boolean"]}],
+    }
+    records = [{"value": value} for value in [None, 1, 2**40, 1.5, "a", True, False, 2**31, -(2**31), -1]]
+    assert AvroEncoder(schema).encode(records) == [_fastavro_schemaless(schema, record) for record in records]
+
+
+@pytest.mark.parametrize("field", ["e_ra", "mjd"])  # float and double
+def test_encoder_raises_same_error_as_fastavro_for_null_in_non_nullable_floats(field):
+    message = _output()[0]
+    message["detections"][0] = {**message["detections"][0], field: None}
+    with pytest.raises(TypeError):
+        _fastavro_schemaless(get_output_schema(), message)
+    with pytest.raises(TypeError):
+        AvroEncoder(get_output_schema()).encode([message])
+
+
+def test_encoder_raises_error_for_missing_fields_without_defaults():
+    with pytest.raises(ValueError):
+        AvroEncoder(get_output_schema()).encode([{"aid": "AID1", "meanra": 1.0}])
+
+
+def test_encoder_does_not_support_enums():
+    schema = {
+        "type": "record",
+        "name": "x",
+        "fields": [{"name": "e", "type": {"type": "enum", "name": "e", "symbols": ["A"]}}],
+    }
+    with pytest.raises(NotImplementedError):
+        AvroEncoder(schema)
+
+
+def _containers(schema, messages, **kwargs):
+    out = io.BytesIO()
+    fastavro.writer(out, fastavro.parse_schema(schema), messages, **kwargs)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("codec", ["null", "deflate"])
+def test_decoder_gives_same_values_as_fastavro_reader_for_output_messages(codec):
+    messages, schema = _output(), get_output_schema()
+    payloads = [_containers(schema, messages[:2], codec=codec, sync_interval=1), _containers(schema, messages[2:])]
+    expected = [message for payload in payloads for message in fastavro.reader(io.BytesIO(payload))]
+
+    records, columns = decode_containers(payloads, "detections")
+    assert records == [{k: v for k, v in message.items() if k != "detections"} for message in expected]
+    detections = [detection for message in expected for detection in message["detections"]]
+    np.testing.assert_equal(columns, {field: [det[field] for det in detections] for field in detections[0]})
+
+
+def test_decoder_fills_columns_missing_from_schema_of_some_containers():
+    def schema(*fields):
+        items = {"type": "record", "name": "item", "fields": [{"name": field, "type": "double"} for field in fields]}
+        return {"type": "record", "name": "x", "fields": [{"name": "items", "type": {"type": "array", "items": items}}]}
+
+    payloads = [
+        _containers(schema("a"), [{"items": [{"a": 1.0}]}]),
+        _containers(schema("a", "b"), [{"items": [{"a": 2.0, "b": 3.0}, {"a": 4.0, "b": 5.0}]}]),
+        _containers(schema("a"), [{"items": [{"a": 6.0}]}]),
+    ]
+    assert decode_containers(payloads, "items") == (
+        [{}, {}, {}],
+        {"a": [1.0, 2.0, 4.0, 6.0], "b": [None, 3.0, 5.0, None]},
+    )
+
+
+def test_decoder_does_not_support_other_codecs():
+    with pytest.raises(NotImplementedError):
+        decode_containers([_containers(get_output_schema(), _output(), codec="bzip2")], "detections")
+
+
+def test_decoder_requires_array_of_records_for_columns():
+    with pytest.raises(ValueError):
+        AvroDecoder(get_output_schema(), "aid")
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from correction import Corrector
+from correction.core.first_detections import MemoryFirstDetectionStore, SQLiteFirstDetectionStore
+from correction.core.strategy import ztf
+from tests.utils import ztf_alert, ztf_extra_fields
+
+
+def _detections(size, start=0, aids=5, new=True):
+    rng = np.random.default_rng(start)
+    return [
+        ztf_alert(
+            candid=f"c{i}",
+            aid=f"AID{i % aids}",
+            fid=["g", "r"][i % 2],
+            mjd=float(i),
+            isdiffpos=int(rng.choice([-1, 1])),
+            extra_fields=ztf_extra_fields(distnr=rng.uniform(0, 3)),
+            new=new,
+        )
+        for i in range(start, start + size)
+    ]
+
+
+def _store(kind, tmp_path):
+    return MemoryFirstDetectionStore() if kind == "memory" else SQLiteFirstDetectionStore(str(tmp_path / "db"))
+
+
+def test_memory_store_evicts_least_recently_used_pairs():
+    store = MemoryFirstDetectionStore(maxsize=2)
+    store.put({("AID1", "g"): (1.0, True), ("AID1", "r"): (2.0, False)})
+    store.get([("AID1", "g")])
+    store.put({("AID2", "g"): (3.0, True)})
+    assert len(store) == 2
+    assert store.get([("AID1", "g"), ("AID1", "r"), ("AID2", "g")]) == {
+        ("AID1", "g"): (1.0, True),
+        ("AID2", "g"): (3.0, True),
+    }
+
+
+def test_sqlite_store_keeps_first_detections_across_instances_with_any_fid(tmp_path):
+    path = str(tmp_path / "first_detections.db")
+    SQLiteFirstDetectionStore(path).put({("AID1", 1): (1.0, True), ("AID1", "1"): (2.0, False)})
+    SQLiteFirstDetectionStore(path).put({("AID1", "1"): (0.5, True)})
+    assert SQLiteFirstDetectionStore(path).get([("AID1", 1), ("AID1", "1"), ("AID2", 1)]) == {
+        ("AID1", 1): (1.0, True),
+        ("AID1", "1"): (0.5, True),
+    }
+
+
+def test_sqlite_store_gets_more_pairs_than_query_parameter_limit(tmp_path):
+    store = SQLiteFirstDetectionStore(str(tmp_path / "first_detections.db"))
+    store.put({(f"AID{i}", "g"): (float(i), True) for i in range(2000)})
+    assert len(store.get([(f"AID{i}", "g") for i in range(2001)])) == 2000
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_dubious_with_store_and_only_new_detections_is_same_as_from_full_history(kind, tmp_path):
+    store = _store(kind, tmp_path)
+    history, batch = _detections(50, new=False), _detections(30, start=50)
+    Corrector(history, first_detections=store).compute()
+
+    incremental = Corrector(batch, first_detections=store).dubious
+    stateless = Corrector(history + batch).dubious
+    assert (incremental == stateless[incremental.index]).all()
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_earlier_detection_replaces_first_detection_in_store(kind, tmp_path):
+    store = _store(kind, tmp_path)
+    corrector = Corrector(
+        [ztf_alert(candid="c2", mjd=2.0, extra_fields=ztf_extra_fields(distnr=2.0))], first_detections=store
+    )
+    assert store.get([("AID1", "g")]) == {}  # Only updated once the flags are computed
+    corrector.compute()
+    assert store.get([("AID1", "g")]) == {("AID1", "g"): (2.0, False)}
+
+    corrector = Corrector([ztf_alert(candid="c1", mjd=1.0)], first_detections=store)
+    assert not corrector.dubious["c1"]
+    assert store.get([("AID1", "g")]) == {("AID1", "g"): (1.0, True)}
+
+    later = Corrector(
+        [ztf_alert(candid="c3", mjd=3.0, extra_fields=ztf_extra_fields(distnr=2.0))], first_detections=store
+    )
+    assert later.dubious["c3"]  # Not corrected, but the first detection was
+    assert store.get([("AID1", "g")]) == {("AID1", "g"): (1.0, True)}
+
+
+def test_check_first_detections_finds_no_differences_with_full_history():
+    store, detections = MemoryFirstDetectionStore(), _detections(80)
+    Corrector(detections[:50], first_detections=store).compute()
+    ztf_detections = Corrector(detections)._detections
+    assert not ztf.check_first_detections(ztf_detections, store).any()
+
+
+def test_check_first_detections_finds_detections_with_different_first_detection_and_keeps_store():
+    store = MemoryFirstDetectionStore()
+    store.put({("AID1", "g"): (0.5, False)})
+    detections = Corrector([ztf_alert(candid="c1"), ztf_alert(candid="c2", fid="r")])._detections
+    assert ztf.check_first_detections(detections, store).tolist() == [True, False]
+    assert store.get([("AID1", "g"), ("AID1", "r")]) == {("AID1", "g"): (0.5, False)}
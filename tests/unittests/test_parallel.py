@@ -0,0 +1,59 @@
+import pytest
+
+from correction import Corrector
+from correction.core.accumulator import CoordinateAccumulator
+from correction.core.first_detections import MemoryFirstDetectionStore
+from correction.core.parallel import ShardedCorrector
+from tests.benchmarks.generator import generate_detections
+from tests.utils import atlas_alert
+
+
+@pytest.fixture(scope="module", params=[1, 3])
+def sharded_corrector(request):
+    sharded_corrector = ShardedCorrector(request.param)
+    yield sharded_corrector
+    sharded_corrector.shutdown()
+
+
+def _detections():
+    detections = generate_detections(200, per_aid=7)
+    # Mixed surveys and duplicated candids
+    return detections + [atlas_alert(candid=f"a{i}", aid=f"AID{i}", new=True) for i in range(5)] + detections[:3]
+
+
+def test_sharded_corrector_output_is_same_as_single_corrector(sharded_corrector):
+    detections = _detections()
+    corrector = Corrector(detections)
+    records, coords = sharded_corrector.correct(detections)
+    assert records == corrector.corrected_as_records()
+    assert coords == corrector.coordinates_as_records()
+    assert list(coords) == sorted(coords)
+
+
+def test_sharded_corrector_keeps_coordinate_sums_in_accumulator(sharded_corrector):
+    detections = _detections()
+    expected, accumulator = CoordinateAccumulator(), CoordinateAccumulator()
+    for batch in [detections[:100], detections]:
+        expected_coords = Corrector(batch).coordinates_as_records(expected)
+        _, coords = sharded_corrector.correct(batch, accumulator)
+        assert coords == expected_coords
+    aids = {detection["aid"] for detection in detections}
+    assert accumulator.store.get(aids) == expected.store.get(aids)
+
+
+def test_sharded_corrector_keeps_first_detections_in_store(sharded_corrector):
+    detections = _detections()
+    expected, store = MemoryFirstDetectionStore(), MemoryFirstDetectionStore()
+    for batch in [detections[100:], detections[:100]]:
+        expected_records = Corrector(batch, first_detections=expected).corrected_as_records()
+        records, _ = sharded_corrector.correct(batch, first_detections=store)
+        assert records == expected_records
+    keys = {(detection["aid"], detection["fid"]) for detection in detections}
+    assert store.get(keys) == expected.get(keys)
+
+
+def test_sharded_corrector_records_have_missing_values_as_none(sharded_corrector):
+    detections = _detections() + [atlas_alert(candid="nan", aid="AID0", e_mag=float("nan"), extra="value")]
+    records, _ = sharded_corrector.correct(detections)
+    assert records == Corrector(detections).corrected_as_records()
+    assert records[-1]["e_mag"] is None and records[0]["extra"] is None
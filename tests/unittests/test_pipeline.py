@@ -0,0 +1,106 @@
+import copy
+import threading
+import time
+from unittest import mock
+
+import pytest
+from confluent_kafka import TopicPartition
+
+from correction._step import CorrectionStep
+from correction._step.consumers import OffsetKafkaConsumer
+from tests.utils import ztf_alert, atlas_alert, non_detection
+
+
+def _batches(n):
+    batches = []
+    for i in range(n):
+        batches.append(
+            [
+                {
+                    "aid": f"AID{i}",
+                    "detections": [
+                        ztf_alert(aid=f"AID{i}", candid=f"{i}a", new=True),
+                        ztf_alert(aid=f"AID{i}", candid=f"{i}b", new=False, has_stamp=False),
+                    ],
+                    "non_detections": [non_detection(aid=f"AID{i}", oid="oid1", fid="g", mjd=1)],
+                },
+                {"aid": "AID", "detections": [atlas_alert(aid="AID", candid=f"{i}c", new=True)], "non_detections": []},
+            ]
+        )
+    return batches
+
+
+def _step(batches, pipeline=True, scribe_background=None):
+    config = {
+        "CONSUMER_CONFIG": {"CLASS": "correction._step.consumers.MemoryConsumer", "MESSAGES": batches},
+        "PRODUCER_CONFIG": {"CLASS": "correction._step.producers.MemoryProducer"},
+        "SCRIBE_PRODUCER_CONFIG": {"CLASS": "correction._step.producers.MemoryProducer"},
+        "PIPELINE_CONFIG": {"MAX_IN_FLIGHT": 1} if pipeline else None,
+        "SCRIBE_BACKGROUND_CONFIG": scribe_background,
+    }
+    return CorrectionStep(config=config)
+
+
+@pytest.mark.parametrize("scribe_background", [None, {"WORKERS": 2, "MAX_PENDING": 2, "CHUNK_SIZE": 1}])
+def test_pipelined_step_has_same_output_as_sequential_step(scribe_background, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batches = _batches(10)
+    sequential, pipelined = _step(copy.deepcopy(batches), False), _step(batches, True, scribe_background)
+    sequential.start()
+    pipelined.start()
+    assert pipelined.producer.messages == sequential.producer.messages
+    assert pipelined.scribe_producer.messages == sequential.scribe_producer.messages
+    assert pipelined.consumer.committed == list(range(1, 11))
+
+
+def test_pipelined_step_does_not_consume_too_far_ahead_of_production(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    step = _step(_batches(20))
+    release = threading.Event()
+    step.producer.produce_batch = mock.MagicMock(side_effect=lambda *args, **kwargs: release.wait())
+
+    thread = threading.Thread(target=step.start)
+    thread.start()
+    time.sleep(0.5)
+    # One batch in each stage (3) and up to one waiting between stages (2)
+    assert step.consumer.offsets() <= 5
+    assert step.consumer.committed == []
+    release.set()
+    thread.join(timeout=10)
+    assert step.consumer.committed == list(range(1, 21))
+
+
+def test_pipelined_step_raises_error_from_stages_without_committing_later_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    step = _step(_batches(5))
+    execute = step.execute
+    step.execute = mock.MagicMock(
+        side_effect=[execute(step.pre_execute(batch)) for batch in _batches(2)] + [ValueError]
+    )
+    step.tear_down = mock.MagicMock(wraps=step.tear_down)
+    with pytest.raises(ValueError):
+        step.start()
+    assert step.consumer.committed == [1, 2]
+    step.tear_down.assert_called_once()
+    assert not (tmp_path / "__SUCCESS__").exists()
+
+
+@mock.patch("apf.consumers.kafka.Consumer")
+def test_offset_kafka_consumer_commits_next_offset_for_each_partition_of_batch(mock_consumer):
+    consumer = OffsetKafkaConsumer({"PARAMS": {}, "TOPICS": ["topic"]})
+    messages = []
+    for partition, offset in [(0, 10), (1, 3), (0, 12), (0, 11)]:
+        message = mock.MagicMock()
+        message.error.return_value = None
+        message.topic.return_value, message.partition.return_value, message.offset.return_value = (
+            "topic",
+            partition,
+            offset,
+        )
+        messages.append(message)
+    consumer.messages = messages
+
+    offsets = consumer.offsets()
+    assert offsets == [TopicPartition("topic", 0, 13), TopicPartition("topic", 1, 4)]
+    consumer.commit_offsets(offsets)
+    mock_consumer.return_value.commit.assert_called_once_with(offsets=offsets, asynchronous=False)
@@ -0,0 +1,62 @@
+import io
+import json
+from unittest import mock
+
+import fastavro
+import pytest
+
+from correction._step.producers import BatchKafkaProducer, dumps
+from correction._step.settings import get_scribe_schema
+
+
+def test_dumps_is_same_as_json_once_decoded():
+    data = {"collection": "detection", "data": {"mag": 1.5, "flag": True, "parent_candid": None, "extra": {"a": 1}}}
+    assert json.loads(dumps(data)) == data
+
+
+@mock.patch("apf.producers.kafka.Producer")
+def test_batch_producer_sends_each_message_and_polls_once(mock_producer):
+    producer = BatchKafkaProducer({"PARAMS": {}, "TOPIC": "scribe", "SCHEMA": get_scribe_schema()})
+    messages = [{"payload": f"message {i}"} for i in range(5)]
+    producer.produce_batch(messages)
+
+    calls = mock_producer.return_value.produce.call_args_list
+    assert len(calls) == len(messages)
+    for message, call in zip(messages, calls):
+        assert call.args == ("scribe",)
+        assert next(fastavro.reader(io.BytesIO(call.kwargs["value"]))) == message
+    mock_producer.return_value.poll.assert_called_once_with(0)
+
+
+@mock.patch("apf.producers.kafka.Producer")
+def test_batch_producer_flushes_and_retries_when_queue_is_full(mock_producer):
+    mock_producer.return_value.produce.side_effect = [BufferError, None, None]
+    producer = BatchKafkaProducer({"PARAMS": {}, "TOPIC": "scribe", "SCHEMA": get_scribe_schema()})
+    producer.produce_batch([{"payload": "first"}, {"payload": "second"}])
+    assert mock_producer.return_value.produce.call_count == 3
+    mock_producer.return_value.flush.assert_called_once()
+
+
+@mock.patch("apf.producers.kafka.Producer")
+def test_batch_producer_flush_raises_error_if_messages_are_not_delivered(mock_producer):
+    mock_producer.return_value.flush.return_value = 2
+    producer = BatchKafkaProducer({"PARAMS": {}, "TOPIC": "scribe", "SCHEMA": get_scribe_schema()})
+    with pytest.raises(RuntimeError):
+        producer.flush(timeout=1)
+    mock_producer.return_value.flush.assert_called_with(1)
+    mock_producer.return_value.flush.return_value = 0
+
+
+@mock.patch("apf.producers.kafka.Producer")
+def test_batch_producer_serializes_each_message_if_schema_is_not_supported_by_encoder(mock_producer):
+    schema = {
+        "type": "record",
+        "name": "x",
+        "fields": [{"name": "e", "type": {"type": "enum", "name": "e", "symbols": ["A"]}}],
+    }
+    producer = BatchKafkaProducer({"PARAMS": {}, "TOPIC": "topic", "SCHEMA": schema})
+    producer.produce_batch([{"e": "A"}])
+
+    assert producer.encoder is None
+    value = mock_producer.return_value.produce.call_args.kwargs["value"]
+    assert next(fastavro.reader(io.BytesIO(value))) == {"e": "A"}
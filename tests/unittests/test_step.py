@@ -1,11 +1,18 @@
 import copy
 import json
+import subprocess
+import sys
 from copy import deepcopy
 from unittest import mock
 
-from correction._step import CorrectionStep
+import fastavro
+import numpy as np
+import pytest
 
-from tests.utils import ztf_alert, atlas_alert, non_detection
+from correction._step import CorrectionStep, settings
+from correction.core.corrector import Corrector
+
+from tests.utils import FakeProducer, correction_step, ztf_alert, atlas_alert, non_detection, ztf_extra_fields
 
 messages = [
     {
@@ -15,7 +22,10 @@ messages = [
     },
     {
         "aid": "AID2",
-        "detections": [ztf_alert(aid="AID2", candid="c", new=True), ztf_alert(aid="AID2", candid="d", has_stamp=False, new=True)],
+        "detections": [
+            ztf_alert(aid="AID2", candid="c", new=True),
+            ztf_alert(aid="AID2", candid="d", has_stamp=False, new=True),
+        ],
         "non_detections": [non_detection(aid="AID2", mjd=1, oid="oid1", fid=1)],
     },
     {"aid": "AID3", "detections": [atlas_alert(aid="AID3", candid="e", new=True)], "non_detections": []},
@@ -33,7 +43,10 @@ message4produce = [
         "aid": "AID2",
         "meanra": 1,
         "meandec": 1,
-        "detections": [ztf_alert(aid="AID2", candid="c", new=True), ztf_alert(aid="AID2", candid="d", has_stamp=False, new=True)],
+        "detections": [
+            ztf_alert(aid="AID2", candid="c", new=True),
+            ztf_alert(aid="AID2", candid="d", has_stamp=False, new=True),
+        ],
         "non_detections": [non_detection(aid="AID2", mjd=1, oid="oid1", fid=1)],
     },
     {
@@ -65,20 +78,49 @@ message4execute = {
 
 
 def test_pre_execute_formats_message_with_all_detections_and_non_detections():
-    formatted = CorrectionStep.pre_execute(messages)
+    formatted = correction_step().pre_execute(messages)
     assert "detections" in formatted
     assert formatted["detections"] == message4execute["detections"]
     assert "non_detections" in formatted
     assert formatted["non_detections"] == message4execute["non_detections"]
 
 
+def test_pre_execute_drops_duplicate_detections_across_messages_preferring_new():
+    batch = [
+        {
+            "detections": [ztf_alert(candid="a", new=False), ztf_alert(candid="b", new=True)],
+            "non_detections": [non_detection(oid="oid1", fid="g", mjd=1)],
+        },
+        {
+            "detections": [ztf_alert(candid="a", new=True), ztf_alert(candid="b", new=False)],
+            "non_detections": [non_detection(oid="oid1", fid="g", mjd=1), non_detection(oid="oid1", fid="g", mjd=2)],
+        },
+    ]
+    step = correction_step()
+    formatted = step.pre_execute(batch)
+    assert formatted["detections"] == [ztf_alert(candid="a", new=True), ztf_alert(candid="b", new=True)]
+    assert formatted["detections"][0] is batch[1]["detections"][0]
+    assert formatted["non_detections"] == [
+        non_detection(oid="oid1", fid="g", mjd=1),
+        non_detection(oid="oid1", fid="g", mjd=2),
+    ]
+    assert step.metrics["detections_dedup_ratio"] == 0.5
+    assert step.metrics["non_detections_dedup_ratio"] == pytest.approx(1 / 3)
+
+
+def test_pre_execute_reports_zero_dedup_ratio_for_empty_messages():
+    step = correction_step()
+    step.pre_execute([{"detections": [], "non_detections": []}])
+    assert step.metrics["detections_dedup_ratio"] == step.metrics["non_detections_dedup_ratio"] == 0
+
+
 @mock.patch("correction._step.step.Corrector")
 def test_execute_calls_corrector_for_detection_records_and_keeps_non_detections(mock_corrector):
-    formatted = CorrectionStep.execute(message4execute)
+    formatted = correction_step().execute(message4execute)
     assert "detections" in formatted
     assert "non_detections" in formatted
     assert formatted["non_detections"] == message4execute["non_detections"]
-    mock_corrector.assert_called_with(message4execute["detections"])
+    mock_corrector.assert_called_with(message4execute["detections"], first_detections=None)
     mock_corrector.return_value.corrected_as_records.assert_called_once()
 
 
@@ -88,7 +130,7 @@ def test_execute_removes_duplicate_non_detections(_):
     message4execute_copy["non_detections"] = (
         message4execute_copy["non_detections"] + message4execute_copy["non_detections"]
     )
-    formatted = CorrectionStep.execute(message4execute_copy)
+    formatted = correction_step().execute(message4execute_copy)
     assert "non_detections" in formatted
     assert formatted["non_detections"] == message4execute["non_detections"]
 
@@ -97,24 +139,35 @@ def test_execute_removes_duplicate_non_detections(_):
 def test_execute_works_with_empty_non_detections(_):
     message4execute_copy = deepcopy(message4execute)
     message4execute_copy["non_detections"] = []
-    formatted = CorrectionStep.execute(message4execute_copy)
+    formatted = correction_step().execute(message4execute_copy)
     assert "non_detections" in formatted
     assert formatted["non_detections"] == []
 
 
+@mock.patch("correction._step.step.Corrector")
+def test_execute_uses_coordinates_accumulator_if_available(mock_corrector):
+    accumulator = mock.MagicMock()
+    correction_step(coordinates_accumulator=accumulator).execute(message4execute)
+    mock_corrector.return_value.coordinates_as_records.assert_called_once_with(accumulator)
+
+
+@mock.patch("correction._step.step.Corrector")
+def test_execute_uses_first_detections_store_if_available(mock_corrector):
+    store = mock.MagicMock()
+    correction_step(first_detections=store).execute(message4execute)
+    mock_corrector.assert_called_once_with(message4execute["detections"], first_detections=store)
+
+
 def test_post_execute_calls_scribe_producer_for_each_detection():
     # To check the "new" flag is removed
     message4execute_copy = copy.deepcopy(message4execute)
     message4execute_copy["detections"] = [{k: v for k, v in det.items()} for det in message4execute_copy["detections"]]
 
-    class MockCorrectionStep(CorrectionStep):
-        def __init__(self):
-            self.scribe_producer = mock.MagicMock()
-            self.logger = mock.MagicMock()
-
-    step = MockCorrectionStep()
+    step = correction_step()
+    step.scribe_producer = FakeProducer()
     output = step.post_execute(copy.deepcopy(message4execute))
     assert output == message4execute_copy
+    payloads = [json.loads(message["payload"]) for message in step.scribe_producer.messages]
     for det in message4execute_copy["detections"]:
         if not det["new"]:  # does not write
             continue
@@ -125,7 +178,23 @@ def test_post_execute_calls_scribe_producer_for_each_detection():
             "data": {k: v for k, v in det.items() if k not in ["candid", "forced", "new"]},
             "options": {"upsert": True, "set_on_insert": not det["has_stamp"]},
         }
-        step.scribe_producer.produce.assert_any_call({"payload": json.dumps(data)})
+        assert data in payloads
+    assert len(payloads) == sum(det["new"] for det in message4execute_copy["detections"])
+
+
+def test_post_execute_produces_all_scribe_messages_in_a_single_batch():
+    step = correction_step()
+    step.scribe_producer = FakeProducer()
+    step.post_execute(copy.deepcopy(message4execute))
+    assert step.scribe_producer.calls == 1
+    assert step.scribe_producer.bytes > 0
+
+
+def test_post_execute_produces_scribe_messages_one_at_a_time_with_generic_producers():
+    step = correction_step()
+    step.scribe_producer = mock.MagicMock(spec=["produce"])
+    step.post_execute(copy.deepcopy(message4execute))
+    assert step.scribe_producer.produce.call_count == sum(det["new"] for det in message4execute["detections"])
 
 
 def test_pre_produce_unpacks_detections_and_non_detections_by_aid():
@@ -135,3 +204,141 @@ def test_pre_produce_unpacks_detections_and_non_detections_by_aid():
 
     formatted = CorrectionStep.pre_produce(message4execute_copy)
     assert formatted == message4produce
+
+
+def test_pre_produce_restores_nan_in_nullable_floats_without_changing_records():
+    message4execute_copy = copy.deepcopy(message4execute)
+    message4execute_copy["detections"][0]["mag_corr"] = None
+    message4execute_copy["detections"][2]["mag_corr"] = 1.0
+
+    formatted = CorrectionStep.pre_produce(message4execute_copy)
+    assert np.isnan(formatted[0]["detections"][0]["mag_corr"])
+    assert message4execute_copy["detections"][0]["mag_corr"] is None
+
+
+def test_pre_produce_keeps_none_in_nullable_floats_without_values_in_batch():
+    message4execute_copy = copy.deepcopy(message4execute)
+    for detection in message4execute_copy["detections"]:
+        detection["mag_corr"] = None
+
+    formatted = CorrectionStep.pre_produce(message4execute_copy)
+    assert all(detection["mag_corr"] is None for message in formatted for detection in message["detections"])
+
+
+def test_pre_produce_output_with_uncorrected_magnitudes_is_serialized_as_nan(tmp_path):
+    detections = [ztf_alert(candid="a", oid="OID", pid=1, parent_candid=None, new=True)]
+    detections.append(
+        ztf_alert(candid="b", oid="OID", pid=2, parent_candid=None, new=True, extra_fields=ztf_extra_fields(distnr=2.0))
+    )
+    corrector = Corrector(detections)
+    result = {"detections": corrector.corrected_as_records(), "coords": corrector.coordinates_as_records()}
+
+    formatted = CorrectionStep.pre_produce(result)
+    with open(tmp_path / "output.avro", "wb") as fh:
+        fastavro.writer(fh, settings.get_output_schema(), formatted)
+    with open(tmp_path / "output.avro", "rb") as fh:
+        (record,) = fastavro.reader(fh)
+    corrected, uncorrected = record["detections"]
+    assert corrected["corrected"] and not np.isnan(corrected["mag_corr"])
+    assert all(np.isnan(uncorrected[field]) for field in ["mag_corr", "e_mag_corr", "e_mag_corr_ext"])
+
+
+def test_pre_produce_output_with_nan_in_non_nullable_floats_is_serialized(tmp_path):
+    detections = [ztf_alert(candid="a", e_ra=np.nan, oid="OID", pid=1, parent_candid=None, new=True)]
+    detections.append(ztf_alert(candid="b", mag=np.nan, oid="OID", pid=2, parent_candid=None, new=True))
+    corrector = Corrector(detections)
+    result = {"detections": corrector.corrected_as_records(), "coords": corrector.coordinates_as_records()}
+
+    formatted = CorrectionStep.pre_produce(result)
+    assert result["detections"][0]["e_ra"] is None  # Records from the corrector are not modified
+    with open(tmp_path / "output.avro", "wb") as fh:
+        fastavro.writer(fh, settings.get_output_schema(), formatted)
+    with open(tmp_path / "output.avro", "rb") as fh:
+        (record,) = fastavro.reader(fh)
+    assert np.isnan(record["detections"][0]["e_ra"]) and np.isnan(record["detections"][1]["mag"])
+
+
+def test_pre_produce_works_without_non_detections():
+    message4execute_copy = copy.deepcopy(message4execute)
+    message4execute_copy["non_detections"] = []
+
+    formatted = CorrectionStep.pre_produce(message4execute_copy)
+    assert [msg["aid"] for msg in formatted] == ["AID1", "AID2", "AID3"]
+    assert all(msg["non_detections"] == [] for msg in formatted)
+
+
+def test_produce_scribe_removes_elasticc_extra_fields_without_modifying_detections():
+    detections = copy.deepcopy(message4execute["detections"])
+    detections[0]["extra_fields"] = {"diaObject": b"object", "prvDiaSources": b"sources", "kept": 1}
+    original = copy.deepcopy(detections)
+
+    step = correction_step()
+    step.scribe_producer = FakeProducer()
+    step.produce_scribe(detections)
+    assert detections == original
+    payload = json.loads(step.scribe_producer.messages[0]["payload"])
+    assert payload["data"]["extra_fields"] == {"kept": 1}
+    assert payload["criteria"] == {"_id": detections[0]["candid"]}
+
+
+def _step_with_local_producers(events, background_config=None):
+    config = {
+        "CONSUMER_CONFIG": {"CLASS": "tests.utils.FakeConsumer", "MESSAGES": [messages, messages], "EVENTS": events},
+        "PRODUCER_CONFIG": {"CLASS": "tests.utils.FakeProducer", "TOPIC": "correction", "EVENTS": events},
+        "SCRIBE_PRODUCER_CONFIG": {"CLASS": "tests.utils.FakeProducer", "TOPIC": "scribe", "EVENTS": events},
+        "SCRIBE_BACKGROUND_CONFIG": background_config,
+    }
+    return CorrectionStep(config=config)
+
+
+def test_step_with_background_scribe_commits_only_after_both_outputs_are_flushed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    events = []
+    step = _step_with_local_producers(events, {"WORKERS": 2, "MAX_PENDING": 2, "CHUNK_SIZE": 2})
+    step.start()
+
+    batches = [[]]
+    for event in events:
+        batches[-1].append(event)
+        if event == ("commit",):
+            batches.append([])
+    assert batches[-1] == []
+    for batch in batches[:-1]:  # The batch is consumed twice
+        assert batch[-3:-1] in [[("flush", "scribe"), ("flush", "correction")]]
+        produced = [event for event in batch if event[0] == "produce"]
+        assert sum(n for _, topic, n in produced if topic == "scribe") == 4  # New detections
+        assert sum(n for _, topic, n in produced if topic == "correction") == len(messages)
+    assert len(step.scribe_producer.messages) == 8
+
+
+def test_step_without_background_scribe_produces_scribe_before_commit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    events = []
+    step = _step_with_local_producers(events)
+    step.start()
+    assert [event[0] for event in events].count("commit") == 2
+    assert events[:2] == [("produce", "scribe", 4), ("commit",)]
+
+
+def test_unique_non_detections_keeps_first_occurrence_in_order():
+    non_detections = [
+        non_detection(aid="AID1", oid="oid1", fid="g", mjd=2, diffmaglim=1),
+        non_detection(aid="AID1", oid="oid1", fid="g", mjd=1, diffmaglim=2),
+        non_detection(aid="AID1", oid="oid1", fid="g", mjd=2, diffmaglim=3),
+        non_detection(aid="AID1", oid="oid1", fid="r", mjd=2, diffmaglim=4),
+        non_detection(aid="AID2", oid="oid2", fid="g", mjd=2, diffmaglim=5),
+    ]
+    unique = CorrectionStep._unique_non_detections(non_detections)
+    assert [nd["diffmaglim"] for nd in unique] == [1, 2, 4, 5]
+    assert unique[0] is non_detections[0]
+
+
+def test_importing_package_loads_corrector_only_when_used():
+    script = "import sys, correction; assert 'pandas' not in sys.modules; correction.Corrector; assert 'pandas' in sys.modules"
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def test_schemas_are_loaded_once():
+    assert settings.get_output_schema() is settings.get_output_schema()
+    assert settings.get_scribe_schema() is settings.get_scribe_schema()
+    assert settings.get_metrics_schema() is settings.get_metrics_schema()
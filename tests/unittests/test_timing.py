@@ -0,0 +1,102 @@
+import sys
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from correction.core import timing
+from correction.core.corrector import Corrector
+from correction._step.timings import StepObserver
+from tests.unittests.test_step import messages
+from tests.utils import correction_step, ztf_alert, atlas_alert
+
+
+class RecordingObserver(timing.Observer):
+    def __init__(self):
+        self.events = []
+
+    def enter(self, phase, survey):
+        self.events.append(("enter", phase, survey))
+
+    def exit(self, phase, survey, seconds):
+        assert seconds >= 0
+        self.events.append(("exit", phase, survey))
+
+    def count(self, phase, survey, rows):
+        self.events.append(("count", phase, survey, rows))
+
+
+@pytest.fixture
+def observer():
+    observer = RecordingObserver()
+    timing.set_observer(observer)
+    yield observer
+    timing.set_observer(None)
+
+
+def test_timed_does_nothing_without_observer():
+    assert timing.get_observer() is None
+    assert timing.timed("phase") is timing.timed("other", "ztf")
+    timing.count("phase", 1)
+
+
+def test_corrector_reports_phases_and_rows_by_survey(observer):
+    detections = [ztf_alert(candid="c1"), ztf_alert(candid="c2"), atlas_alert(candid="a1")]
+    corrector = Corrector(detections)
+    corrector.corrected_as_records()
+    corrector.mean_coordinates()
+
+    assert ("count", "corrector", "ztf", 2) in observer.events
+    assert ("count", "corrector", "atlas", 1) not in observer.events  # No strategy for ATLAS
+    assert observer.events[-6:] == [
+        ("enter", "corrected_as_records", ""),
+        ("enter", "strategy.evaluate", "ztf"),
+        ("exit", "strategy.evaluate", "ztf"),
+        ("exit", "corrected_as_records", ""),
+        ("enter", "mean_coordinates", ""),
+        ("exit", "mean_coordinates", ""),
+    ]
+
+
+def test_step_reports_its_phases(observer):
+    step = correction_step()
+    step.post_execute(step.execute(step.pre_execute(messages)))
+    step.pre_produce(step.execute(step.pre_execute(messages)))
+
+    phases = {event[1] for event in observer.events if event[0] == "exit"}
+    assert {"pre_execute", "corrector", "corrected_as_records", "mean_coordinates", "produce_scribe"} <= phases
+    assert "pre_produce" in phases
+
+
+def test_step_observer_reports_prometheus_histograms_and_counters():
+    observer = StepObserver(prometheus=True)
+    labels = {"phase": "test", "survey": "ztf"}
+    before = REGISTRY.get_sample_value("correction_phase_seconds_count", labels) or 0
+    observer.exit("test", "ztf", 0.5)
+    observer.count("test", "ztf", 3)
+    observer.count("test", "ztf", 2)
+
+    assert REGISTRY.get_sample_value("correction_phase_seconds_count", labels) == before + 1
+    assert REGISTRY.get_sample_value("correction_rows_total", labels) >= 5
+    StepObserver(prometheus=True)  # Metrics are registered only once
+
+
+def test_step_observer_restores_outer_pyroscope_tags_after_inner_phase():
+    pyroscope = mock.MagicMock()
+    with mock.patch.dict(sys.modules, {"pyroscope": pyroscope}):
+        observer = StepObserver(prometheus=False, pyroscope=True)
+    observer.enter("outer", "")
+    observer.enter("inner", "ztf")
+    observer.exit("inner", "ztf", 0.1)
+    observer.exit("outer", "", 0.2)
+
+    assert pyroscope.mock_calls == [
+        mock.call.add_thread_tag("phase", "outer"),
+        mock.call.remove_thread_tag("phase", "outer"),
+        mock.call.add_thread_tag("phase", "inner"),
+        mock.call.add_thread_tag("survey", "ztf"),
+        mock.call.remove_thread_tag("phase", "inner"),
+        mock.call.remove_thread_tag("survey", "ztf"),
+        mock.call.add_thread_tag("phase", "outer"),
+        mock.call.remove_thread_tag("phase", "outer"),
+    ]
@@ -2,6 +2,7 @@ from unittest import mock
 
 import numpy as np
 import pandas as pd
+import pytest
 
 from correction.core.strategy import ztf
 
@@ -39,6 +40,28 @@ def test_ztf_strategy_first_detection_with_close_source_splits_by_aid_and_fid(mo
     assert ~first_corrected[first_corrected.index.str.startswith("sn")].all()
 
 
+def test_ztf_strategy_first_detection_ties_in_mjd_go_to_earliest_detection():
+    detections = pd.DataFrame(
+        {"aid": ["AID1", "AID1", "AID1"], "fid": [1, 1, 1], "mjd": [2.0, 1.0, 1.0], "distnr": [0.1, 3.0, 0.1]},
+        index=["c1", "c2", "c3"],
+    )
+    assert not ztf.is_first_corrected(detections).any()
+    assert (ztf.is_first_corrected(detections.iloc[[0, 2, 1]])).all()
+
+
+def test_ztf_strategy_first_positions_are_same_as_groupby_idxmin():
+    rng = np.random.default_rng(42)
+    detections = pd.DataFrame(
+        {
+            "aid": rng.choice(["AID1", "AID2", "AID3"], 500),
+            "fid": rng.choice([1, 2], 500),
+            "mjd": rng.integers(0, 5, 500),
+        }
+    ).astype({"aid": "category", "mjd": float})
+    idxmin = detections.groupby(["aid", "fid"], observed=True)["mjd"].transform("idxmin")
+    assert (ztf._first_positions(detections) == idxmin.to_numpy()).all()
+
+
 @mock.patch("correction.core.strategy.ztf.is_corrected")
 @mock.patch("correction.core.strategy.ztf.is_first_corrected")
 def test_ztf_strategy_dubious_for_negative_difference_without_close_source(mock_first, mock_corrected):
@@ -138,3 +161,74 @@ def test_ztf_strategy_correction_with_null_nr_fields_results_in_null_corrections
     assert corrected["mag_corr"].isna().all()
     assert corrected["e_mag_corr"].isna().all()
     assert corrected["e_mag_corr_ext"].isna().all()
+
+
+def test_ztf_strategy_stellar_requires_sharpnr_within_both_limits():
+    detections = pd.DataFrame.from_records(
+        {"distnr": [1.0] * 3, "distpsnr1": [2.0] * 3, "sgscore1": [0.0] * 3, "chinr": [1.0] * 3, "sharpnr": [-1, 0, 1]}
+    )
+    stellar = ztf.is_stellar(detections)
+    assert (stellar == pd.Series([False, True, False])).all()
+
+
+def _random_detections(size):
+    rng = np.random.default_rng(42)
+    detections = pd.DataFrame(
+        {
+            "candid": [str(i) for i in range(size)],
+            "aid": rng.choice(["AID1", "AID2", "AID3"], size),
+            "fid": rng.choice([1, 2], size),
+            "mjd": rng.uniform(1, 100, size),
+            "mag": rng.uniform(10, 25, size),
+            "e_mag": rng.uniform(0, 1, size),
+            "isdiffpos": rng.choice([-1, 1], size),
+            "magnr": rng.uniform(10, 25, size),
+            "sigmagnr": rng.uniform(0, 1, size),
+            "distnr": rng.uniform(0, 3, size),
+            "distpsnr1": rng.uniform(0, 3, size),
+            "sgscore1": rng.uniform(0, 1, size),
+            "sharpnr": rng.uniform(-0.3, 0.3, size),
+            "chinr": rng.uniform(0, 4, size),
+        }
+    ).set_index("candid")
+    detections = detections.astype({"magnr": object, "sigmagnr": object})
+    detections.iloc[:5, detections.columns.get_loc("magnr")] = None
+    detections.iloc[5:10, detections.columns.get_loc("distnr")] = np.nan
+    return detections
+
+
+def test_ztf_strategy_evaluate_is_equivalent_to_separate_functions():
+    detections = _random_detections(200)
+    evaluated = ztf.evaluate(detections)
+
+    corrected = ztf.correct(detections)
+    assert (evaluated.index == detections.index).all()
+    for col in ["mag_corr", "e_mag_corr", "e_mag_corr_ext"]:
+        assert np.allclose(evaluated[col], corrected[col], equal_nan=True)
+    assert (evaluated["corrected"] == ztf.is_corrected(detections)).all()
+    assert (evaluated["dubious"] == ztf.is_dubious(detections)).all()
+    assert (evaluated["stellar"] == ztf.is_stellar(detections)).all()
+
+
+def test_ztf_strategy_evaluate_keeps_infinite_values_of_correction():
+    detections = _random_detections(1).assign(magnr=5.0, sigmagnr=2.0, mag=5.0, e_mag=0.1, isdiffpos=-1)
+    evaluated = ztf.evaluate(detections)
+    assert np.isinf(evaluated[["mag_corr", "e_mag_corr", "e_mag_corr_ext"]]).all().all()
+
+
+def test_ztf_strategy_evaluate_with_numba_engine_is_equivalent_to_numpy_engine():
+    pytest.importorskip("numba")
+    detections = _random_detections(200)
+    negative = detections.index[10:20]  # Zero flux results in infinite values
+    detections.loc[negative, "mag"] = detections.loc[negative, "magnr"].astype(float)
+    detections.loc[negative, "isdiffpos"] = -1
+
+    expected = ztf.evaluate(detections)
+    evaluated = ztf.evaluate(detections, engine="numba")
+
+    assert (evaluated.columns == expected.columns).all() and (evaluated.index == expected.index).all()
+    for col in ["mag_corr", "e_mag_corr", "e_mag_corr_ext"]:
+        # Same NaN and inf values. NumPy may use SIMD versions of power/log10 that differ from libm in the last bit
+        np.testing.assert_allclose(evaluated[col], expected[col], rtol=1e-12)
+    for col in ["corrected", "dubious", "stellar"]:
+        assert (evaluated[col] == expected[col]).all()
@@ -1,3 +1,9 @@
+import json
+from unittest import mock
+
+from correction._step import CorrectionStep
+
+
 def ztf_extra_fields(**kwargs):
     extra_fields = {
         "magnr": 10.0,
@@ -65,3 +71,70 @@ def non_detection(**kwargs):
     }
     alert.update(kwargs)
     return alert
+
+
+def as_columns(detections, extra_fields):
+    fields = [field for field in detections[0] if field != "extra_fields"] if detections else []
+    columns = {field: [det.get(field) for det in detections] for field in fields}
+    columns.update({field: [det["extra_fields"].get(field) for det in detections] for field in extra_fields})
+    return columns, [det["extra_fields"] for det in detections]
+
+
+class FakeProducer:
+    """Local stand-in for a producer that keeps the produced messages, counting calls and (JSON) bytes.
+
+    If the configuration has a list in `EVENTS`, produced batches and flushes are appended to it.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.messages = []
+        self.calls = 0
+        self.bytes = 0
+        self.key_field = None
+
+    def set_key_field(self, key_field):
+        self.key_field = key_field
+
+    def produce(self, message=None, **kwargs):
+        self.produce_batch([message])
+
+    def produce_batch(self, messages, **kwargs):
+        self.calls += 1
+        self.messages.extend(messages)
+        self.bytes += sum(len(json.dumps(message).encode()) for message in messages)
+        self.config.get("EVENTS", []).append(("produce", self.config.get("TOPIC"), len(messages)))
+
+    def flush(self):
+        self.config.get("EVENTS", []).append(("flush", self.config.get("TOPIC")))
+
+
+class FakeConsumer:
+    """Local stand-in for a consumer that yields the batches in `MESSAGES`, appending commits to `EVENTS`"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def consume(self):
+        yield from self.config["MESSAGES"]
+
+    def commit(self):
+        self.config.get("EVENTS", []).append(("commit",))
+
+
+def correction_step(**attributes) -> CorrectionStep:
+    """Step with only the state used by its methods (no consumer, metrics or Kafka producers), to call them directly.
+
+    Optional features (accumulators, shards, background scribe, etc.) are disabled and both producers are
+    `FakeProducer`. Any attribute can be replaced with the keyword arguments (e.g., `coordinates_accumulator`).
+    """
+    step = CorrectionStep.__new__(CorrectionStep)
+    step.config = {}
+    step.producer, step.scribe_producer = FakeProducer(), FakeProducer()
+    step.coordinates_accumulator, step.first_detections = None, None
+    step.sharded_corrector, step.scribe_tasks, step.scribe_chunk_size = None, None, None
+    step.commit, step.commit_after_produce = False, False
+    step.metrics, step.logger = {}, mock.MagicMock()
+    for name, value in attributes.items():
+        setattr(step, name, value)
+    return step